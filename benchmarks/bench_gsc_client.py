@@ -0,0 +1,60 @@
+"""
+bench_gsc_client.py - Search Console クライアントの作成時間を比べる（ネットワーク不要）
+
+usage: python benchmarks/bench_gsc_client.py [--calls 200]
+
+  build()               : 以前の実装。呼ぶたびに同梱のディスカバリ文書を読み込んでパースする
+  build_from_document() : 読み込み済みのディスカバリ文書から毎回作る
+  get_gsc_service()     : 現在の実装。スレッドごとに作ったものを使い回す
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# 認証情報はダミー（クライアントの作成だけならトークンの取得は走らない）
+os.environ.setdefault("GSC_REFRESH_TOKEN", "dummy")
+os.environ.setdefault("GSC_CLIENT_ID", "dummy")
+os.environ.setdefault("GSC_CLIENT_SECRET", "dummy")
+
+from googleapiclient.discovery import build
+
+import ga4_api
+
+
+def timeit(fn, calls):
+    times = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    ga4_api.load_gsc_discovery_doc()
+    print(f"discovery doc load (1回目のみ): {(time.perf_counter() - t0) * 1000:.2f} ms\n")
+
+    creds = ga4_api.get_gsc_credentials()
+    cases = {
+        "build()": lambda: build("searchconsole", "v1", credentials=creds),
+        "build_from_document()": ga4_api.create_gsc_service,
+        "get_gsc_service()": ga4_api.get_gsc_service,
+    }
+    print(f"{'client':<24}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for name, fn in cases.items():
+        times = sorted(timeit(fn, args.calls))
+        p95 = times[int(len(times) * 0.95) - 1]
+        print(f"{name:<24}{statistics.median(times) * 1000:>10.3f}{p95 * 1000:>10.3f}{sum(times):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
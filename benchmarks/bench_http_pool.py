@@ -0,0 +1,102 @@
+"""
+bench_http_pool.py - requests.post（毎回接続）と共有 Session（keep-alive）の1回あたりの遅延を比べる
+
+usage: python benchmarks/bench_http_pool.py [--calls 200] [--threads 8] [--handshake-ms 30]
+
+ローカルにスタブの Ads API（HTTP/1.1 keep-alive）を立てて googleAds:search 相当の POST を投げる。
+TLS は使わないので、新規接続時に --handshake-ms だけ待たせて TCP + TLS ハンドシェイクの代わりにする。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import http_utils
+
+RESPONSE_BODY = json.dumps({"results": [
+    {"segments": {"month": "2025-03-01"}, "metrics": {"costMicros": "1000000", "clicks": "10"}}
+] * 20}).encode()
+
+
+class StubAdsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文を別々に書くので、Nagle と遅延ACKで keep-alive 側だけ ~40ms 待たされないようにする
+    disable_nagle_algorithm = True
+    handshake_ms = 0
+
+    def setup(self):
+        # 新しい接続ごとに1回だけ（TLSハンドシェイク相当）
+        time.sleep(self.handshake_ms / 1000)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(handshake_ms):
+    StubAdsHandler.handshake_ms = handshake_ms
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAdsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(post, url, calls, threads):
+    body = {"query": "SELECT segments.month, metrics.cost_micros FROM campaign"}
+
+    def one(_):
+        t0 = time.perf_counter()
+        resp = post(url, json=body, headers={"developer-token": "x"})
+        resp.json()
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(one, range(calls)))
+    return latencies, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--handshake-ms", type=float, default=30)
+    args = ap.parse_args()
+
+    server = start_stub(args.handshake_ms)
+    url = f"http://127.0.0.1:{server.server_address[1]}/v20/customers/123/googleAds:search"
+    session = http_utils.create_session(pool_size=args.threads)
+
+    print(f"calls={args.calls} threads={args.threads} handshake={args.handshake_ms}ms\n")
+    print(f"{'client':<16}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for name, post in (("requests.post", requests.post), ("shared session", session.post)):
+        latencies, total = run(post, url, args.calls, args.threads)
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{name:<16}{statistics.median(latencies) * 1000:>10.2f}{p95 * 1000:>10.2f}{total:>10.2f}")
+
+    print("\nshared session pool:")
+    for host, stats in http_utils.pool_stats(session).items():
+        print(f"  {host} {stats}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+bench_import.py - ga4_api の起動コスト（import 時間・RSS）を -X importtime で計測する
+
+usage: python benchmarks/bench_import.py [--repeat 5] [--top 15]
+
+それぞれ新しいプロセスで import ga4_api → /health を1回呼ぶまでを計測する。
+  lazy  : 現在のコード（Google系クライアントは初回使用時に import）
+  eager : 同じプロセスで先に Google系クライアントを import しておく（以前の起動時 import 相当）
+  ga4   : lazy のあと create_ga4_client 相当の import まで済ませる（GA4を使うワーカーの実コスト）
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+EAGER_IMPORTS = """
+import google.analytics.data_v1beta
+import google.analytics.data_v1beta.types
+import google.oauth2.service_account
+import google.oauth2.credentials
+import googleapiclient.discovery
+"""
+
+CHILD = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+{pre}
+import ga4_api
+{post}
+resp = ga4_api.app.test_client().get('/health')
+assert resp.status_code == 200, resp.status_code
+elapsed = time.perf_counter() - t0
+print(json.dumps({{"seconds": elapsed, "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "modules": len(sys.modules)}}), file=sys.stdout)
+"""
+
+SCENARIOS = {
+    "lazy": ("", ""),
+    "eager": (EAGER_IMPORTS, ""),
+    "ga4": ("", EAGER_IMPORTS),
+}
+
+
+def run_child(pre, post, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", CHILD.format(pre=pre, post=post)]
+    # ウォームアップは走らせない（/health だけのプロセスを測る）
+    env = dict(os.environ, WARMUP_PROVIDERS="")
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力を [(モジュール, self_us, cumulative_us, depth)] にする"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def summarize_packages(entries):
+    """トップレベルパッケージごとの self 時間の合計（ms）"""
+    totals = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        package = name.split(".")[0]
+        if package == "google" and name.count(".") >= 1:
+            package = ".".join(name.split(".")[:2])
+        totals[package] += self_us
+    return sorted(((pkg, us / 1000) for pkg, us in totals.items()), key=lambda x: -x[1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--top", type=int, default=15)
+    args = ap.parse_args()
+
+    print(f"{'scenario':<10}{'boot ms':>10}{'RSS MB':>10}{'modules':>10}")
+    for name, (pre, post) in SCENARIOS.items():
+        runs = [run_child(pre, post)[0] for _ in range(args.repeat)]
+        boot = statistics.median(r["seconds"] for r in runs) * 1000
+        rss = statistics.median(r["maxrss_kb"] for r in runs) / 1024
+        print(f"{name:<10}{boot:>10.1f}{rss:>10.1f}{runs[0]['modules']:>10}")
+
+    for name in ("lazy", "eager"):
+        _, stderr = run_child(*SCENARIOS[name], importtime=True)
+        entries = parse_importtime(stderr)
+        print(f"\n[{name}] self time by package (ms)")
+        for pkg, ms in summarize_packages(entries)[:args.top]:
+            print(f"  {pkg:<36}{ms:>8.1f}")
+        print(f"[{name}] top-level imports by cumulative time (ms)")
+        top = sorted((e for e in entries if e[3] == 0), key=lambda e: -e[2])[:args.top]
+        for module, _, cumulative_us, _ in top:
+            print(f"  {module:<36}{cumulative_us / 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
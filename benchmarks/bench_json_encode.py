@@ -0,0 +1,113 @@
+"""
+bench_json_encode.py - /ga4/monthly 相当のペイロードでJSONエンコードと圧縮を計測する
+
+usage: python benchmarks/bench_json_encode.py [--months 12] [--cities 300] [--pages 3000] [--repeat 5]
+
+  encoder : Flask標準（ensure_ascii=True, sort_keys=True） / FastJSONProvider（orjson）
+  bytes   : 非圧縮 / gzip / br / zstd（インストールされているもののみ）
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import format_utils
+
+CITY_NAMES = ["Kawaguchi", "Saitama", "Koshigaya", "Soka", "Kasukabe", "Tokorozawa", "Kawagoe", "Ageo"]
+SOURCES = [("google", "organic"), ("(direct)", "(none)"), ("google", "cpc"), ("yahoo", "organic"),
+           ("instagram", "referral"), ("line", "social"), ("bing", "organic"), ("ameblo.jp", "referral")]
+
+
+def make_monthly_payload(months=12, cities=300, pages=3000, rng=None):
+    """get_monthly のレスポンスと同じ形のペイロードを作る"""
+    rng = rng or random.Random(0)
+    yms = [f"{2024 + (i // 12)}-{i % 12 + 1:02d}" for i in range(months)]
+    city_list = [f"{CITY_NAMES[i % len(CITY_NAMES)]}{i // len(CITY_NAMES) or ''}" for i in range(cities)]
+    page_list = [f"/works/{i}/" if i % 3 else f"/column/外壁塗装-{i}/" for i in range(pages)]
+    return {
+        "success": True, "property_id": "123456789",
+        "start_date": f"{yms[0]}-01", "end_date": f"{yms[-1]}-28",
+        "monthly_summary": [{
+            "year_month": ym, "sessions": rng.randint(1000, 9000), "active_users": rng.randint(800, 7000),
+            "pageviews": rng.randint(3000, 30000), "bounce_rate": round(rng.random(), 4),
+            "average_session_duration": round(rng.uniform(30, 200), 1), "key_events": rng.randint(0, 50),
+        } for ym in yms],
+        "monthly_sources": [{
+            "year_month": ym, "source": s, "medium": m,
+            "sessions": rng.randint(1, 3000), "users": rng.randint(1, 2500),
+        } for ym in yms for s, m in SOURCES],
+        "monthly_cities": [{
+            "year_month": ym, "city": c, "sessions": rng.randint(1, 500), "users": rng.randint(1, 400),
+        } for ym in yms for c in city_list],
+        "monthly_devices": [{
+            "year_month": ym, "device": d, "sessions": rng.randint(1, 5000),
+            "users": rng.randint(1, 4000), "engagement_rate": round(rng.random(), 4),
+        } for ym in yms for d in ("mobile", "desktop", "tablet")],
+        "monthly_pages": [{
+            "year_month": ym, "page_path": p, "pageviews": rng.randint(1, 2000),
+            "users": rng.randint(1, 1500), "avg_session_duration": round(rng.uniform(0, 300), 1),
+        } for ym in yms for p in page_list],
+        "monthly_city_sources": [{
+            "year_month": ym, "city": c, "source": s, "medium": m,
+            "sessions": rng.randint(1, 200), "users": rng.randint(1, 150),
+        } for ym in yms for c in city_list[: cities // 3] for s, m in SOURCES],
+    }
+
+
+def timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return out, statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--months", type=int, default=12)
+    ap.add_argument("--cities", type=int, default=300)
+    ap.add_argument("--pages", type=int, default=3000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    payload = make_monthly_payload(args.months, args.cities, args.pages)
+    rows = sum(len(v) for v in payload.values() if isinstance(v, list))
+    print(f"payload: {rows:,} rows")
+
+    app = Flask(__name__)
+    # jsonify と同じく provider.response() でレスポンスボディを作るまでを計測する
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = format_utils.FastJSONProvider(app)
+    encoders = {
+        "flask-default": lambda: default_provider.response(payload).get_data(),
+        "fast-provider": lambda: fast_provider.response(payload).get_data(),
+    }
+    if format_utils.orjson is None:
+        print("(orjson 未インストール: fast-provider は標準jsonにフォールバック)")
+
+    print(f"\n{'encoder':<16}{'encode ms':>12}{'bytes':>14}")
+    bodies = {}
+    for name, fn in encoders.items():
+        body, t = timeit(fn, args.repeat)
+        bodies[name] = body
+        print(f"{name:<16}{t * 1000:>12.1f}{len(body):>14,}")
+
+    print(f"\n{'encoder':<16}{'encoding':<10}{'compress ms':>12}{'bytes':>14}{'ratio':>8}")
+    for name, body in bodies.items():
+        for enc, fn in format_utils.COMPRESSORS.items():
+            if fn is None:
+                continue
+            out, t = timeit(lambda: format_utils.compress(body, enc), args.repeat)
+            print(f"{name:<16}{enc:<10}{t * 1000:>12.1f}{len(out):>14,}{len(body) / len(out):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
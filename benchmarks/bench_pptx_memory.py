@@ -0,0 +1,135 @@
+"""
+bench_pptx_memory.py - prs.save と逐次書き出し（generate の stream=True）のピークRSSを比べる（ネットワーク不要）
+
+usage: python benchmarks/bench_pptx_memory.py [--slides 60] [--concurrency 1,4] [--scale small] [--json result.json]
+
+synth_data の合成データから generate() の入力を作り、商圏GSCのクエリ行を増やして --slides 枚のデッキにする
+（P7.5 は8行ごとに続きのスライドを足す）。
+モード（save / stream）と同時生成数の組み合わせごとに子プロセスで実行し、
+生成前のRSS・ピークRSS（ru_maxrss。kaleido の Chromium サブプロセスは含まない）・その差、
+1回あたりの時間、スライド数、ファイルサイズを出す。
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import synth_data
+from bench_suite import install_stubs
+
+MODES = ("save", "stream")
+# P1・P2（テンプレートのまま）と P3〜P17（P7.5 は1枚目だけ）
+FIXED_SLIDES = 18
+AREA_ROWS_PER_SLIDE = 8
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def deck_input(prop, slides):
+    """当月の商圏GSCのクエリを増やして slides 枚のデッキになる generate() の入力"""
+    data = synth_data.report_input(prop)
+    month = data["gsc_area_monthly"][0]
+    queries = [q for area in month["areas"] for q in area["queries"]]
+    rows = max(slides - FIXED_SLIDES + 1, 1) * AREA_ROWS_PER_SLIDE
+    month["areas"] = [{
+        "area": month["areas"][0]["area"],
+        "queries": [dict(queries[i % len(queries)], query=f"{queries[i % len(queries)]['query']} {i // len(queries) + 1}")
+                    for i in range(rows)],
+    }]
+    return data
+
+
+def run_child(args):
+    from pptx import Presentation
+
+    import build_report
+    import ga4_api
+    import plot_utils
+
+    prop = synth_data.SyntheticProperty(args.scale)
+    install_stubs(prop, os.getcwd())
+    data = deck_input(prop, args.slides)
+    # テンプレートの読み込みと kaleido の起動は計測の前に済ませる
+    Presentation(ga4_api.TEMPLATE_PATH)
+    plot_utils.warm_up()
+    base_rss = rss_mb()
+
+    stream = args.child == "stream"
+    outputs = [os.path.join(os.getcwd(), f"deck_{i}.pptx") for i in range(args.concurrency)]
+
+    def one(path):
+        started = time.perf_counter()
+        build_report.generate(data, ga4_api.TEMPLATE_PATH, path, stream=stream)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        seconds = list(pool.map(one, outputs))
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "mode": args.child,
+        "concurrency": args.concurrency,
+        "slides": len(Presentation(outputs[0]).slides),
+        "seconds": max(seconds),
+        "base_rss_mb": base_rss,
+        "peak_rss_mb": peak_rss,
+        "delta_mb": peak_rss - base_rss,
+        "file_kb": os.path.getsize(outputs[0]) / 1024,
+    }))
+
+
+def run_case(mode, concurrency, args):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", mode, "--concurrency", str(concurrency),
+           "--slides", str(args.slides), "--scale", args.scale]
+    with tempfile.TemporaryDirectory(prefix="bench_pptx_memory_") as workdir:
+        proc = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True,
+                              env=dict(os.environ, WARMUP_PROVIDERS="", TRACE_EXPORTER=""))
+    if proc.returncode != 0:
+        return {"mode": mode, "concurrency": concurrency, "error": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--slides", type=int, default=60)
+    ap.add_argument("--concurrency", default="1,4", help="同時に生成するデッキ数（カンマ区切りで複数）")
+    ap.add_argument("--scale", default="small", choices=list(synth_data.SCALES))
+    ap.add_argument("--json", help="結果をJSONで保存する")
+    ap.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        args.concurrency = int(args.concurrency)
+        run_child(args)
+        return
+
+    print(f"slides={args.slides} scale={args.scale}\n")
+    print(f"{'mode':<8}{'conc':>5}{'slides':>8}{'sec':>8}{'base MB':>10}{'peak MB':>10}{'delta MB':>10}{'file KB':>10}")
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for mode in MODES:
+            r = run_case(mode, concurrency, args)
+            results.append(r)
+            if "error" in r:
+                print(f"{mode:<8}{concurrency:>5}  error: {r['error']}")
+                continue
+            print(f"{mode:<8}{concurrency:>5}{r['slides']:>8}{r['seconds']:>8.2f}{r['base_rss_mb']:>10.0f}"
+                  f"{r['peak_rss_mb']:>10.0f}{r['delta_mb']:>10.1f}{r['file_kb']:>10.0f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+bench_suite.py - 上流APIをスタブにして全ルートと build_report.generate を計測する（ネットワーク不要）
+
+usage: python benchmarks/bench_suite.py [--sizes small,medium,large] [--only ga4/monthly] [--repeat 10]
+                                        [--heavy-repeat 3] [--concurrency 4] [--upstream-ms 0]
+                                        [--json result.json] [--baseline base.json] [--max-regression 1.2]
+                                        [--months 24 --cities 2000 ...]
+
+GA4 / GSC / Ads の応答は synth_data.py の合成データ（サイズは synth_data.SCALES、--months などで上書き）
+から作り、プロセス内のスタブで返す。
+  GA4 : BetaAnalyticsDataClient の代わり。レスポンスをシリアライズしたバイト列で保持し、
+        呼び出しのたびにパースして返す（gRPC クライアントのデシリアライズ相当）
+  GSC : build_from_document に渡す httplib2 互換の http（googleapiclient の処理はそのまま通る）
+  Ads : 共有 Session の googleads / oauth2 宛てのリクエストに応答するトランスポートアダプタ
+--upstream-ms で上流1回ごとの待ち時間を足せる（既定0: アプリ側の処理だけを測る）。
+
+ケースごとに子プロセスで実行し、p50 / p90 / p99 レイテンシ、--concurrency 並列時のスループット、
+ピークRSS（kaleido の Chromium サブプロセスは含まない）を出す。
+--json で結果を保存し、--baseline で前回の結果と p50 を比べる（--max-regression 倍を超えたら終了コード1）。
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import synth_data
+from synth_data import CUSTOMER_ID, MCC_ID, PROPERTY_ID, SITE_URL
+
+# 管理用ルート（/metrics・/debug/http-pool・/admin/*）に付けるトークン
+ADMIN_TOKEN = "bench-admin-token"
+
+
+def make_stub_template(path):
+    """template.pptx が無い環境用の代わりのテンプレート（4:3・3枚・タイトル 1）"""
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    prs = Presentation()
+    prs.slide_width, prs.slide_height = Inches(7.5), Inches(5.62)
+    for _ in range(3):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.name = "タイトル 1"
+    prs.save(path)
+
+
+def install_stubs(prop, workdir, upstream_ms=0, cache=False):
+    """synth_data.install に加えて、テンプレート・出力先・キャッシュ・ウォームアップをベンチマーク用にする"""
+    ga4_api = synth_data.install(prop, upstream_ms)
+    ga4_api.ADMIN_TOKEN = ADMIN_TOKEN
+
+    if not cache:
+        ga4_api.ga4_report_cache.ttl = 0
+
+    if not os.path.exists(ga4_api.TEMPLATE_PATH):
+        ga4_api.TEMPLATE_PATH = os.path.join(workdir, "template.pptx")
+        make_stub_template(ga4_api.TEMPLATE_PATH)
+    ga4_api.GENERATED_FILES_DIR = os.path.join(workdir, "generated_reports")
+
+    import profile_utils
+    profile_utils.PROFILE_DIR = os.path.join(workdir, "profiles")
+
+    # /ready 用（ウォームアップの各ステップは実行しない）
+    ga4_api.WARMUP_PROVIDERS = set()
+    ga4_api.warm_up()
+
+
+# ============================================================
+# ケース
+# ============================================================
+Case = namedtuple("Case", "name method path body heavy", defaults=(None, False))
+# /admin/profiles* のケースで返すプロファイル（prepare で PROFILE_DIR に書く）
+BENCH_PROFILE = "20250101T000000_bench.folded"
+BENCH_PROFILES = 20
+
+
+def report_data(client, prop):
+    resp = client.post("/report-data", json=prop.report_params())
+    return resp.get_json()["report_data"]
+
+
+def build_cases(prop):
+    """ルートごとのリクエスト（body が関数なら準備時に test_client を渡して作る）"""
+    period = {"start_date": prop.start_date, "end_date": prop.end_date}
+    ga4 = urlencode({"property_id": PROPERTY_ID, **period})
+    gsc = urlencode({"site_url": SITE_URL, **period})
+    ads = urlencode({"customer_id": CUSTOMER_ID, **period})
+    start, end = date.fromisoformat(prop.start_date), date.fromisoformat(prop.end_date)
+    compare = urlencode({"compare_start_date": prop.start_date, "compare_end_date": (start + (end - start) / 2).isoformat()})
+    return [
+        Case("GET /", "GET", "/"),
+        Case("GET /health", "GET", "/health"),
+        Case("GET /ready", "GET", "/ready"),
+        Case("GET /metrics", "GET", "/metrics"),
+        Case("GET /debug/http-pool", "GET", "/debug/http-pool"),
+        Case("GET /ga4/sessions", "GET", f"/ga4/sessions?{ga4}"),
+        Case("GET /ga4/comprehensive", "GET", f"/ga4/comprehensive?{ga4}"),
+        Case("GET /ga4/comprehensive compare", "GET", f"/ga4/comprehensive?{ga4}&{compare}"),
+        Case("GET /ga4/monthly", "GET", f"/ga4/monthly?{ga4}"),
+        Case("GET /ga4/monthly columnar", "GET", f"/ga4/monthly?{ga4}&format=columnar"),
+        Case("GET /ga4/monthly ndjson", "GET", f"/ga4/monthly?{ga4}&format=ndjson"),
+        Case("GET /ga4/monthly pivot", "GET", f"/ga4/monthly?{ga4}&mode=pivot"),
+        Case("GET /ga4/key-events", "GET", f"/ga4/key-events?{ga4}"),
+        Case("GET /gsc/queries", "GET", f"/gsc/queries?{gsc}&limit=100"),
+        Case("GET /gsc/pages", "GET", f"/gsc/pages?{gsc}&limit=100"),
+        Case("GET /gsc/monthly", "GET", f"/gsc/monthly?{gsc}"),
+        Case("POST /gsc/area_queries", "POST", "/gsc/area_queries",
+             {"site_url": SITE_URL, **period, "areas": prop.areas}),
+        Case("GET /google-ads/debug", "GET", f"/google-ads/debug?customer_id={CUSTOMER_ID}"),
+        Case("GET /google-ads/campaigns", "GET", f"/google-ads/campaigns?{ads}"),
+        Case("GET /google-ads/keywords", "GET", f"/google-ads/keywords?{ads}&limit=100"),
+        Case("GET /ads/performance", "GET", f"/ads/performance?{ads}"),
+        Case("GET /ads/mcc-performance", "GET", f"/ads/mcc-performance?{urlencode({'mcc_id': MCC_ID, **period})}"),
+        Case("POST /report-data", "POST", "/report-data", prop.report_params()),
+        Case("POST /bulk/report-data", "POST", "/bulk/report-data", {
+            **period, "stores": [{**prop.report_params(str(100000000 + i)), "store_id": i}
+                                 for i in range(prop.params["stores"])]}, heavy=True),
+        Case("POST /generate_report", "POST", "/generate_report", report_data, heavy=True),
+        Case("GET /files/<filename>", "GET", "/files/bench_download.pptx"),
+        Case("GET /admin/profiles", "GET", "/admin/profiles"),
+        Case("GET /admin/profiles/<name>", "GET", f"/admin/profiles/{BENCH_PROFILE}"),
+        Case("build_report.generate", None, None, report_data, heavy=True),
+    ]
+
+
+def uncovered_routes(cases):
+    """ケースが1つも無い app.url_map のルール（static を除く）。ルートを足したらケースも足す"""
+    from urllib.parse import urlsplit
+
+    import ga4_api
+
+    adapter = ga4_api.app.url_map.bind("localhost")
+    covered = {adapter.match(urlsplit(c.path).path, method=c.method)[0] for c in cases if c.method}
+    return sorted(rule.rule for rule in ga4_api.app.url_map.iter_rules()
+                  if rule.endpoint != "static" and rule.endpoint not in covered)
+
+
+def write_bench_profiles(profile_dir):
+    """/admin/profiles* 用に BENCH_PROFILES 件のプロファイル（.folded とメタデータ）を書く"""
+    os.makedirs(profile_dir, exist_ok=True)
+    for i in range(BENCH_PROFILES):
+        name = BENCH_PROFILE if i == 0 else f"20250101T0000{i:02d}_bench.folded"
+        with open(os.path.join(profile_dir, name), "w", encoding="utf-8") as fh:
+            fh.writelines(f"ga4_api.py:get_monthly;ga4_utils.py:run_specs;frame{j} {j + 1}\n" for j in range(200))
+        with open(os.path.join(profile_dir, name + ".json"), "w", encoding="utf-8") as fh:
+            json.dump({"name": name, "route": "/ga4/monthly", "method": "GET", "mode": "sample",
+                       "trigger": "slow", "duration_ms": 1000.0, "status": 200}, fh)
+
+
+def prepare(case, client, prop, workdir):
+    """1回分のリクエストを実行する関数を返す（戻り値はステータスコード）"""
+    import ga4_api
+
+    body = case.body(client, prop) if callable(case.body) else case.body
+
+    if case.name == "build_report.generate":
+        import build_report
+        out_path = os.path.join(workdir, "bench_generate.pptx")
+
+        def generate(_client):
+            build_report.generate(body, io.BytesIO(ga4_api.load_template_bytes()), out_path)
+            return 200
+
+        return generate
+
+    path = case.path
+    if case.name == "GET /files/<filename>":
+        os.makedirs(ga4_api.GENERATED_FILES_DIR, exist_ok=True)
+        filename = os.path.basename(path)
+        with open(ga4_api.TEMPLATE_PATH, "rb") as src, open(os.path.join(ga4_api.GENERATED_FILES_DIR, filename), "wb") as dst:
+            dst.write(src.read())
+    if case.name.startswith("GET /admin/profiles"):
+        import profile_utils
+        write_bench_profiles(profile_utils.PROFILE_DIR)
+
+    def call(client):
+        resp = client.open(path, method=case.method, json=body, headers={"X-Admin-Token": ADMIN_TOKEN})
+        resp.get_data()  # ストリーミングのレスポンスも最後まで読む
+        resp.close()
+        return resp.status_code
+
+    return call
+
+
+# ============================================================
+# 計測（子プロセス）
+# ============================================================
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q * (len(values) - 1))))]
+
+
+def rss_mb():
+    with open("/proc/self/statm") as fh:
+        return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def run_child(args):
+    workdir = os.getcwd()
+    prop = synth_data.SyntheticProperty(args.size, **synth_data.scale_overrides(args))
+    install_stubs(prop, workdir, args.upstream_ms, args.cache)
+
+    import ga4_api
+    case = {c.name: c for c in build_cases(prop)}[args.child]
+    client = ga4_api.app.test_client()
+    call = prepare(case, client, prop, workdir)
+    repeat = args.heavy_repeat if case.heavy else args.repeat
+
+    # 1回目（スタブの応答の生成・import・kaleido の起動）は計測しない
+    status = call(client)
+    base_rss = rss_mb()
+
+    latencies = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        call(client)
+        latencies.append(time.perf_counter() - t0)
+
+    # 並列時のスループット（スレッドごとに test_client を作る）
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "client"):
+            local.client = ga4_api.app.test_client()
+        return call(local.client)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(one, range(repeat)))
+    wall = time.perf_counter() - t0
+
+    print(json.dumps({
+        "size": args.size, "case": case.name, "status": status, "errors": sum(s >= 500 for s in statuses),
+        "n": repeat,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p90_ms": percentile(latencies, 0.9) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "rps": repeat / wall,
+        "base_rss_mb": base_rss,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+# ============================================================
+# 集計（親プロセス）
+# ============================================================
+def run_case(name, size, args):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--size", size,
+           "--repeat", str(args.repeat), "--heavy-repeat", str(args.heavy_repeat),
+           "--concurrency", str(args.concurrency), "--upstream-ms", str(args.upstream_ms)]
+    if args.cache:
+        cmd.append("--cache")
+    for key, value in synth_data.scale_overrides(args).items():
+        cmd += [f"--{key.replace('_', '-')}", str(value)]
+    with tempfile.TemporaryDirectory(prefix="bench_suite_") as workdir:
+        # plot_utils はカレントディレクトリにグラフのPNGを書くので作業ディレクトリで実行する
+        proc = subprocess.run(cmd, cwd=workdir, capture_output=True, text=True,
+                              env=dict(os.environ, WARMUP_PROVIDERS="", TRACE_EXPORTER=""))
+    if proc.returncode != 0:
+        return {"size": size, "case": name, "error": proc.stderr.strip().splitlines()[-1:]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="small,medium")
+    ap.add_argument("--only", default="", help="ケース名にこの文字列を含むものだけ実行する")
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--heavy-repeat", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--upstream-ms", type=float, default=0)
+    ap.add_argument("--cache", action="store_true", help="GA4 レポートの TTLCache を有効にする")
+    ap.add_argument("--json", help="結果をJSONで保存する")
+    ap.add_argument("--baseline", help="比較する前回の --json の結果")
+    ap.add_argument("--max-regression", type=float, default=1.2)
+    ap.add_argument("--list", action="store_true")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--size", default="small", help=argparse.SUPPRESS)
+    synth_data.add_scale_arguments(ap)
+    args = ap.parse_args()
+
+    if args.child:
+        return run_child(args)
+
+    cases = build_cases(synth_data.SyntheticProperty("small"))
+    missing = uncovered_routes(cases)
+    if missing:
+        sys.exit("ケースの無いルートがあります（build_cases に追加してください）: " + ", ".join(missing))
+    names = [c.name for c in cases if args.only in c.name]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = {(r["size"], r["case"]): r for r in json.load(fh)["results"] if "p50_ms" in r}
+
+    print(f"repeat={args.repeat} heavy={args.heavy_repeat} concurrency={args.concurrency} upstream={args.upstream_ms}ms\n")
+    print(f"{'size':<8}{'case':<34}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'req/s':>9}{'RSS MB':>9}{'peak MB':>9}"
+          + (f"{'vs base':>9}" if baseline else ""))
+    results, regressions = [], []
+    for size in args.sizes.split(","):
+        for name in names:
+            r = run_case(name, size, args)
+            results.append(r)
+            if "error" in r:
+                print(f"{size:<8}{name:<34}  ERROR {r['error']}")
+                continue
+            line = (f"{size:<8}{name:<34}{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+                    f"{r['rps']:>9.1f}{r['base_rss_mb']:>9.0f}{r['peak_rss_mb']:>9.0f}")
+            if r["status"] >= 400 or r["errors"]:
+                line += f"  (status {r['status']}, {r['errors']} errors)"
+            base = baseline.get((size, name))
+            if base:
+                ratio = r["p50_ms"] / base["p50_ms"] if base["p50_ms"] else 1.0
+                line += f"{ratio:>8.2f}x"
+                # 1ms 未満はばらつきが大きいので比較しない
+                if ratio > args.max_regression and base["p50_ms"] >= 1.0:
+                    regressions.append((size, name, ratio))
+            print(line, flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("child", "size") and v is not None},
+                       "results": results}, fh, ensure_ascii=False, indent=1)
+    if regressions:
+        print(f"\n{len(regressions)} 件が p50 で {args.max_regression}x を超えて遅くなっています:")
+        for size, name, ratio in regressions:
+            print(f"  {size} {name}: {ratio:.2f}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,740 @@
+"""
+synth_data.py - 大規模プロパティ相当の合成データ（GA4 / GSC / Ads の応答と generate() の入力）
+
+usage: python benchmarks/synth_data.py [--scale large] [--months 24] [--cities 2000] [--pages 100000]
+                                       [--campaigns 200] [--queries 20000] [--seed 0] [--out synth_large]
+
+同じ scale・上書き値・seed なら毎回同じ内容になる（乱数は使わずキーのハッシュから値を決める）。
+  SyntheticProperty : GA4 の RunReport / RunPivotReport / Metadata、GSC の searchanalytics.query、
+                      Ads の googleAds:search に対する応答をリクエストの内容から作る
+  StubGA4Client / StubGSCHttp / make_ads_adapter / install :
+                      ga4_api の上流クライアントを差し替えて、合成データを返すようにする
+  report_input      : install したうえで collect_report_data を通し、generate() の入力を作る
+
+値の分布は実データに寄せている。
+  市区町村・ページ・参照元・クエリ・キャンペーンは順位に対して Zipf 的に減衰する
+  月ごとに季節変動（春・秋に多い）がある
+  activeUsers ≤ sessions、bounceRate = 1 - engagementRate など指標同士の整合をとる
+  GSC のクエリには商圏の市区町村名を含むもの（「川口市 外壁塗装」など）が混ざる
+--out を指定すると代表的な上流レスポンスと generate_input.json をそのディレクトリに書き出す
+（python build_report.py <out>/generate_input.json でそのままPPTXを作れる）。
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ga4_utils import month_ranges, resolve_date
+
+SCALES = {
+    "small": dict(months=3, cities=30, pages=300, sources=8, queries=300, campaigns=5,
+                  keywords=50, clients=3, stores=2, sessions=3000, max_rows=5000),
+    "medium": dict(months=12, cities=300, pages=3000, sources=20, queries=3000, campaigns=30,
+                   keywords=500, clients=10, stores=5, sessions=30000, max_rows=50000),
+    "large": dict(months=12, cities=2000, pages=20000, sources=40, queries=20000, campaigns=200,
+                  keywords=2000, clients=30, stores=10, sessions=300000, max_rows=250000),
+}
+
+PROPERTY_ID = "123456789"
+SITE_URL = "https://www.example.jp/"
+CUSTOMER_ID = "1234567890"
+MCC_ID = "9876543210"
+PREFECTURE = "埼玉県"
+
+REAL_CITIES = [
+    "さいたま市", "川口市", "川越市", "所沢市", "越谷市", "草加市", "春日部市", "上尾市", "熊谷市", "新座市",
+    "久喜市", "狭山市", "入間市", "朝霞市", "戸田市", "鴻巣市", "三郷市", "深谷市", "ふじみ野市", "坂戸市",
+    "富士見市", "八潮市", "和光市", "蕨市", "志木市", "蓮田市", "桶川市", "北本市", "吉川市", "東松山市",
+]
+CITY_HEADS = "川大北南東西新上下中本若高朝桜松竹梅青白"
+CITY_TAILS = "口宮浦和田野山原沢島谷越戸橋岡崎瀬江森台"
+CITY_SUFFIXES = ["市", "町", "区", "村"]
+
+SOURCE_MEDIUMS = [
+    ("google", "organic"), ("(direct)", "(none)"), ("yahoo", "organic"), ("google", "cpc"),
+    ("bing", "organic"), ("instagram", "social"), ("line", "social"), ("m.facebook.com", "referral"),
+    ("t.co", "referral"), ("yahoo", "cpc"), ("chatgpt.com", "referral"), ("newsletter", "email"),
+]
+DEVICES = ["mobile", "desktop", "tablet"]
+EVENTS = ["page_view", "session_start", "first_visit", "user_engagement", "scroll", "click",
+          "form_start", "form_submit", "tel_tap", "file_download"]
+KEY_EVENTS = {"form_submit", "tel_tap"}
+FIXED_PAGES = ["/", "/contact/", "/contact/thanks/", "/price/", "/company/", "/works/", "/blog/", "/faq/"]
+PAGE_KINDS = ["/works/{n}/", "/blog/{n}/", "/column/gaiheki-{n}/", "/area/{n}/", "/voice/{n}/"]
+AREA_QUERIES = ["{city} 外壁塗装", "{city}外壁塗装", "{city} 屋根塗装", "{city} 塗装 相場", "{city}屋根塗装"]
+GENERIC_QUERIES = ["外壁塗装", "屋根塗装 費用", "外壁 塗り替え 時期", "プロタイムズ", "塗装 業者 おすすめ", "外壁塗装 助成金"]
+CAMPAIGN_KINDS = ["検索_外壁塗装", "検索_屋根塗装", "P-MAX", "ディスプレイ"]
+KEYWORD_KINDS = ["外壁塗装", "屋根塗装", "塗装 業者", "外壁 リフォーム"]
+
+INTEGER_METRICS = {"sessions", "activeUsers", "screenPageViews", "keyEvents", "eventCount"}
+SECONDS_METRICS = {"averageSessionDuration"}
+FLOAT_METRICS = {"engagementRate", "bounceRate", "screenPageViewsPerSession"}
+
+# 月ごとの季節変動（外壁塗装は春・秋が繁忙期）
+SEASONALITY = {1: 0.75, 2: 0.85, 3: 1.1, 4: 1.25, 5: 1.3, 6: 1.0, 7: 0.9, 8: 0.8, 9: 1.05, 10: 1.2, 11: 1.1, 12: 0.7}
+
+
+def _days(start, end):
+    cur, end = resolve_date(start), resolve_date(end)
+    while cur <= end:
+        yield cur
+        cur += timedelta(days=1)
+
+
+def _zipf(rank, s=1.0):
+    return 1 / (rank + 1) ** s
+
+
+class _Axis:
+    """レポートの1軸（1つ以上のディメンションの値の組と、その組の重み）"""
+
+    def __init__(self, names, values, weights):
+        self.names = names
+        self.values = values
+        total = sum(weights) or 1
+        self.shares = [w / total for w in weights]
+
+
+# ============================================================
+# 合成データ
+# ============================================================
+class SyntheticProperty:
+    """
+    1プロパティ（GA4 / GSC / Ads をまとめた1店舗）分の合成データ。
+    scale は SCALES のキー。months / cities / pages / queries / campaigns などはキーワード引数で上書きできる。
+    """
+
+    def __init__(self, scale="small", seed=0, end_date="2025-12-31", **overrides):
+        unknown = set(overrides) - set(SCALES["small"])
+        if unknown:
+            raise ValueError(f"不明なパラメータ: {sorted(unknown)}")
+        self.scale = scale
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._rows_cache = {}
+        self._season_cache = {}
+        p = self.params = {**SCALES[scale], **{k: v for k, v in overrides.items() if v is not None}}
+
+        end = date.fromisoformat(end_date)
+        first = end.replace(day=1)
+        for _ in range(p["months"] - 1):
+            first = (first - timedelta(days=1)).replace(day=1)
+        self.start_date = first.isoformat()
+        self.end_date = end.isoformat()
+
+        self.cities = self._city_names(p["cities"])
+        self.areas = [f"{PREFECTURE} {c}" for c in self.cities[:5]]
+        self.pages = (FIXED_PAGES + [PAGE_KINDS[i % len(PAGE_KINDS)].format(n=i // len(PAGE_KINDS) + 1)
+                                     for i in range(max(0, p["pages"] - len(FIXED_PAGES)))])[:p["pages"]]
+        self.source_mediums = (SOURCE_MEDIUMS + [(f"site{i}.example.jp", "referral")
+                                                 for i in range(max(0, p["sources"] - len(SOURCE_MEDIUMS)))])[:p["sources"]]
+        self.queries = self._queries(p["queries"])
+        self.campaigns = [f"{CAMPAIGN_KINDS[i % len(CAMPAIGN_KINDS)]}_{self.cities[i // len(CAMPAIGN_KINDS) % len(self.cities)]}"
+                          + (f"_{i // (len(CAMPAIGN_KINDS) * len(self.cities)) + 1}" if i >= len(CAMPAIGN_KINDS) * len(self.cities) else "")
+                          for i in range(p["campaigns"])]
+        self.keywords = [self._numbered(f"{self.cities[i % len(self.cities)]} {KEYWORD_KINDS[i // len(self.cities) % len(KEYWORD_KINDS)]}",
+                                        i // (len(self.cities) * len(KEYWORD_KINDS)))
+                         for i in range(p["keywords"])]
+
+    # ---------- 値の生成 ----------
+    def noise(self, *key):
+        """キーごとに決まる [0, 1) の値"""
+        return zlib.crc32("|".join(map(str, (self.seed,) + key)).encode()) / 2 ** 32
+
+    def jitter(self, *key, spread=0.3):
+        """1 ± spread の範囲で揺らす係数"""
+        return 1 + spread * (2 * self.noise(*key) - 1)
+
+    @staticmethod
+    def _numbered(text, lap):
+        """2周目以降は末尾に番号を付けて重複させない"""
+        return f"{text} {lap + 1}" if lap else text
+
+    @staticmethod
+    def _city_names(n):
+        names = list(REAL_CITIES[:n])
+        i = 0
+        while len(names) < n:
+            head = CITY_HEADS[i % len(CITY_HEADS)]
+            tail = CITY_TAILS[i // len(CITY_HEADS) % len(CITY_TAILS)]
+            lap = i // (len(CITY_HEADS) * len(CITY_TAILS))
+            suffix = CITY_SUFFIXES[lap % len(CITY_SUFFIXES)]
+            number = lap // len(CITY_SUFFIXES)
+            names.append(f"{head}{tail}{'第' + str(number + 1) if number else ''}{suffix}")
+            i += 1
+        return names
+
+    def _queries(self, n):
+        # 上位は商圏の市区町村名を含むクエリと一般クエリを交互に並べる
+        queries, a, g = [], 0, 0
+        while len(queries) < n:
+            if len(queries) % 2 == 0 and a < len(self.cities) * len(AREA_QUERIES):
+                city = self.cities[a // len(AREA_QUERIES)]
+                queries.append(AREA_QUERIES[a % len(AREA_QUERIES)].format(city=city))
+                a += 1
+            else:
+                queries.append(self._numbered(GENERIC_QUERIES[g % len(GENERIC_QUERIES)], g // len(GENERIC_QUERIES)))
+                g += 1
+        return queries
+
+    def months(self, start, end):
+        return [s[:7] for s, _ in month_ranges(start, end)]
+
+    def season(self, start, end):
+        """期間内の季節変動の平均"""
+        factor = self._season_cache.get((start, end))
+        if factor is None:
+            months = self.months(start, end)
+            factor = self._season_cache[(start, end)] = sum(SEASONALITY[int(ym[5:])] for ym in months) / max(1, len(months))
+        return factor
+
+    # ---------- GA4 ----------
+    def ga4_axes(self, dims, start, end):
+        """ディメンションの並びを軸にまとめる（sessionSource と sessionMedium は実在する組だけの1軸）"""
+        axes, done = [], set()
+        for d in dims:
+            if d in done:
+                continue
+            if d in ("sessionSource", "sessionMedium") and {"sessionSource", "sessionMedium"} <= set(dims):
+                pairs = self.source_mediums
+                names = ["sessionSource", "sessionMedium"]
+                axes.append(self._axis(names, pairs, [_zipf(i, 1.1) for i in range(len(pairs))]))
+                done.update(names)
+                continue
+            if d == "yearMonth":
+                months = self.months(start, end)
+                values = [(ym.replace("-", ""),) for ym in months]
+                weights = [SEASONALITY[int(ym[5:])] for ym in months]
+            elif d == "date":
+                days = list(_days(start, end))
+                values = [(x.strftime("%Y%m%d"),) for x in days]
+                weights = [SEASONALITY[x.month] * (1.15 if x.weekday() >= 5 else 1) for x in days]
+            elif d == "sessionSource":
+                values = list(dict.fromkeys((s,) for s, _ in self.source_mediums))
+                weights = [_zipf(i, 1.1) for i in range(len(values))]
+            elif d == "sessionMedium":
+                values = list(dict.fromkeys((m,) for _, m in self.source_mediums))
+                weights = [_zipf(i, 1.1) for i in range(len(values))]
+            elif d == "deviceCategory":
+                values, weights = [(v,) for v in DEVICES], [0.68, 0.29, 0.03]
+            elif d == "city":
+                values = [(c,) for c in self.cities]
+                weights = [_zipf(i, 0.9) for i in range(len(values))]
+            elif d in ("pagePath", "landingPage"):
+                pages = self.pages if d == "pagePath" else self.pages[:max(1, len(self.pages) // 5)]
+                values = [(v,) for v in pages]
+                weights = [_zipf(i, 1.05) for i in range(len(values))]
+            elif d == "eventName":
+                values = [(v,) for v in EVENTS]
+                weights = [_zipf(i, 0.7) for i in range(len(values))]
+            else:
+                values, weights = [("(not set)",)], [1]
+            axes.append(self._axis([d], values, weights))
+            done.add(d)
+        return axes
+
+    def _axis(self, names, values, weights):
+        # 重みの揺らぎは値ごとに決める（行ごとに揺らすと内訳の合計が全体と合わなくなる）
+        return _Axis(names, values, [w * self.jitter(*names, *v) for w, v in zip(weights, values)])
+
+    def ga4_rows(self, dims, start, end, limit=None):
+        """[(ディメンション名→値, 軸の組み合わせの割合)]（先頭の軸が最も速く変わる順・max_rows 件まで）"""
+        axes = self.ga4_axes(dims, start, end)
+        count = 1
+        for axis in axes:
+            count *= len(axis.values)
+        count = min(count, self.params["max_rows"], limit or count)
+        rows = []
+        for n in range(count):
+            values, share = {}, 1.0
+            for axis in axes:
+                n, r = divmod(n, len(axis.values))
+                values.update(zip(axis.names, axis.values[r]))
+                share *= axis.shares[r]
+            rows.append((values, share))
+        return rows
+
+    def ga4_metrics(self, values, share, start, end):
+        """行の指標（sessions を基準にほかの指標を整合するように決める）"""
+        key = tuple(sorted(values.items()))
+        days = (resolve_date(end) - resolve_date(start)).days + 1
+        expected = self.params["sessions"] * days / 30.4 * share
+        if "yearMonth" not in values and "date" not in values:
+            expected *= self.season(start, end)
+        sessions = max(1, round(expected))
+        engagement = 0.45 + 0.3 * self.noise(*key, "engagement")
+        pages_per_session = 1.3 + 1.7 * self.noise(*key, "pv")
+        event = values.get("eventName")
+        if event:
+            event_count = max(1, round(sessions * (4 if event == "page_view" else 1) * self.jitter(*key, "events")))
+            key_events = event_count if event in KEY_EVENTS else 0
+        else:
+            event_count = round(sessions * 6.5 * self.jitter(*key, "events"))
+            key_events = math.floor(sessions * 0.012 * self.jitter(*key, "key_events", spread=0.8))
+        screen_page_views = max(sessions, round(sessions * pages_per_session))
+        return {
+            "sessions": sessions,
+            "activeUsers": max(1, round(sessions * (0.72 + 0.2 * self.noise(*key, "users")))),
+            "screenPageViews": screen_page_views,
+            "engagementRate": engagement,
+            "bounceRate": 1 - engagement,
+            "averageSessionDuration": 35 + 180 * self.noise(*key, "duration") ** 2,
+            "keyEvents": key_events,
+            "eventCount": event_count,
+            "screenPageViewsPerSession": screen_page_views / sessions,
+        }
+
+    @staticmethod
+    def _metric_type(name):
+        from google.analytics.data_v1beta.types import MetricType
+
+        if name in INTEGER_METRICS:
+            return MetricType.TYPE_INTEGER
+        if name in SECONDS_METRICS:
+            return MetricType.TYPE_SECONDS
+        return MetricType.TYPE_FLOAT
+
+    @staticmethod
+    def _metric_value(name, value):
+        return str(value) if name in INTEGER_METRICS else f"{value:.6f}"
+
+    def _sorted_rows(self, req, dims, ranges):
+        """全行を order_bys の順に並べたもの（offset / limit だけが違うページ取得では使い回す）"""
+        key = (tuple(dims), tuple(ranges), tuple(type(o).serialize(o) for o in req.order_bys))
+        with self._lock:
+            rows = self._rows_cache.get(key)
+        if rows is not None:
+            return rows
+        rows = [(i, values, self.ga4_metrics(values, share, *ranges[i]))
+                for i, (s, e) in enumerate(ranges) for values, share in self.ga4_rows(dims, s, e)]
+        # order_bys は後ろの条件から順に安定ソートする
+        for o in reversed(req.order_bys):
+            if o.dimension.dimension_name:
+                name = o.dimension.dimension_name
+                rows.sort(key=lambda r: r[1].get(name, ""), reverse=o.desc)
+            elif o.metric.metric_name:
+                name = o.metric.metric_name
+                rows.sort(key=lambda r: r[2].get(name, 0), reverse=o.desc)
+        with self._lock:
+            self._rows_cache[key] = rows
+        return rows
+
+    def ga4_report(self, req):
+        """RunReportRequest に対する RunReportResponse（dimension_filter は無視する）"""
+        from google.analytics.data_v1beta.types import RunReportResponse
+
+        dims = [d.name for d in req.dimensions]
+        mets = [m.name for m in req.metrics]
+        ranges = [(r.start_date, r.end_date) for r in req.date_ranges]
+        rows = self._sorted_rows(req, dims, ranges)
+
+        pb = RunReportResponse.pb()()
+        for d in dims:
+            pb.dimension_headers.add(name=d)
+        if len(ranges) > 1:
+            pb.dimension_headers.add(name="dateRange")
+        for m in mets:
+            pb.metric_headers.add(name=m, type_=self._metric_type(m))
+        pb.row_count = len(rows)
+        offset = req.offset or 0
+        limit = req.limit or 10000
+        for i, values, metrics in rows[offset:offset + limit]:
+            row = pb.rows.add()
+            for d in dims:
+                row.dimension_values.add(value=values[d])
+            if len(ranges) > 1:
+                row.dimension_values.add(value=f"date_range_{i}")
+            for m in mets:
+                row.metric_values.add(value=self._metric_value(m, metrics.get(m, 0)))
+        return RunReportResponse.wrap(pb)
+
+    def ga4_pivot_report(self, req):
+        """RunPivotReportRequest に対する RunPivotReportResponse（ピボットごとに上位 limit 件）"""
+        from google.analytics.data_v1beta.types import RunPivotReportResponse
+
+        dims = [d.name for d in req.dimensions]
+        metric = req.metrics[0].name
+        start, end = req.date_ranges[0].start_date, req.date_ranges[0].end_date
+        axes = {a.names[0]: a for a in self.ga4_axes(dims, start, end) if len(a.names) == 1}
+        pb = RunPivotReportResponse.pb()()
+        for d in dims:
+            pb.dimension_headers.add(name=d)
+        pb.metric_headers.add(name=metric, type_=self._metric_type(metric))
+        kept = {}
+        for pivot in req.pivots:
+            axis = axes[pivot.field_names[0]]
+            kept[axis.names[0]] = list(range(min(len(axis.values), pivot.limit or len(axis.values))))
+            header = pb.pivot_headers.add(row_count=len(axis.values))
+            for r in kept[axis.names[0]]:
+                header.pivot_dimension_headers.add().dimension_values.add(value=axis.values[r][0])
+        index_lists = [kept.get(d, [0]) for d in dims]
+        count = 1
+        for indexes in index_lists:
+            count *= len(indexes)
+        for n in range(count):
+            values, share = {}, 1.0
+            for d, indexes in zip(dims, index_lists):
+                n, r = divmod(n, len(indexes))
+                values[d] = axes[d].values[indexes[r]][0]
+                share *= axes[d].shares[indexes[r]]
+            row = pb.rows.add()
+            for d in dims:
+                row.dimension_values.add(value=values[d])
+            row.metric_values.add(value=self._metric_value(metric, self.ga4_metrics(values, share, start, end)[metric]))
+        return RunPivotReportResponse.wrap(pb)
+
+    def ga4_metadata(self, name):
+        from google.analytics.data_v1beta.types import Metadata
+
+        dimensions = ["yearMonth", "date", "city", "sessionSource", "sessionMedium", "deviceCategory",
+                      "pagePath", "landingPage", "eventName", "isKeyEvent"]
+        pb = Metadata.pb()(name=name)
+        for d in dimensions:
+            pb.dimensions.add(api_name=d)
+        for m in sorted(INTEGER_METRICS | SECONDS_METRICS | FLOAT_METRICS):
+            pb.metrics.add(api_name=m, type_=self._metric_type(m))
+        return Metadata.wrap(pb)
+
+    # ---------- GSC ----------
+    def gsc_row(self, keys, rank, day=None):
+        """順位 rank のクエリ / ページの1行（掲載順位が上がるほどCTRが高い）"""
+        weight = SEASONALITY[day.month] if day else 1.0
+        impressions = max(1, round(self.params["sessions"] * 3 * _zipf(rank, 0.85) / (30 if day else 1)
+                                   * weight * self.jitter(*keys, "imp")))
+        position = 1 + rank ** 0.5 * 1.5 * self.jitter(*keys, "pos", spread=0.4)
+        ctr = min(0.6, 0.3 / position ** 1.2)
+        clicks = round(impressions * ctr)
+        return {"keys": list(keys), "clicks": clicks, "impressions": impressions,
+                "ctr": clicks / impressions, "position": round(position, 1)}
+
+    def gsc_query(self, body):
+        """searchanalytics.query のレスポンス（dimensionFilterGroups は query の includingRegex だけ解釈する）"""
+        dims = body.get("dimensions") or []
+        row_limit = body.get("rowLimit", 1000)
+        ranked = list(enumerate(self.queries))
+        for group in body.get("dimensionFilterGroups", []):
+            for f in group.get("filters", []):
+                if f.get("dimension") == "query" and f.get("operator") == "includingRegex":
+                    pattern = re.compile(f["expression"])
+                    ranked = [(i, q) for i, q in ranked if pattern.search(q)]
+        days = list(_days(body["startDate"], body["endDate"]))
+        if not dims:
+            top = [self.gsc_row((q,), i) for i, q in ranked[:1000]]
+            clicks = sum(r["clicks"] for r in top) * len(days) // 30
+            impressions = sum(r["impressions"] for r in top) * len(days) // 30
+            return {"rows": [{"clicks": clicks, "impressions": impressions, "ctr": clicks / max(1, impressions),
+                              "position": round(sum(r["position"] for r in top) / max(1, len(top)), 1)}],
+                    "responseAggregationType": "byProperty"}
+        if dims == ["page"]:
+            ranked = [(i, SITE_URL.rstrip("/") + p) for i, p in enumerate(self.pages)]
+        rows = []
+        # 上位のクエリから日ごとの行を作る（実際の API と同じくクリック数の多い順に返す）
+        for i, key in ranked:
+            if "date" in dims:
+                rows.extend(self.gsc_row((d.isoformat(), key), i, d) for d in days)
+            else:
+                rows.append(self.gsc_row((key,), i))
+            if len(rows) >= row_limit:
+                break
+        rows.sort(key=lambda r: -r["clicks"])
+        return {"rows": rows[:row_limit], "responseAggregationType": "byProperty"}
+
+    # ---------- Google Ads ----------
+    def ads_metrics(self, *key, rank=0, days=30, ctr=False):
+        impressions = max(10, round(self.params["sessions"] * 2 * _zipf(rank, 0.8) * days / 30.4 * self.jitter(*key, "imp")))
+        clicks = round(impressions * 0.06 * self.jitter(*key, "ctr", spread=0.6))
+        cost = clicks * round(180 + 420 * self.noise(*key, "cpc"))
+        metrics = {"costMicros": str(cost * 1_000_000),
+                   "conversions": round(clicks * 0.025 * self.jitter(*key, "cv", spread=0.9), 2),
+                   "clicks": str(clicks), "impressions": str(impressions)}
+        if ctr:
+            metrics["ctr"] = clicks / impressions
+        return metrics
+
+    def ads_search(self, customer_id, gaql):
+        """googleAds:search の results（GAQL の FROM と SELECT から返す形を決める）"""
+        m = re.search(r"BETWEEN '(\d{4}-\d{2}-\d{2})' AND '(\d{4}-\d{2}-\d{2})'", gaql)
+        start, end = m.groups() if m else (self.start_date, self.end_date)
+        limit = re.search(r"LIMIT (\d+)", gaql)
+        limit = int(limit.group(1)) if limit else None
+        days = list(_days(start, end))
+        if "FROM customer_client" in gaql:
+            return [{"customerClient": {"id": str(1000000000 + i), "descriptiveName": f"プロタイムズ{self.cities[i % len(self.cities)][:-1]}店",
+                                        "currencyCode": "JPY"}} for i in range(self.params["clients"])]
+        if "FROM keyword_view" in gaql:
+            return [{"adGroupCriterion": {"keyword": {"text": k, "matchType": ["PHRASE", "EXACT", "BROAD"][i % 3]}},
+                     "metrics": self.ads_metrics(customer_id, k, rank=i, days=len(days), ctr=True)}
+                    for i, k in enumerate(self.keywords[:limit])]
+        if "segments.week" in gaql:
+            weeks = sorted({d - timedelta(days=d.weekday()) for d in days}, reverse=True)
+            return [{"segments": {"week": w.isoformat()},
+                     "metrics": self.ads_metrics(customer_id, c, w, rank=i, days=7 * SEASONALITY[w.month])}
+                    for w in weeks for i, c in enumerate(self.campaigns)]
+        if "segments.month" in gaql:
+            months = sorted({d.replace(day=1) for d in days}, reverse=True)
+            return [{"segments": {"month": ym.isoformat()}, "campaign": {"name": c},
+                     "metrics": self.ads_metrics(customer_id, c, ym, rank=i, days=30.4 * SEASONALITY[ym.month])}
+                    for ym in months for i, c in enumerate(self.campaigns)]
+        return [{"campaign": {"name": c, "status": "ENABLED" if self.noise(c, "status") < 0.8 else "PAUSED"},
+                 "metrics": self.ads_metrics(customer_id, c, rank=i, days=len(days), ctr=True)}
+                for i, c in enumerate(self.campaigns[:limit])]
+
+    # ---------- generate() の入力 ----------
+    def report_params(self, property_id=PROPERTY_ID):
+        """/report-data・collect_report_data に渡すパラメータ"""
+        return {"property_id": property_id, "site_url": SITE_URL, "customer_id": CUSTOMER_ID,
+                "start_date": self.start_date, "end_date": self.end_date, "areas": self.areas,
+                "inquiry_paths": ["/contact/thanks/"], "report_fields": self.report_fields()}
+
+    def report_fields(self):
+        """APIから取れない項目（店舗名・期間・CV実績・分析コメント・改善提案）"""
+        months = self.months(self.start_date, self.end_date)[-3:]
+        cv_months = []
+        for ym in months:
+            target = 8 + round(12 * self.noise(ym, "target"))
+            actual = max(0, round(target * self.jitter(ym, "actual", spread=0.5)))
+            budget = round(300000 + 500000 * self.noise(ym, "budget"), -3)
+            cv_months.append({"ym": f"{ym[:4]}年{int(ym[5:])}月", "ym_short": f"{int(ym[5:])}月", "target": target, "actual": actual,
+                              "budget": int(budget), "cpa": int(budget // actual) if actual else 0})
+        last = date.fromisoformat(self.end_date)
+        return {
+            "store_name": f"プロタイムズ{self.cities[0][:-1]}店",
+            "period": f"{last.year}年{last.month}月",
+            "period_1st": f"{last.year}年{last.month}月 {last.replace(day=1).isoformat()} - {last.isoformat()}",
+            "cv_months": cv_months,
+            "cv_comment": "問合せ数は前月から増加し、CPAは目標内で推移しました。",
+            "analysis": {
+                "analysis_text": "自然検索からの流入が増え、商圏内のセッションも伸びています。",
+                "good": ["自然検索の流入が前月比で増加", "商圏内セッション比率が改善", "問合せ完了ページの到達数が増加"],
+                "issues": ["スマートフォンの直帰率が高い", "屋根塗装クエリの掲載順位が低下", "広告のCPAが上昇傾向"],
+            },
+            "proposals": [
+                {"color": "red", "title": "施工事例ページの導線改善", "body": "事例ページから問合せフォームへのボタンを追加する。"},
+                {"color": "orange", "title": "屋根塗装ページの強化", "body": "商圏名を含む屋根塗装のコンテンツを追加する。"},
+                {"color": "blue", "title": "広告の入札調整", "body": "CPAの高いキャンペーンの入札単価を見直す。"},
+            ],
+        }
+
+
+# ============================================================
+# 上流クライアントのスタブ
+# ============================================================
+class StubGA4Client:
+    """BetaAnalyticsDataClient の代わり（リクエストごとにシリアライズ済みのレスポンスを保持して再生する）"""
+
+    def __init__(self, prop, upstream_ms=0):
+        self.prop = prop
+        self.upstream_ms = upstream_ms
+        self._lock = threading.Lock()
+        self._recorded = {}
+
+    def _replay(self, request, build):
+        key = (type(request).__name__, type(request).serialize(request))
+        with self._lock:
+            data = self._recorded.get(key)
+        if data is None:
+            response = build(request)
+            data = type(response).serialize(response)
+            with self._lock:
+                self._recorded[key] = data
+        return data
+
+    def _wait(self):
+        if self.upstream_ms:
+            time.sleep(self.upstream_ms / 1000)
+
+    def run_report(self, request, **kwargs):
+        from google.analytics.data_v1beta.types import RunReportResponse
+
+        self._wait()
+        return RunReportResponse.deserialize(self._replay(request, self.prop.ga4_report))
+
+    def batch_run_reports(self, request, **kwargs):
+        from google.analytics.data_v1beta.types import BatchRunReportsResponse
+
+        self._wait()
+        pb = BatchRunReportsResponse.pb()()
+        for r in request.requests:
+            pb.reports.add().MergeFromString(self._replay(r, self.prop.ga4_report))
+        return BatchRunReportsResponse.wrap(pb)
+
+    def run_pivot_report(self, request, **kwargs):
+        from google.analytics.data_v1beta.types import RunPivotReportResponse
+
+        self._wait()
+        return RunPivotReportResponse.deserialize(self._replay(request, self.prop.ga4_pivot_report))
+
+    def batch_run_pivot_reports(self, request, **kwargs):
+        from google.analytics.data_v1beta.types import BatchRunPivotReportsResponse
+
+        self._wait()
+        pb = BatchRunPivotReportsResponse.pb()()
+        for r in request.requests:
+            pb.pivot_reports.add().MergeFromString(self._replay(r, self.prop.ga4_pivot_report))
+        return BatchRunPivotReportsResponse.wrap(pb)
+
+    def get_metadata(self, name=None, **kwargs):
+        from google.analytics.data_v1beta.types import Metadata
+
+        self._wait()
+        return Metadata.deserialize(Metadata.serialize(self.prop.ga4_metadata(name)))
+
+
+class StubGSCHttp:
+    """googleapiclient の http に渡す httplib2.Http 互換のスタブ"""
+
+    def __init__(self, prop, upstream_ms=0):
+        self.prop = prop
+        self.upstream_ms = upstream_ms
+        self._lock = threading.Lock()
+        self._recorded = {}
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+
+        key = (uri, body)
+        with self._lock:
+            content = self._recorded.get(key)
+        if content is None:
+            content = json.dumps(self.prop.gsc_query(json.loads(body or "{}")), ensure_ascii=False).encode()
+            with self._lock:
+                self._recorded[key] = content
+        if self.upstream_ms:
+            time.sleep(self.upstream_ms / 1000)
+        return httplib2.Response({"status": "200", "content-type": "application/json; charset=UTF-8"}), content
+
+
+def make_ads_adapter(prop, upstream_ms=0):
+    """googleads / oauth2 宛てのリクエストに合成データで応答する HTTPAdapter"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class StubAdsAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            if upstream_ms:
+                time.sleep(upstream_ms / 1000)
+            if "oauth2.googleapis.com" in request.url:
+                payload = {"access_token": "stub-access-token", "expires_in": 3599, "token_type": "Bearer"}
+            else:
+                customer_id = re.search(r"/customers/(\d+)/", request.url).group(1)
+                payload = {"results": prop.ads_search(customer_id, json.loads(request.body)["query"])}
+            resp = requests.Response()
+            resp.status_code = 200
+            resp._content = json.dumps(payload, ensure_ascii=False).encode()
+            resp.headers["Content-Type"] = "application/json; charset=UTF-8"
+            resp.encoding = "utf-8"
+            resp.url = request.url
+            resp.request = request
+            return resp
+
+    return StubAdsAdapter()
+
+
+def install(prop, upstream_ms=0):
+    """ga4_api の上流クライアントと認証情報を prop の合成データを返すスタブに差し替える"""
+    import ga4_api
+
+    ga4_api.SERVICE_ACCOUNT_JSON = "{}"
+    ga4_api.DEFAULT_PROPERTY_ID = PROPERTY_ID
+    ga4_api.GSC_REFRESH_TOKEN = ga4_api.GSC_CLIENT_ID = ga4_api.GSC_CLIENT_SECRET = "stub"
+    ga4_api.GOOGLE_ADS_REFRESH_TOKEN = ga4_api.GOOGLE_ADS_CLIENT_ID = "stub"
+    ga4_api.GOOGLE_ADS_CLIENT_SECRET = ga4_api.GOOGLE_ADS_DEVELOPER_TOKEN = "stub"
+    ga4_api.GOOGLE_ADS_LOGIN_CUSTOMER_ID = MCC_ID
+
+    ga4_client = StubGA4Client(prop, upstream_ms)
+    ga4_api.create_ga4_client = lambda: ga4_client
+    ga4_api._ga4_client = None
+
+    gsc_http = StubGSCHttp(prop, upstream_ms)
+
+    def create_gsc_service():
+        from googleapiclient.discovery import build_from_document
+        return build_from_document(ga4_api.load_gsc_discovery_doc(), http=gsc_http)
+
+    ga4_api.create_gsc_service = create_gsc_service
+    ga4_api._gsc_local.__dict__.clear()
+
+    adapter = make_ads_adapter(prop, upstream_ms)
+    ga4_api.http_session.mount("https://googleads.googleapis.com/", adapter)
+    ga4_api.http_session.mount("https://oauth2.googleapis.com/", adapter)
+    return ga4_api
+
+
+def report_input(prop):
+    """合成データを collect_report_data に通した generate() の入力（/report-data の report_data と同じ）"""
+    ga4_api = install(prop)
+    params = prop.report_params()
+    data, errors = ga4_api.collect_report_data(**params)
+    if errors:
+        raise RuntimeError(f"合成データの取得に失敗しました: {errors}")
+    return data
+
+
+# ============================================================
+# 書き出し
+# ============================================================
+def dump(prop, out_dir):
+    """代表的な上流レスポンスと generate() の入力を out_dir に書き出す"""
+    from google.analytics.data_v1beta.types import DateRange, Dimension, Metric, RunReportRequest
+
+    os.makedirs(out_dir, exist_ok=True)
+    ga4 = prop.ga4_report(RunReportRequest(
+        property=f"properties/{PROPERTY_ID}",
+        dimensions=[Dimension(name="yearMonth"), Dimension(name="city")],
+        metrics=[Metric(name="sessions"), Metric(name="activeUsers")],
+        date_ranges=[DateRange(start_date=prop.start_date, end_date=prop.end_date)],
+        limit=10000,
+    ))
+    samples = {
+        "ga4_run_report_city.json": type(ga4).to_dict(ga4),
+        "gsc_queries.json": prop.gsc_query({"startDate": prop.start_date, "endDate": prop.end_date,
+                                            "dimensions": ["query"], "rowLimit": 1000}),
+        "gsc_area_queries.json": prop.gsc_query({
+            "startDate": prop.start_date, "endDate": prop.end_date, "dimensions": ["date", "query"], "rowLimit": 25000,
+            "dimensionFilterGroups": [{"filters": [{"dimension": "query", "operator": "includingRegex",
+                                                    "expression": "(" + "|".join(prop.cities[:5]) + ")"}]}]}),
+        "ads_campaign_monthly.json": {"results": prop.ads_search(CUSTOMER_ID, (
+            "SELECT segments.month, campaign.name, metrics.cost_micros FROM campaign "
+            f"WHERE segments.date BETWEEN '{prop.start_date}' AND '{prop.end_date}'"))},
+        "generate_input.json": report_input(prop),
+    }
+    for name, payload in samples.items():
+        with open(os.path.join(out_dir, name), "w", encoding="utf-8") as fh:
+            json.dump(payload, fh, ensure_ascii=False)
+        print(f"{os.path.join(out_dir, name)}  {os.path.getsize(os.path.join(out_dir, name)) / 1024:,.0f} KB")
+
+
+def add_scale_arguments(ap):
+    """SCALES の各項目を上書きする引数（--months 24 など）を追加する"""
+    for key in SCALES["small"]:
+        ap.add_argument(f"--{key.replace('_', '-')}", type=int, dest=key)
+
+
+def scale_overrides(args):
+    return {k: getattr(args, k) for k in SCALES["small"] if getattr(args, k, None) is not None}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", default="small", choices=list(SCALES))
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--end-date", default="2025-12-31")
+    ap.add_argument("--out", help="書き出し先ディレクトリ（既定 synth_<scale>）")
+    add_scale_arguments(ap)
+    args = ap.parse_args()
+
+    prop = SyntheticProperty(args.scale, seed=args.seed, end_date=args.end_date, **scale_overrides(args))
+    print(", ".join(f"{k}={v}" for k, v in prop.params.items()))
+    dump(prop, args.out or f"synth_{args.scale}")
+
+
+if __name__ == "__main__":
+    main()
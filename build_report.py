@@ -8,8 +8,13 @@ build_report.py - GA4/GSC/CV レポート PowerPoint生成スクリプト
 usage: python build_report.py report_data_test.json [output.pptx]
 """
 import json
+import os
 import sys
 import copy
+import tempfile
+import time
+from concurrent.futures import wait
+from contextlib import contextmanager
 from pptx import Presentation
 from pptx.util import Inches, Pt, Emu
 from pptx.dml.color import RGBColor
@@ -20,6 +25,8 @@ from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION, XL_TICK_MARK, XL_
 from pptx.oxml.ns import qn
 
 import plot_utils
+import pptx_utils
+import trace_utils
 
 # ============================================================
 # テンプレートファイル
@@ -191,6 +198,10 @@ def slide_header(slide, title, period=""):
 def load_data(path):
     with open(path, encoding="utf-8") as f:
         d = json.load(f)
+    return normalize_data(d)
+
+def normalize_data(d):
+    """ga4_monthly / cv_months から summary の未設定項目を補完する"""
     ga = d.get("ga4_monthly", [])
     cv = d.get("cv_months", [])
     s  = d.get("summary", {})
@@ -770,10 +781,35 @@ def format_chart_axes(chart, fs=9):
             except Exception:
                 pass
 
+def chart_filename(name):
+    return f"temp_chart_{name}.png"
+
+def render_charts(specs, out_dir=""):
+    """p15_charts などのグラフをその場で順に書き出して {名前: パス} を返す"""
+    paths = {}
+    for name, (kind, args, kwargs) in specs.items():
+        paths[name] = os.path.join(out_dir, chart_filename(name))
+        plot_utils.render_chart(kind, args, kwargs, paths[name])
+    return paths
+
+
 # ============================================================
 # P15: 広告基本指標 (Ads) 月次
 # ============================================================
-def build_p15_ads_monthly(slide, d):
+def p15_charts(d):
+    """P15 のグラフ（{名前: (種類, 引数, キーワード引数)}。plot_utils.render_chart にそのまま渡せる）"""
+    ads_m = sorted(d.get("ads_monthly", []), key=lambda x: x["ym_raw"])
+    if not ads_m:
+        return {}
+    categories = [m["ym"].replace("年", "/").replace("月", "") for m in ads_m]
+    size = {"width": 320, "height": 220}
+    return {
+        "p15_cost": ("bar", (categories, [m.get("cost", 0) for m in ads_m], "Cost"), size),
+        "p15_cv_cvr": ("combo", (categories, [m["cv"] for m in ads_m], "CV", [m["cvr"] for m in ads_m], "CVR"), size),
+    }
+
+def build_p15_ads_monthly(slide, d, charts=None):
+    """charts: p15_charts を書き出し済みの {名前: パス}（None ならここで書き出す）"""
     slide_header(slide, "広告基本指標 (Ads)")
     ads_m = d.get("ads_monthly", [])
     if not ads_m:
@@ -802,33 +838,36 @@ def build_p15_ads_monthly(slide, d):
     add_table(slide, 0.2, 0.6, 7.1, 1.0, h, r, fs=8,
               col_widths=[1.1, 0.9, 0.6, 0.8, 0.8, 0.6, 0.7, 0.9, 0.7])
 
-    categories = [m["ym"].replace("年", "/").replace("月", "") for m in ads_m]
+    if charts is None:
+        charts = render_charts(p15_charts(d))
 
     # --- 左側グラフ: コスト (Bar) ---
     add_text(slide, 0.2, 2.0, 3.0, 0.3, "コスト (Ads)\nby Month", font_size=9, color=C_SUBTEXT)
-    fpath1 = "temp_chart_p15_cost.png"
-    plot_utils.save_bar_chart(
-        categories, [m.get("cost", 0) for m in ads_m], "Cost",
-        fpath1, width=320, height=220
-    )
-    slide.shapes.add_picture(fpath1, inch(0.2), inch(2.4), width=inch(3.3))
+    slide.shapes.add_picture(charts["p15_cost"], inch(0.2), inch(2.4), width=inch(3.3))
 
     # --- 右側グラフ: CV・CVR (Line+Bar combo) ---
     add_text(slide, 3.6, 2.0, 3.0, 0.3, "CV・CVR (Ads)\nby Month", font_size=9, color=C_SUBTEXT)
-    fpath2 = "temp_chart_p15_cv_cvr.png"
-    plot_utils.save_combo_chart(
-        categories,
-        [m["cv"] for m in ads_m], "CV",
-        [m["cvr"] for m in ads_m], "CVR",
-        fpath2, width=320, height=220
-    )
-    slide.shapes.add_picture(fpath2, inch(3.6), inch(2.4), width=inch(3.3), height=inch(2.8)) # Light blue
+    slide.shapes.add_picture(charts["p15_cv_cvr"], inch(3.6), inch(2.4), width=inch(3.3), height=inch(2.8)) # Light blue
 
 
 # ============================================================
 # P16: 広告基本指標_週次 (Ads)
 # ============================================================
-def build_p16_ads_weekly(slide, d):
+def p16_charts(d):
+    """P16 のグラフ（p15_charts と同じ形式）"""
+    ads_w = sorted(d.get("ads_weekly", []), key=lambda x: x["week"])
+    if not ads_w:
+        return {}
+    categories = [m["week"][-5:] + " " for m in ads_w] # use short dates, append space to make Plotly treat as string
+    size = {"width": 320, "height": 180}
+    return {
+        # 表示回数-クリック数 (Click=Bar, Imp=Line overlay)
+        "p16_ct_imp": ("combo", (categories, [m["clicks"] for m in ads_w], "Click", [m["impressions"] for m in ads_w], "Imp"), size),
+        "p16_cpa_cv": ("combo", (categories, [m["cpa"] for m in ads_w], "CPA", [m["cv"] for m in ads_w], "CV"), size),
+    }
+
+def build_p16_ads_weekly(slide, d, charts=None):
+    """charts: p16_charts を書き出し済みの {名前: パス}（None ならここで書き出す）"""
     slide_header(slide, "広告基本指標_週次 (Ads)")
     ads_w = d.get("ads_weekly", [])
     if not ads_w:
@@ -855,29 +894,16 @@ def build_p16_ads_weekly(slide, d):
     add_table(slide, 0.2, 0.5, 7.1, 1.0, h, r, fs=7,
               col_widths=[1.1, 0.8, 0.6, 0.6, 0.7, 0.6, 0.7, 1.1, 0.9])
 
-    categories = [m["week"][-5:] + " " for m in ads_w] # use short dates, append space to make Plotly treat as string
+    if charts is None:
+        charts = render_charts(p16_charts(d))
 
     # --- 左側グラフ: 表示回数-クリック数 (Click=Bar, Imp=Line overlay) ---
     add_text(slide, 0.2, 2.8, 3.0, 0.2, "表示回数-クリック数 (Ads)", font_size=9, color=C_SUBTEXT)
-    fpath1 = "temp_chart_p16_ct_imp.png"
-    plot_utils.save_combo_chart(
-        categories,
-        [m["clicks"] for m in ads_w], "Click",
-        [m["impressions"] for m in ads_w], "Imp",
-        fpath1, width=320, height=180
-    )
-    slide.shapes.add_picture(fpath1, inch(0.2), inch(3.1), width=inch(3.3))
+    slide.shapes.add_picture(charts["p16_ct_imp"], inch(0.2), inch(3.1), width=inch(3.3))
 
     # --- 右側グラフ: CV-CPA ---
     add_text(slide, 3.6, 2.8, 3.0, 0.2, "CV-CPA (Ads)", font_size=9, color=C_SUBTEXT)
-    fpath2 = "temp_chart_p16_cpa_cv.png"
-    plot_utils.save_combo_chart(
-        categories,
-        [m["cpa"] for m in ads_w], "CPA",
-        [m["cv"] for m in ads_w], "CV",
-        fpath2, width=320, height=180
-    )
-    slide.shapes.add_picture(fpath2, inch(3.6), inch(3.1), width=inch(3.3), height=inch(2.0))
+    slide.shapes.add_picture(charts["p16_cpa_cv"], inch(3.6), inch(3.1), width=inch(3.3), height=inch(2.0))
 
 
 # ============================================================
@@ -1038,55 +1064,247 @@ def main():
 if __name__ == "__main__":
     main()
 
-def generate(data: dict, template_path: str, output_path: str):
-    """APIから呼び出し可能なPPTX生成エントリーポイント"""
-    import os, tempfile, json
-
-    # dataをtmpに書き出してload_dataで読み込む
-    tmp = tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8')
-    json.dump(data, tmp, ensure_ascii=False)
-    tmp.close()
-
-    try:
-        d = load_data(tmp.name)
-    finally:
-        os.unlink(tmp.name)
+class ReportTimer:
+    """
+    generate() の処理時間の内訳（テンプレート読み込み・スライドごとの構築/複製/グラフ・保存）。
+    フェーズはトレースのスパンとしても記録し、on_phase(名前, 秒) にも渡す。
+    グラフは書き出しにかかった時間（chart）と、スライドの構築がそれを待った時間（wait）を分けて持つ。
+    その場で書き出した場合は両方同じになる
+    """
+
+    def __init__(self, on_phase=None):
+        self.on_phase = on_phase
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.slides = []
+        self.flushed = 0.0
+        self._current = None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            with trace_utils.span(f"report.{name}"):
+                yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0) + seconds
+            if self.on_phase is not None:
+                self.on_phase(name, seconds)
+
+    @contextmanager
+    def slide(self, name):
+        """スライド1枚分のビルダー（途中の複製・グラフ書き出しもこのスライドに計上する）"""
+        self._current = {"name": name, "clone": 0.0, "wait": 0.0, "flush": 0.0, "slides": 0, "charts": []}
+        started = time.perf_counter()
+        try:
+            with plot_utils.record_renders(self.inline_chart), self.phase(name):
+                yield
+        finally:
+            self._current["total"] = time.perf_counter() - started
+            self.slides.append(self._current)
+            self._current = None
+
+    def clone(self, seconds):
+        if self._current is not None:
+            self._current["clone"] += seconds
+            self._current["slides"] += 1
+
+    def flush(self, seconds):
+        """stream=True でスライドを書き出した時間（ビルダーの途中で書き出した分はそのスライドにも計上する）"""
+        self.flushed += seconds
+        if self._current is not None:
+            self._current["flush"] += seconds
+
+    def chart(self, name, seconds, waited=0.0):
+        if self._current is not None:
+            self._current["charts"].append((name, seconds))
+            self._current["wait"] += waited
+
+    def inline_chart(self, name, seconds):
+        self.chart(name, seconds, waited=seconds)
+
+    def report(self):
+        """処理時間の内訳（ミリ秒）"""
+        ms = lambda seconds: round(seconds * 1000, 1)
+        slides = []
+        for s in self.slides:
+            slides.append({
+                "name": s["name"],
+                "ms": ms(s["total"]),
+                "build_ms": ms(s["total"] - s["clone"] - s["wait"] - s["flush"]),
+                "clone_ms": ms(s["clone"]),
+                "flush_ms": ms(s["flush"]),
+                "chart_ms": ms(sum(sec for _, sec in s["charts"])),
+                "chart_wait_ms": ms(s["wait"]),
+                "slides": s["slides"],
+                "charts": [{"name": name, "ms": ms(sec)} for name, sec in s["charts"]],
+            })
+        return {
+            "total_ms": ms(time.perf_counter() - self.started),
+            "prepare_ms": ms(self.phases.get("prepare", 0)),
+            "template_ms": ms(self.phases.get("template", 0)),
+            "clone_ms": ms(sum(s["clone"] for s in self.slides)),
+            "chart_ms": ms(sum(sec for s in self.slides for _, sec in s["charts"])),
+            "chart_wait_ms": ms(sum(s["wait"] for s in self.slides)),
+            "flush_ms": ms(self.flushed),
+            "save_ms": ms(self.phases.get("save", 0)),
+            "slides": slides,
+        }
+
+
+def log_timing(report, top=5):
+    """report() の結果を1回分のログとして出力する（遅いスライドから top 件）"""
+    save = f"{report['save_ms']:.0f}" + (f"（逐次 {report['flush_ms']:.0f}）" if report["flush_ms"] else "")
+    print(f"⏱ PPTX生成 {report['total_ms']:.0f}ms（テンプレート {report['template_ms']:.0f} / 複製 {report['clone_ms']:.0f}"
+          f" / グラフ {report['chart_ms']:.0f}（待ち {report['chart_wait_ms']:.0f}） / 保存 {save}）")
+    for s in sorted(report["slides"], key=lambda s: -s["ms"])[:top]:
+        print(f"   {s['name']:<18}{s['ms']:>8.0f}ms（構築 {s['build_ms']:.0f} / 複製 {s['clone_ms']:.0f}"
+              f" / グラフ {len(s['charts'])}枚 {s['chart_ms']:.0f} 待ち {s['chart_wait_ms']:.0f}）")
+
+class ChartResults:
+    """
+    generate() のグラフ（{キー: p15_charts などの結果}）を out_dir に書き出す。
+    submit でプール（plot_utils.chart_pool）にまとめて投げておき、get で待って {名前: パス} を返す。
+    プールがなければ get のときにその場で書き出す
+    """
+
+    def __init__(self, timer, specs, out_dir):
+        self.timer = timer
+        self.specs = specs
+        self.out_dir = out_dir
+        self._futures = {}
+
+    def submit(self):
+        if plot_utils.chart_pool() is None:
+            return
+        for key, specs in self.specs.items():
+            futures = {}
+            for name, (kind, args, kwargs) in specs.items():
+                path = os.path.join(self.out_dir, chart_filename(name))
+                futures[name] = (path, plot_utils.submit_chart(kind, args, kwargs, path))
+            self._futures[key] = futures
+
+    def get(self, key):
+        futures = self._futures.get(key)
+        if futures is None:
+            return render_charts(self.specs.get(key, {}), self.out_dir)
+        paths = {}
+        for name, (path, future) in futures.items():
+            started = time.perf_counter()
+            seconds = future.result()
+            self.timer.chart(os.path.basename(path), seconds, waited=time.perf_counter() - started)
+            paths[name] = path
+        return paths
+
+    def close(self):
+        """始まっていない書き出しは取り消し、書き出し中のものは終わるまで待つ（out_dir を消す前に呼ぶ）"""
+        pending = [future for futures in self._futures.values() for _, future in futures.values()]
+        for future in pending:
+            future.cancel()
+        wait(pending)
+
+
+def generate(data: dict, template_path: str, output_path: str, on_phase=None, log=False, stream=False):
+    """
+    APIから呼び出し可能なPPTX生成エントリーポイント。処理時間の内訳（ReportTimer.report）を返す
+    グラフは最初にまとめて plot_utils のプールに投げ、スライドは決まった順に1枚ずつ組み立てる
+    （グラフの書き出しが前のスライドの構築と重なる。python-pptx の操作は並列にしない）
+    on_phase: テンプレート読み込み・各スライド・保存の処理時間を (名前, 秒) で受け取る関数
+    log: True なら処理時間の内訳をログに出す
+    stream: True ならスライドを組み終わるごとに output_path へ書き出し、メモリから外す（pptx_utils.StreamingWriter）
+    """
+    timer = ReportTimer(on_phase)
+    # summary補完で呼び出し元のdictを書き換えないようコピーしてから正規化
+    with timer.phase("prepare"):
+        d = normalize_data(copy.deepcopy(data))
 
     global TEMPLATE_FILE
     TEMPLATE_FILE = template_path
-    prs = Presentation(template_path)
+    with timer.phase("template"):
+        prs = Presentation(template_path)
 
     tmpl = prs.slides[2]
+    writer = pptx_utils.StreamingWriter(prs, output_path) if stream else None
+    created = []
 
     def new_slide():
-        return add_content_slide(prs, tmpl)
-
-    build_p3_cv(new_slide(), d)
-    build_p4_summary(new_slide(), d)
-    build_p5_detail(new_slide(), d)
-    build_p6_ga4(new_slide(), d)
-    build_p7_gsc(new_slide(), d)
-    build_p7_5_gsc_area(new_slide(), d, new_slide_fn=new_slide)
-    build_p8_analysis(new_slide(), d)
-    build_p9_proposals(new_slide(), d)
-    build_p10_pages(new_slide(), d)
-    build_traffic_slide(new_slide(), d, "traffic_sources_1st", "当月")
-    build_traffic_slide(new_slide(), d, "traffic_sources_2nd", "前月")
-    build_area_slide(new_slide(), d, "area_traffic_1st", "当月")
-    build_area_slide(new_slide(), d, "area_traffic_2nd", "前月")
+        started = time.perf_counter()
+        slide = add_content_slide(prs, tmpl)
+        timer.clone(time.perf_counter() - started)
+        created.append(slide)
+        return slide
+
+    def flush_created():
+        """ここまでに組み終わったスライドを書き出す（stream=True のとき）"""
+        if writer is not None:
+            started = time.perf_counter()
+            for slide in created:
+                writer.flush(slide)
+            timer.flush(time.perf_counter() - started)
+        created.clear()
+
+    def next_page():
+        # P7.5 の続きのスライド。前のページはもう変更しないので先に書き出す
+        flush_created()
+        return new_slide()
+
+    steps = [
+        ("p3_cv", build_p3_cv),
+        ("p4_summary", build_p4_summary),
+        ("p5_detail", build_p5_detail),
+        ("p6_ga4", build_p6_ga4),
+        ("p7_gsc", build_p7_gsc),
+        ("p7_5_gsc_area", lambda slide, d: build_p7_5_gsc_area(slide, d, new_slide_fn=next_page)),
+        ("p8_analysis", build_p8_analysis),
+        ("p9_proposals", build_p9_proposals),
+        ("p10_pages", build_p10_pages),
+        ("p11_traffic_1st", lambda slide, d: build_traffic_slide(slide, d, "traffic_sources_1st", "当月")),
+        ("p12_traffic_2nd", lambda slide, d: build_traffic_slide(slide, d, "traffic_sources_2nd", "前月")),
+        ("p13_area_1st", lambda slide, d: build_area_slide(slide, d, "area_traffic_1st", "当月")),
+        ("p14_area_2nd", lambda slide, d: build_area_slide(slide, d, "area_traffic_2nd", "前月")),
+    ]
     if d.get("ads_monthly"):
-        build_p15_ads_monthly(new_slide(), d)
-        build_p16_ads_weekly(new_slide(), d)
-        build_p17_ads_campaign(new_slide(), d)
+        steps += [
+            ("p15_ads_monthly", lambda slide, d: build_p15_ads_monthly(slide, d, charts=charts.get("p15"))),
+            ("p16_ads_weekly", lambda slide, d: build_p16_ads_weekly(slide, d, charts=charts.get("p16"))),
+            ("p17_ads_campaign", build_p17_ads_campaign),
+        ]
 
-    # テンプレートのSlide3（雛形）を削除
-    from pptx.oxml.ns import qn
-    sldIdLst = prs.slides._sldIdLst
-    slide3_rId = sldIdLst[2].get("r:id")
-    slide3_elem = sldIdLst[2]
-    sldIdLst.remove(slide3_elem)
+    specs = {"p15": p15_charts(d), "p16": p16_charts(d)} if d.get("ads_monthly") else {}
     try:
-        del prs.slides.part.related_parts[slide3_rId]
-    except: pass
-
-    prs.save(output_path)
+        with tempfile.TemporaryDirectory(prefix="report_charts_") as chart_dir:
+            charts = ChartResults(timer, specs, chart_dir)
+            charts.submit()
+            try:
+                for name, build in steps:
+                    with timer.slide(name):
+                        build(new_slide(), d)
+                    flush_created()
+            finally:
+                charts.close()
+
+        # テンプレートのSlide3（雛形）を削除
+        from pptx.oxml.ns import qn
+        sldIdLst = prs.slides._sldIdLst
+        slide3_rId = sldIdLst[2].get("r:id")
+        slide3_elem = sldIdLst[2]
+        sldIdLst.remove(slide3_elem)
+        try:
+            del prs.slides.part.related_parts[slide3_rId]
+        except: pass
+
+        with timer.phase("save"):
+            if writer is not None:
+                writer.close()
+            else:
+                prs.save(output_path)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    report = timer.report()
+    if log:
+        log_timing(report)
+    return report
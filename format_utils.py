@@ -0,0 +1,180 @@
+"""
+format_utils.py - APIレスポンスのフォーマット変換・JSONエンコード・圧縮
+
+  columnar : {"length": n, "columns": [...], "data": {列名: [値...]}}
+             文字列列は {"dictionary": [ユニーク値...], "codes": [添字...]} に辞書エンコード（None は -1）
+  arrow    : Arrow IPC ストリーム（pyarrow が必要）
+  parquet  : Parquet（pyarrow が必要）
+
+JSONは orjson があれば FastJSONProvider で高速にエンコードし、
+レスポンスは Accept-Encoding に応じて zstd / br / gzip で圧縮する。
+"""
+import gzip
+import io
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MIMETYPE = "application/vnd.apache.parquet"
+
+
+def is_record_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+
+def column_names(rows):
+    """全行に出てくるキーを最初に出現した順で返す"""
+    names = {}
+    for r in rows:
+        for k in r:
+            names.setdefault(k, None)
+    return list(names)
+
+def to_columnar(rows):
+    """dictの配列を列指向に変換する"""
+    columns = column_names(rows)
+    data = {}
+    for col in columns:
+        values = [r.get(col) for r in rows]
+        if any(isinstance(v, str) for v in values) and all(v is None or isinstance(v, str) for v in values):
+            dictionary = {}
+            codes = [-1 if v is None else dictionary.setdefault(v, len(dictionary)) for v in values]
+            data[col] = {"dictionary": list(dictionary), "codes": codes}
+        else:
+            data[col] = values
+    return {"length": len(rows), "columns": columns, "data": data}
+
+def from_columnar(table):
+    """to_columnar の逆変換（クライアント側の参考実装・検証用）"""
+    cols = {}
+    for col in table["columns"]:
+        v = table["data"][col]
+        if isinstance(v, dict):
+            dictionary = v["dictionary"]
+            cols[col] = [None if c < 0 else dictionary[c] for c in v["codes"]]
+        else:
+            cols[col] = v
+    return [{col: cols[col][i] for col in table["columns"]} for i in range(table["length"])]
+
+def columnarize(payload):
+    """レスポンスdictのうち、dictの配列になっている項目だけを列指向に置き換える"""
+    return {k: to_columnar(v) if is_record_list(v) else v for k, v in payload.items()}
+
+
+def _arrow_table(rows):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("arrow / parquet 形式には pyarrow のインストールが必要です")
+    table = pa.Table.from_pylist(rows)
+    # 文字列列は辞書エンコードして繰り返し値を1回だけ持たせる
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type):
+            table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+    return table
+
+def to_arrow_ipc(rows):
+    table = _arrow_table(rows)
+    import pyarrow as pa
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+def to_parquet(rows):
+    table = _arrow_table(rows)
+    import pyarrow.parquet as pq
+    sink = io.BytesIO()
+    pq.write_table(table, sink, compression="zstd")
+    return sink.getvalue()
+
+
+# ============================================================
+# JSONエンコード
+# ============================================================
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    orjson でエンコード/デコードする Flask JSON プロバイダ（orjson が無ければ既定の json）。
+    キーのソートと ASCII エスケープは行わない（日本語をそのまま UTF-8 で出力する）。
+    """
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+# ============================================================
+# 圧縮
+# ============================================================
+# 優先順（先頭ほど優先）。ライブラリが無いものは候補から外す
+COMPRESSORS = {
+    "zstd": (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data)) if zstandard else None,
+    "br": (lambda data, level: brotli.compress(data, quality=level)) if brotli else None,
+    "gzip": lambda data, level: gzip.compress(data, compresslevel=level),
+}
+COMPRESS_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+
+# 既に圧縮済みの形式は再圧縮しない
+INCOMPRESSIBLE_MIMETYPES = {
+    PARQUET_MIMETYPE, "application/zip", "application/gzip",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+def parse_accept_encoding(header):
+    """Accept-Encoding を {エンコーディング: q値} にする"""
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+def choose_encoding(header):
+    """クライアントが受け付ける中で最も優先度の高いエンコーディングを返す（無ければ None）"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    candidates = [
+        (accepted.get(enc, wildcard), -i, enc)
+        for i, (enc, fn) in enumerate(COMPRESSORS.items()) if fn is not None
+    ]
+    candidates = [c for c in candidates if c[0] > 0]
+    return max(candidates)[2] if candidates else None
+
+def compress(data, encoding, level=None):
+    return COMPRESSORS[encoding](data, level or COMPRESS_LEVELS[encoding])
@@ -1,38 +1,470 @@
-from flask import Flask, jsonify, request
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import RunReportRequest
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-import requests as http_requests
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 import os
+import re
 import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+
+import format_utils
+import http_utils
+import ga4_utils
+import metrics_utils
+import profile_utils
+import trace_utils
+from ga4_utils import PivotSpec, ReportSpec
 
 app = Flask(__name__)
+# JSON_PROVIDER=default で Flask 標準の json に戻せる
+if os.environ.get('JSON_PROVIDER', 'fast') == 'fast':
+    app.json = format_utils.FastJSONProvider(app)
 
 SERVICE_ACCOUNT_JSON = os.environ.get('SERVICE_ACCOUNT_JSON')
 DEFAULT_PROPERTY_ID = os.environ.get('GA4_PROPERTY_ID')
+# GA4 レポート結果のキャッシュ秒数（0で無効）
+GA4_CACHE_TTL = int(os.environ.get('GA4_CACHE_TTL', '300'))
+# GA4 レポート結果のキャッシュに持つ行数の合計の上限（これより大きい結果はキャッシュしない）
+GA4_CACHE_MAX_ROWS = int(os.environ.get('GA4_CACHE_MAX_ROWS', '200000'))
+# プロパティのメタデータ（ディメンション/指標一覧）のキャッシュ秒数
+GA4_METADATA_TTL = int(os.environ.get('GA4_METADATA_TTL', str(6 * 3600)))
+# 存在しない・閲覧権限のないプロパティを覚えておく秒数（その間は GA4 に問い合わせずに 404 を返す）
+GA4_METADATA_ERROR_TTL = int(os.environ.get('GA4_METADATA_ERROR_TTL', '60'))
 
 GSC_REFRESH_TOKEN = os.environ.get('GSC_REFRESH_TOKEN')
 GSC_CLIENT_ID = os.environ.get('GSC_CLIENT_ID')
 GSC_CLIENT_SECRET = os.environ.get('GSC_CLIENT_SECRET')
+# Search Console API のディスカバリ文書（未指定なら google-api-python-client 同梱のもの）
+GSC_DISCOVERY_DOC_PATH = os.environ.get('GSC_DISCOVERY_DOC_PATH')
 
 GOOGLE_ADS_REFRESH_TOKEN = os.environ.get('GOOGLE_ADS_REFRESH_TOKEN')
 GOOGLE_ADS_CLIENT_ID = os.environ.get('GOOGLE_ADS_CLIENT_ID')
 GOOGLE_ADS_CLIENT_SECRET = os.environ.get('GOOGLE_ADS_CLIENT_SECRET')
 GOOGLE_ADS_DEVELOPER_TOKEN = os.environ.get('GOOGLE_ADS_DEVELOPER_TOKEN')
 
+# ============================================================
+# メトリクス（/metrics で Prometheus のテキスト形式で返す。ADMIN_TOKEN が必要）
+# ============================================================
+HTTP_REQUEST_SECONDS = metrics_utils.Histogram(
+    'http_request_duration_seconds', 'ルートごとの処理時間（ストリーミングは最初のレスポンスまで）',
+    ['method', 'route', 'status'])
+UPSTREAM_REQUEST_SECONDS = metrics_utils.Histogram(
+    'upstream_request_duration_seconds', '上流API呼び出しの時間（同時実行枠の待ちを含まない）',
+    ['api', 'method', 'outcome'])
+UPSTREAM_WAIT_SECONDS = metrics_utils.Histogram(
+    'upstream_slot_wait_seconds', '上流APIの同時実行枠が空くまでの待ち時間', ['api'])
+REPORT_PHASE_SECONDS = metrics_utils.Histogram(
+    'report_build_phase_seconds', 'PPTX生成のフェーズ（テンプレート読み込み・各スライド・保存）ごとの時間', ['phase'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace_span = trace_utils.start_span(
+        f"{request.method} {route}", kind='server',
+        attributes={'http.method': request.method, 'http.route': route},
+        remote_parent=trace_utils.parse_traceparent(request.headers.get('traceparent')))
+
+# after_request は登録の逆順に呼ばれるので、圧縮より先に登録して圧縮時間も含める
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     method=request.method, route=route, status=str(response.status_code))
+    span = g.get('trace_span')
+    if span is not None:
+        span.set_attribute('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = span.trace_id
+        response.headers['traceparent'] = span.traceparent
+    return response
+
+# ストリーミングのレスポンスは送り終わってから teardown が呼ばれるので、ルートのスパンはここで閉じる
+@app.teardown_request
+def end_request_span(error=None):
+    span = g.pop('trace_span', None)
+    if span is not None:
+        trace_utils.end_span(span, error)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus のテキスト形式（ADMIN_TOKEN が必要。scrape 側は Authorization: Bearer で渡す）"""
+    denied = check_admin_token()
+    if denied:
+        return denied
+    return Response(metrics_utils.render(), content_type=metrics_utils.CONTENT_TYPE)
+
+# ============================================================
+# プロファイル（PROFILING_ENABLED=1 のときだけ。一覧は /admin/profiles）
+# ============================================================
+# /admin/*・/metrics・/debug/http-pool の認証トークン（未設定ならどれも使えない）
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+@app.before_request
+def start_profile():
+    span = g.get('trace_span')
+    g.profile = profile_utils.start(
+        request.url_rule.rule if request.url_rule else 'unmatched', request.method,
+        request.headers, request.args, trace_id=span.trace_id if span else None)
+
+@app.after_request
+def add_profile_header(response):
+    capture = g.get('profile')
+    if capture is not None:
+        g.profile_status = response.status_code
+        if capture.explicit:
+            response.headers['X-Profile-Id'] = capture.filename
+    return response
+
+# ストリーミングのレスポンスは送り終わるまでを1回分として記録する
+@app.teardown_request
+def finish_profile(error=None):
+    capture = g.pop('profile', None)
+    if capture is not None:
+        profile_utils.finish(capture, g.pop('profile_status', None), error)
+
+# ============================================================
+# レスポンス圧縮（Accept-Encoding に応じて zstd / br / gzip）
+# ============================================================
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+
+@app.after_request
+def compress_response(response):
+    """一定サイズ以上のレスポンスを圧縮する（ストリーミング・ファイル送信は対象外）"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype in format_utils.INCOMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = format_utils.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(format_utils.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# ============================================================
+# Google Ads / OAuth 呼び出し用の共有HTTPセッション（keep-alive で接続を再利用）
+# ============================================================
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+
+http_session = http_utils.create_session(HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+@contextmanager
+def observe_upstream(provider, method):
+    """with ブロックを上流API呼び出しとして計測し、スパンも記録する（例外で抜けたら outcome=error）"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        with trace_utils.span(f'{provider}.{method}', kind='client', attributes={'upstream.api': provider}):
+            yield
+        outcome = 'ok'
+    finally:
+        UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                         api=provider, method=method, outcome=outcome)
+
+# ============================================================
+# 上流APIの同時実行数（プロバイダごと・プロセス全体で共有）
+# ============================================================
+# GA4 は1プロパティあたり同時10リクエストまで。店舗一括取得などで並列度が上がっても
+# ここで待たせて 429 / RESOURCE_EXHAUSTED を避ける
+UPSTREAM_CONCURRENCY = {
+    'ga4': int(os.environ.get('GA4_MAX_CONCURRENCY', 10)),
+    'gsc': int(os.environ.get('GSC_MAX_CONCURRENCY', 10)),
+    'ads': int(os.environ.get('ADS_MAX_CONCURRENCY', 10)),
+}
+_upstream_slots = {name: threading.BoundedSemaphore(n) for name, n in UPSTREAM_CONCURRENCY.items()}
+
+def upstream_call(api, fn, *args, **kwargs):
+    """
+    プロバイダの同時実行枠が空くのを待ってから上流APIを呼ぶ。
+    api は 'プロバイダ.メソッド'（例: 'ga4.run_report'）で、メトリクスのラベルにも使う。
+    """
+    provider, method = api.split('.', 1)
+    waited = time.perf_counter()
+    with _upstream_slots[provider]:
+        UPSTREAM_WAIT_SECONDS.observe(time.perf_counter() - waited, api=provider)
+        with observe_upstream(provider, method):
+            return fn(*args, **kwargs)
+
+# ============================================================
+# 同一クエリの同時実行をまとめる（single-flight）
+# ============================================================
+_inflight_lock = threading.Lock()
+_inflight = {}
+
+def single_flight(key, fn):
+    """同じkeyの上流リクエストが実行中ならその完了を待ち、結果を共有する"""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+    if not leader:
+        return future.result()
+    try:
+        result = fn()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+# google-analytics-data / google-api-python-client / google-auth は読み込みが重いので
+# （合わせて数百ms・数十MB）、使う関数の中で初めて import する
+
+def create_ga4_client():
+    from google.analytics.data_v1beta import BetaAnalyticsDataClient
+    from google.oauth2 import service_account
+
+    service_account_info = json.loads(SERVICE_ACCOUNT_JSON)
+    credentials = service_account.Credentials.from_service_account_info(
+        service_account_info,
+        scopes=['https://www.googleapis.com/auth/analytics.readonly']
+    )
+    return BetaAnalyticsDataClient(credentials=credentials)
+
+_ga4_client = None
+_ga4_client_lock = threading.Lock()
+
+def get_ga4_client():
+    """プロセス内で共有する GA4 クライアント（認証情報と gRPC チャネルを使い回す）"""
+    global _ga4_client
+    if _ga4_client is None:
+        with _ga4_client_lock:
+            if _ga4_client is None:
+                _ga4_client = create_ga4_client()
+    return _ga4_client
+
+_gsc_lock = threading.Lock()
+_gsc_discovery_doc = None
+_gsc_credentials = None
+_gsc_local = threading.local()
+
+def load_gsc_discovery_doc():
+    """searchconsole v1 のディスカバリ文書（プロセスで1回だけ読み込む。ネットワークは使わない）"""
+    global _gsc_discovery_doc
+    if _gsc_discovery_doc is None:
+        with _gsc_lock:
+            if _gsc_discovery_doc is None:
+                path = GSC_DISCOVERY_DOC_PATH
+                if not path:
+                    import googleapiclient.discovery_cache
+                    path = os.path.join(os.path.dirname(googleapiclient.discovery_cache.__file__),
+                                        'documents', 'searchconsole.v1.json')
+                with open(path, encoding='utf-8') as f:
+                    _gsc_discovery_doc = json.load(f)
+    return _gsc_discovery_doc
+
+def get_gsc_credentials():
+    """プロセス内で共有する GSC の認証情報（アクセストークンの更新を1回にまとめる）"""
+    global _gsc_credentials
+    if _gsc_credentials is None:
+        from google.oauth2.credentials import Credentials
+        with _gsc_lock:
+            if _gsc_credentials is None:
+                _gsc_credentials = Credentials(
+                    token=None, refresh_token=GSC_REFRESH_TOKEN,
+                    token_uri='https://oauth2.googleapis.com/token',
+                    client_id=GSC_CLIENT_ID, client_secret=GSC_CLIENT_SECRET,
+                    scopes=['https://www.googleapis.com/auth/webmasters.readonly']
+                )
+    return _gsc_credentials
+
+def create_gsc_service():
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(load_gsc_discovery_doc(), credentials=get_gsc_credentials())
+
+def get_gsc_service():
+    """スレッドごとに使い回す GSC サービス（httplib2 の接続はスレッドセーフではないため共有しない）"""
+    service = getattr(_gsc_local, 'service', None)
+    if service is None:
+        service = _gsc_local.service = create_gsc_service()
+    return service
+
+def run_ga4_report(client, request_obj):
+    """GA4 run_report（RunReportRequestのシリアライズ結果をキーに同時実行をまとめる）"""
+    key = ('ga4.run_report', type(request_obj).serialize(request_obj))
+    return single_flight(key, lambda: upstream_call('ga4.run_report', client.run_report, request_obj))
+
+def run_ga4_batch(client, property_id, requests):
+    """GA4 batch_run_reports（最大5本。同じ内容の同時実行はまとめる）"""
+    from google.analytics.data_v1beta.types import BatchRunReportsRequest
+
+    batch = BatchRunReportsRequest(property=f"properties/{property_id}", requests=requests)
+    key = ('ga4.batch_run_reports', BatchRunReportsRequest.serialize(batch))
+    return single_flight(key, lambda: upstream_call('ga4.batch_run_reports', client.batch_run_reports, batch)).reports
+
+def run_ga4_pivot_batch(client, property_id, requests):
+    """GA4 batch_run_pivot_reports（最大5本。同じ内容の同時実行はまとめる）"""
+    from google.analytics.data_v1beta.types import BatchRunPivotReportsRequest
+
+    batch = BatchRunPivotReportsRequest(property=f"properties/{property_id}", requests=requests)
+    key = ('ga4.batch_run_pivot_reports', BatchRunPivotReportsRequest.serialize(batch))
+    return single_flight(key, lambda: upstream_call('ga4.batch_run_pivot_reports', client.batch_run_pivot_reports, batch)).pivot_reports
+
+ga4_report_cache = ga4_utils.TTLCache(GA4_CACHE_TTL, name='ga4_report', maxrows=GA4_CACHE_MAX_ROWS)
+ga4_metadata_cache = ga4_utils.TTLCache(GA4_METADATA_TTL, name='ga4_metadata')
+ga4_metadata_error_cache = ga4_utils.TTLCache(GA4_METADATA_ERROR_TTL, name='ga4_metadata_error')
+
+def get_ga4_metadata(client, property_id):
+    """
+    プロパティのディメンション/指標一覧（ga4_utils.compact_metadata の形）。GA4_METADATA_TTL 秒キャッシュする。
+    プロパティが存在しない・閲覧権限がないときは PropertyNotFoundError（GA4_METADATA_ERROR_TTL 秒キャッシュする）。
+    """
+    error = ga4_metadata_error_cache.get(property_id)
+    if error is not None:
+        raise ga4_utils.PropertyNotFoundError(error)
+    metadata = ga4_metadata_cache.get(property_id)
+    if metadata is not None:
+        return metadata
+
+    def fetch():
+        from google.api_core.exceptions import NotFound, PermissionDenied
+
+        try:
+            response = upstream_call('ga4.get_metadata', client.get_metadata, name=f"properties/{property_id}/metadata")
+        except (NotFound, PermissionDenied) as e:
+            error = f"プロパティ {property_id} が見つからないか、閲覧権限がありません"
+            ga4_metadata_error_cache.set(property_id, error)
+            raise ga4_utils.PropertyNotFoundError(error) from e
+        metadata = ga4_utils.compact_metadata(response)
+        ga4_metadata_cache.set(property_id, metadata)
+        return metadata
+
+    return single_flight(('ga4.get_metadata', property_id), fetch)
+
+def validate_ga4_request(property_id, start_date, end_date):
+    """GA4 を呼ぶ前にプロパティIDと日付を検証する（不正なら InvalidReportError）"""
+    ga4_utils.validate_property_id(property_id)
+    ga4_utils.validate_date_range(start_date, end_date)
+
+def run_ga4_specs(property_id, specs, *date_ranges):
+    """
+    ReportSpec のリストをまとめて実行する。
+    date_ranges は (start_date, end_date) を最大4つ。期間ごとに {spec.name: 行の配列} を返す。
+    """
+    client = get_ga4_client()
+    metadata = get_ga4_metadata(client, property_id)
+    ga4_utils.validate_specs(specs, metadata)
+    return ga4_utils.run_specs(
+        specs, list(date_ranges),
+        lambda requests: run_ga4_batch(client, property_id, requests),
+        cache=ga4_report_cache, cache_key=(property_id,),
+        metric_types=metadata["metrics"]
+    )
+
+def iter_ga4_specs(property_id, specs, *date_ranges):
+    """
+    run_ga4_specs のストリーミング版（ga4_utils.iter_specs）。
+    メタデータでの検証はここで済ませ、(期間の添字, spec.name, 行) を返すイテレータを返す。
+    """
+    client = get_ga4_client()
+    metadata = get_ga4_metadata(client, property_id)
+    ga4_utils.validate_specs(specs, metadata)
+    return ga4_utils.iter_specs(
+        specs, list(date_ranges),
+        lambda requests: run_ga4_batch(client, property_id, requests),
+        metric_types=metadata["metrics"]
+    )
+
+def run_ga4_pivot_specs(property_id, specs, start_date, end_date):
+    """PivotSpec のリストをまとめて実行して {spec.name: {"columns", "rows"}} を返す"""
+    client = get_ga4_client()
+    ga4_utils.validate_specs(specs, get_ga4_metadata(client, property_id))
+    return ga4_utils.run_pivot_specs(
+        specs, (start_date, end_date),
+        lambda requests: run_ga4_pivot_batch(client, property_id, requests),
+        cache=ga4_report_cache, cache_key=(property_id,)
+    )
+
+def compare_range_param(args):
+    """compare_start_date / compare_end_date を (start, end) で返す（未指定なら None）"""
+    compare_start = args.get('compare_start_date')
+    compare_end = args.get('compare_end_date')
+    if not compare_start and not compare_end:
+        return None
+    if not (compare_start and compare_end):
+        raise ValueError("compare_start_date と compare_end_date は両方指定してください")
+    ga4_utils.validate_date_range(compare_start, compare_end)
+    return (compare_start, compare_end)
+
+def query_gsc(service, site_url, body):
+    """Search Console searchanalytics.query（siteUrl + bodyをキーに同時実行をまとめる）"""
+    key = ('gsc.query', site_url, json.dumps(body, sort_keys=True, ensure_ascii=False))
+    return single_flight(key, lambda: upstream_call('gsc.searchanalytics.query', service.searchanalytics().query(siteUrl=site_url, body=body).execute))
+
+def normalize_gaql(gaql):
+    return ' '.join(gaql.split())
+
+def data_response(payload, fmt=None, section=None):
+    """
+    format に応じてレスポンスを作る。
+      json（既定）     : そのまま jsonify
+      columnar        : dictの配列を列指向（文字列は辞書エンコード）にして jsonify
+      arrow / parquet : section で指定した1項目を Arrow IPC / Parquet のバイナリで返す
+    """
+    if fmt == 'columnar':
+        return jsonify(format_utils.columnarize(payload))
+    if fmt in ('arrow', 'parquet'):
+        sections = [k for k, v in payload.items() if isinstance(v, list)]
+        if section not in sections:
+            return jsonify({"success": False, "error": f"{fmt} 形式では section の指定が必要です（{', '.join(sections)}）"}), 400
+        if fmt == 'arrow':
+            body, mimetype = format_utils.to_arrow_ipc(payload[section]), format_utils.ARROW_MIMETYPE
+        else:
+            body, mimetype = format_utils.to_parquet(payload[section]), format_utils.PARQUET_MIMETYPE
+        return Response(body, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename={section}.{fmt}'
+        })
+    return jsonify(payload)
+
+# Google Ads のアクセストークンは expires_in の少し前までプロセス内で使い回す
+ADS_TOKEN_REFRESH_MARGIN = 300
+_ads_token_lock = threading.Lock()
+_ads_token = {'value': None, 'expires_at': 0.0}
+
 def get_ads_access_token():
-    response = http_requests.post('https://oauth2.googleapis.com/token', data={
-        'client_id': GOOGLE_ADS_CLIENT_ID,
-        'client_secret': GOOGLE_ADS_CLIENT_SECRET,
-        'refresh_token': GOOGLE_ADS_REFRESH_TOKEN,
-        'grant_type': 'refresh_token'
-    })
-    return response.json().get('access_token')
+    with _ads_token_lock:
+        if _ads_token['value'] and _ads_token['expires_at'] > time.monotonic():
+            return _ads_token['value']
+    return single_flight(('ads.token',), _refresh_ads_access_token)
+
+def _refresh_ads_access_token():
+    with observe_upstream('oauth', 'token'):
+        response = http_session.post('https://oauth2.googleapis.com/token', data={
+            'client_id': GOOGLE_ADS_CLIENT_ID,
+            'client_secret': GOOGLE_ADS_CLIENT_SECRET,
+            'refresh_token': GOOGLE_ADS_REFRESH_TOKEN,
+            'grant_type': 'refresh_token'
+        })
+    token_data = response.json()
+    access_token = token_data.get('access_token')
+    if access_token:
+        with _ads_token_lock:
+            _ads_token['value'] = access_token
+            _ads_token['expires_at'] = time.monotonic() + int(token_data.get('expires_in', 3600)) - ADS_TOKEN_REFRESH_MARGIN
+    return access_token
 
 def query_google_ads(customer_id, query):
+    key = ('ads.search.v14', customer_id, normalize_gaql(query))
+    return single_flight(key, lambda: _query_google_ads(customer_id, query))
+
+def _query_google_ads(customer_id, query):
     access_token = get_ads_access_token()
     url = f"https://googleads.googleapis.com/v14/customers/{customer_id}/googleAds:search"
     headers = {
@@ -41,7 +473,7 @@ def query_google_ads(customer_id, query):
         'login-customer-id': customer_id,
         'Content-Type': 'application/json'
     }
-    response = http_requests.post(url, headers=headers, json={'query': query})
+    response = upstream_call('ads.search', http_session.post, url, headers=headers, json={'query': query})
     if response.status_code != 200:
         return {'error': response.text, 'status_code': response.status_code, 'url': url}
     return response.json()
@@ -54,12 +486,20 @@ def home():
 def health():
     return jsonify({"status": "ok"})
 
+@app.route('/debug/http-pool')
+def debug_http_pool():
+    """共有HTTPセッションのホストごとの接続再利用状況（ADMIN_TOKEN が必要）"""
+    denied = check_admin_token()
+    if denied:
+        return denied
+    return jsonify({"pool_size": HTTP_POOL_SIZE, "hosts": http_utils.pool_stats(http_session)})
+
 @app.route('/google-ads/debug')
 def debug_google_ads():
     try:
         customer_id = request.args.get('customer_id')
 
-        token_response = http_requests.post('https://oauth2.googleapis.com/token', data={
+        token_response = http_session.post('https://oauth2.googleapis.com/token', data={
             'client_id': GOOGLE_ADS_CLIENT_ID,
             'client_secret': GOOGLE_ADS_CLIENT_SECRET,
             'refresh_token': GOOGLE_ADS_REFRESH_TOKEN,
@@ -78,7 +518,7 @@ def debug_google_ads():
             'login-customer-id': customer_id,
             'Content-Type': 'application/json'
         }
-        api_response = http_requests.post(url, headers=headers, json={
+        api_response = http_session.post(url, headers=headers, json={
             'query': 'SELECT campaign.name FROM campaign LIMIT 1'
         })
 
@@ -105,9 +545,13 @@ ADS_API_VERSION = 'v20'
 
 def query_ads(customer_id, gaql, login_customer_id=None):
     """Google Ads APIにGAQLクエリを送信してresultsを返す"""
-    access_token = get_ads_access_token()
     cid = customer_id.replace('-', '')
     login_cid = (login_customer_id or GOOGLE_ADS_LOGIN_CUSTOMER_ID or cid).replace('-', '')
+    key = ('ads.search', cid, login_cid, normalize_gaql(gaql))
+    return single_flight(key, lambda: _query_ads(cid, login_cid, gaql))
+
+def _query_ads(cid, login_cid, gaql):
+    access_token = get_ads_access_token()
     url = f"https://googleads.googleapis.com/{ADS_API_VERSION}/customers/{cid}/googleAds:search"
     headers = {
         'Authorization': f'Bearer {access_token}',
@@ -115,17 +559,148 @@ def query_ads(customer_id, gaql, login_customer_id=None):
         'login-customer-id': login_cid,
         'Content-Type': 'application/json'
     }
-    resp = http_requests.post(url, headers=headers, json={'query': gaql})
+    resp = upstream_call('ads.search', http_session.post, url, headers=headers, json={'query': gaql})
     if resp.status_code != 200:
         raise Exception(f"Ads API Error {resp.status_code}: {resp.text[:500]}")
     data = resp.json()
     return data.get('results', [])
 
+def fetch_ads_performance(customer_id, start_date, end_date, login_customer_id=None):
+    """Google Ads月次・週次・キャンペーン別パフォーマンスを取得して整形する"""
+    from collections import defaultdict
+
+    # --- 月次データ ---
+    monthly_gaql = f"""
+        SELECT
+            segments.month,
+            metrics.cost_micros,
+            metrics.conversions,
+            metrics.clicks,
+            metrics.impressions
+        FROM campaign
+        WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
+        ORDER BY segments.month DESC
+    """
+    monthly_rows = query_ads(customer_id, monthly_gaql, login_customer_id)
+
+    monthly_map = defaultdict(lambda: {'cost': 0.0, 'cv': 0.0, 'clicks': 0, 'impressions': 0})
+    for row in monthly_rows:
+        m   = row.get('segments', {}).get('month', '')[:7]
+        met = row.get('metrics', {})
+        monthly_map[m]['cost']        += int(met.get('costMicros', 0)) / 1_000_000
+        monthly_map[m]['cv']          += float(met.get('conversions', 0))
+        monthly_map[m]['clicks']      += int(met.get('clicks', 0))
+        monthly_map[m]['impressions'] += int(met.get('impressions', 0))
+
+    ads_monthly = []
+    for ym in sorted(monthly_map.keys(), reverse=True):
+        d = monthly_map[ym]
+        cost = round(d['cost'], 2)
+        cv   = round(d['cv'], 2)
+        clicks = d['clicks']
+        imps   = d['impressions']
+        cpa  = round(cost / cv, 0) if cv > 0 else 0
+        cpc  = round(cost / clicks, 0) if clicks > 0 else 0
+        ctr  = round(clicks / imps, 4) if imps > 0 else 0
+        cvr  = round(cv / clicks, 4) if clicks > 0 else 0
+        parts = ym.split('-')
+        ym_jp = f"{parts[0]}年{int(parts[1])}月" if len(parts) == 2 else ym
+        ads_monthly.append({
+            'ym': ym_jp, 'ym_raw': ym,
+            'cost': cost, 'cv': cv, 'cpa': cpa,
+            'clicks': clicks, 'cpc': cpc,
+            'ctr': ctr, 'impressions': imps, 'cvr': cvr
+        })
+
+    # --- 週次データ ---
+    weekly_gaql = f"""
+        SELECT
+            segments.week,
+            metrics.cost_micros,
+            metrics.conversions,
+            metrics.clicks,
+            metrics.impressions
+        FROM campaign
+        WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
+        ORDER BY segments.week DESC
+    """
+    weekly_rows = query_ads(customer_id, weekly_gaql, login_customer_id)
+
+    weekly_map = defaultdict(lambda: {'cost': 0.0, 'cv': 0.0, 'clicks': 0, 'impressions': 0})
+    for row in weekly_rows:
+        w   = row.get('segments', {}).get('week', '')[:10]
+        met = row.get('metrics', {})
+        weekly_map[w]['cost']        += int(met.get('costMicros', 0)) / 1_000_000
+        weekly_map[w]['cv']          += float(met.get('conversions', 0))
+        weekly_map[w]['clicks']      += int(met.get('clicks', 0))
+        weekly_map[w]['impressions'] += int(met.get('impressions', 0))
+
+    ads_weekly = []
+    for wk in sorted(weekly_map.keys(), reverse=True)[:12]:
+        d = weekly_map[wk]
+        cost = round(d['cost'], 2)
+        cv   = round(d['cv'], 2)
+        clicks = d['clicks']
+        imps   = d['impressions']
+        cpa  = round(cost / cv, 0) if cv > 0 else 0
+        cpc  = round(cost / clicks, 0) if clicks > 0 else 0
+        ctr  = round(clicks / imps, 4) if imps > 0 else 0
+        cvr  = round(cv / clicks, 4) if clicks > 0 else 0
+        ads_weekly.append({
+            'week': wk,
+            'cost': cost, 'cv': cv, 'cpa': cpa,
+            'clicks': clicks, 'cpc': cpc,
+            'ctr': ctr, 'impressions': imps, 'cvr': cvr
+        })
+
+    # --- キャンペーン別月次データ ---
+    campaign_gaql = f"""
+        SELECT
+            segments.month,
+            campaign.name,
+            metrics.cost_micros,
+            metrics.conversions,
+            metrics.clicks,
+            metrics.impressions
+        FROM campaign
+        WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
+        ORDER BY segments.month DESC, metrics.cost_micros DESC
+    """
+    campaign_rows = query_ads(customer_id, campaign_gaql, login_customer_id)
+
+    ads_campaigns = []
+    for row in campaign_rows:
+        m   = row.get('segments', {}).get('month', '')[:7]
+        cam = row.get('campaign', {}).get('name', '')
+        met = row.get('metrics', {})
+        cost   = round(int(met.get('costMicros', 0)) / 1_000_000, 2)
+        cv     = round(float(met.get('conversions', 0)), 2)
+        clicks = int(met.get('clicks', 0))
+        imps   = int(met.get('impressions', 0))
+        cpa    = round(cost / cv, 0) if cv > 0 else 0
+        cpc    = round(cost / clicks, 0) if clicks > 0 else 0
+        ctr    = round(clicks / imps, 4) if imps > 0 else 0
+        cvr    = round(cv / clicks, 4) if clicks > 0 else 0
+        parts  = m.split('-')
+        ym_jp  = f"{parts[0]}年{int(parts[1])}月" if len(parts) == 2 else m
+        ads_campaigns.append({
+            'ym': ym_jp, 'ym_raw': m, 'campaign': cam,
+            'cost': cost, 'cv': cv, 'cpa': cpa,
+            'clicks': clicks, 'cpc': cpc,
+            'ctr': ctr, 'impressions': imps, 'cvr': cvr
+        })
+
+    return {
+        "ads_monthly": ads_monthly,
+        "ads_weekly": ads_weekly,
+        "ads_campaigns": ads_campaigns
+    }
+
 @app.route('/ads/performance', methods=['GET', 'POST'])
 def get_ads_performance():
     """
     Google Ads月次・週次・キャンペーン別パフォーマンスを取得する。
-    パラメータ: customer_id, start_date, end_date
+    パラメータ: customer_id, start_date, end_date, format（json / columnar / arrow / parquet）, section
     """
     try:
         if request.method == 'POST':
@@ -148,138 +723,13 @@ def get_ads_performance():
                 "ads_campaigns": []
             })
 
-        from collections import defaultdict
-
-        # --- 月次データ ---
-        monthly_gaql = f"""
-            SELECT
-                segments.month,
-                metrics.cost_micros,
-                metrics.conversions,
-                metrics.clicks,
-                metrics.impressions
-            FROM campaign
-            WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
-            ORDER BY segments.month DESC
-        """
-        monthly_rows = query_ads(customer_id, monthly_gaql)
-
-        monthly_map = defaultdict(lambda: {'cost': 0.0, 'cv': 0.0, 'clicks': 0, 'impressions': 0})
-        for row in monthly_rows:
-            m   = row.get('segments', {}).get('month', '')[:7]
-            met = row.get('metrics', {})
-            monthly_map[m]['cost']        += int(met.get('costMicros', 0)) / 1_000_000
-            monthly_map[m]['cv']          += float(met.get('conversions', 0))
-            monthly_map[m]['clicks']      += int(met.get('clicks', 0))
-            monthly_map[m]['impressions'] += int(met.get('impressions', 0))
-
-        ads_monthly = []
-        for ym in sorted(monthly_map.keys(), reverse=True):
-            d = monthly_map[ym]
-            cost = round(d['cost'], 2)
-            cv   = round(d['cv'], 2)
-            clicks = d['clicks']
-            imps   = d['impressions']
-            cpa  = round(cost / cv, 0) if cv > 0 else 0
-            cpc  = round(cost / clicks, 0) if clicks > 0 else 0
-            ctr  = round(clicks / imps, 4) if imps > 0 else 0
-            cvr  = round(cv / clicks, 4) if clicks > 0 else 0
-            parts = ym.split('-')
-            ym_jp = f"{parts[0]}年{int(parts[1])}月" if len(parts) == 2 else ym
-            ads_monthly.append({
-                'ym': ym_jp, 'ym_raw': ym,
-                'cost': cost, 'cv': cv, 'cpa': cpa,
-                'clicks': clicks, 'cpc': cpc,
-                'ctr': ctr, 'impressions': imps, 'cvr': cvr
-            })
-
-        # --- 週次データ ---
-        weekly_gaql = f"""
-            SELECT
-                segments.week,
-                metrics.cost_micros,
-                metrics.conversions,
-                metrics.clicks,
-                metrics.impressions
-            FROM campaign
-            WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
-            ORDER BY segments.week DESC
-        """
-        weekly_rows = query_ads(customer_id, weekly_gaql)
-
-        weekly_map = defaultdict(lambda: {'cost': 0.0, 'cv': 0.0, 'clicks': 0, 'impressions': 0})
-        for row in weekly_rows:
-            w   = row.get('segments', {}).get('week', '')[:10]
-            met = row.get('metrics', {})
-            weekly_map[w]['cost']        += int(met.get('costMicros', 0)) / 1_000_000
-            weekly_map[w]['cv']          += float(met.get('conversions', 0))
-            weekly_map[w]['clicks']      += int(met.get('clicks', 0))
-            weekly_map[w]['impressions'] += int(met.get('impressions', 0))
-
-        ads_weekly = []
-        for wk in sorted(weekly_map.keys(), reverse=True)[:12]:
-            d = weekly_map[wk]
-            cost = round(d['cost'], 2)
-            cv   = round(d['cv'], 2)
-            clicks = d['clicks']
-            imps   = d['impressions']
-            cpa  = round(cost / cv, 0) if cv > 0 else 0
-            cpc  = round(cost / clicks, 0) if clicks > 0 else 0
-            ctr  = round(clicks / imps, 4) if imps > 0 else 0
-            cvr  = round(cv / clicks, 4) if clicks > 0 else 0
-            ads_weekly.append({
-                'week': wk,
-                'cost': cost, 'cv': cv, 'cpa': cpa,
-                'clicks': clicks, 'cpc': cpc,
-                'ctr': ctr, 'impressions': imps, 'cvr': cvr
-            })
-
-        # --- キャンペーン別月次データ ---
-        campaign_gaql = f"""
-            SELECT
-                segments.month,
-                campaign.name,
-                metrics.cost_micros,
-                metrics.conversions,
-                metrics.clicks,
-                metrics.impressions
-            FROM campaign
-            WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
-            ORDER BY segments.month DESC, metrics.cost_micros DESC
-        """
-        campaign_rows = query_ads(customer_id, campaign_gaql)
-
-        ads_campaigns = []
-        for row in campaign_rows:
-            m   = row.get('segments', {}).get('month', '')[:7]
-            cam = row.get('campaign', {}).get('name', '')
-            met = row.get('metrics', {})
-            cost   = round(int(met.get('costMicros', 0)) / 1_000_000, 2)
-            cv     = round(float(met.get('conversions', 0)), 2)
-            clicks = int(met.get('clicks', 0))
-            imps   = int(met.get('impressions', 0))
-            cpa    = round(cost / cv, 0) if cv > 0 else 0
-            cpc    = round(cost / clicks, 0) if clicks > 0 else 0
-            ctr    = round(clicks / imps, 4) if imps > 0 else 0
-            cvr    = round(cv / clicks, 4) if clicks > 0 else 0
-            parts  = m.split('-')
-            ym_jp  = f"{parts[0]}年{int(parts[1])}月" if len(parts) == 2 else m
-            ads_campaigns.append({
-                'ym': ym_jp, 'ym_raw': m, 'campaign': cam,
-                'cost': cost, 'cv': cv, 'cpa': cpa,
-                'clicks': clicks, 'cpc': cpc,
-                'ctr': ctr, 'impressions': imps, 'cvr': cvr
-            })
-
-        return jsonify({
+        return data_response({
             "success": True,
             "customer_id": customer_id,
             "start_date": start_date,
             "end_date": end_date,
-            "ads_monthly": ads_monthly,
-            "ads_weekly": ads_weekly,
-            "ads_campaigns": ads_campaigns
-        })
+            **fetch_ads_performance(customer_id, start_date, end_date)
+        }, params.get('format'), params.get('section'))
 
     except Exception as e:
         import traceback
@@ -293,6 +743,226 @@ def get_ads_performance():
             "ads_campaigns": []
         })
 
+# ============================================================
+# MCC配下の全アカウントをまとめて取得
+# ============================================================
+ADS_MCC_WORKERS = int(os.environ.get('ADS_MCC_WORKERS', 8))
+
+def list_mcc_clients(mcc_id):
+    """
+    MCC配下の有効なクライアントアカウント（サブマネージャー配下を含む。マネージャーアカウントを除く）を返す。
+    複数のサブマネージャーにリンクされたアカウントは1件にまとめる
+    """
+    mcc_id = mcc_id.replace('-', '')
+    rows = query_ads(mcc_id, """
+        SELECT
+            customer_client.id,
+            customer_client.descriptive_name,
+            customer_client.currency_code
+        FROM customer_client
+        WHERE customer_client.level >= 1
+            AND customer_client.manager = FALSE
+            AND customer_client.status = 'ENABLED'
+    """, mcc_id)
+    clients = {}
+    for row in rows:
+        client = row.get('customerClient', {})
+        customer_id = str(client.get('id', ''))
+        clients.setdefault(customer_id, {
+            'customer_id': customer_id,
+            'name': client.get('descriptiveName', ''),
+            'currency_code': client.get('currencyCode', '')
+        })
+    return list(clients.values())
+
+def fetch_mcc_performance(mcc_id, start_date, end_date):
+    """
+    MCC配下の各アカウントの fetch_ads_performance を並列に取得する。
+    アカウントごとの失敗は error に入れ、他のアカウントの結果はそのまま返す。
+    """
+    mcc_id = mcc_id.replace('-', '')
+    clients = list_mcc_clients(mcc_id)
+    if not clients:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(clients), ADS_MCC_WORKERS)) as pool:
+        futures = [
+            pool.submit(trace_utils.wrap(fetch_ads_performance), c['customer_id'], start_date, end_date, mcc_id)
+            for c in clients
+        ]
+        customers = []
+        for client, future in zip(clients, futures):
+            try:
+                customers.append({**client, **future.result()})
+            except Exception as e:
+                print(f"Ads API Error ({client['customer_id']}): {e}")
+                customers.append({**client, 'error': str(e), 'ads_monthly': [], 'ads_weekly': [], 'ads_campaigns': []})
+    return customers
+
+@app.route('/ads/mcc-performance', methods=['GET', 'POST'])
+def get_mcc_performance():
+    """
+    MCC配下の全アカウントの月次・週次・キャンペーン別パフォーマンスをまとめて返す。
+    パラメータ: mcc_id（省略時は GOOGLE_ADS_LOGIN_CUSTOMER_ID）, start_date, end_date
+    """
+    try:
+        if request.method == 'POST':
+            params = request.get_json(force=True, silent=True) or {}
+        else:
+            params = request.args
+
+        mcc_id = str(params.get('mcc_id') or GOOGLE_ADS_LOGIN_CUSTOMER_ID or '').replace('-', '')
+        start_date = params.get('start_date', '')
+        end_date = params.get('end_date', '')
+        if not mcc_id or not start_date or not end_date:
+            return jsonify({"success": False, "error": "mcc_id, start_date, end_date が必要です"}), 400
+
+        customers = fetch_mcc_performance(mcc_id, start_date, end_date)
+        return jsonify({
+            "success": True,
+            "mcc_id": mcc_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "customers": customers
+        })
+
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# ============================================================
+# GA4 レポート定義
+# ============================================================
+round1 = partial(round, ndigits=1)
+round4 = partial(round, ndigits=4)
+
+GA4_COMPREHENSIVE_SPECS = [
+    ReportSpec(
+        "summary",
+        metrics=["sessions", "activeUsers", "screenPageViews", "engagementRate", "bounceRate",
+                 "averageSessionDuration", "screenPageViewsPerSession", "keyEvents"],
+        fields=[
+            ("sessions", "sessions", int), ("active_users", "activeUsers", int),
+            ("pageviews", "screenPageViews", int), ("engagement_rate", "engagementRate", float),
+            ("bounce_rate", "bounceRate", float), ("average_session_duration", "averageSessionDuration", float),
+            ("pageviews_per_session", "screenPageViewsPerSession", float), ("key_events", "keyEvents", int),
+        ],
+    ),
+    ReportSpec(
+        "traffic_sources",
+        dimensions=["sessionSource", "sessionMedium"], metrics=["sessions", "activeUsers"],
+        order_bys=["-sessions"], limit=10,
+        fields=[("source", "sessionSource"), ("medium", "sessionMedium"),
+                ("sessions", "sessions", int), ("users", "activeUsers", int)],
+    ),
+    ReportSpec(
+        "devices",
+        dimensions=["deviceCategory"], metrics=["sessions", "activeUsers", "engagementRate"],
+        order_bys=["-sessions"],
+        fields=[("device", "deviceCategory"), ("sessions", "sessions", int),
+                ("users", "activeUsers", int), ("engagement_rate", "engagementRate", float)],
+    ),
+    ReportSpec(
+        "pages",
+        dimensions=["pagePath"], metrics=["screenPageViews", "activeUsers", "averageSessionDuration"],
+        order_bys=["-screenPageViews"], limit=20,
+        fields=[("page_path", "pagePath"), ("pageviews", "screenPageViews", int),
+                ("users", "activeUsers", int), ("avg_session_duration", "averageSessionDuration", float)],
+    ),
+    ReportSpec(
+        "cities",
+        dimensions=["city"], metrics=["sessions", "activeUsers"],
+        order_bys=["-sessions"], limit=10,
+        fields=[("city", "city"), ("sessions", "sessions", int), ("users", "activeUsers", int)],
+    ),
+    ReportSpec(
+        "landing_pages",
+        dimensions=["landingPage"], metrics=["sessions", "bounceRate", "engagementRate"],
+        order_bys=["-sessions"], limit=10,
+        fields=[("landing_page", "landingPage"), ("sessions", "sessions", int),
+                ("bounce_rate", "bounceRate", float), ("engagement_rate", "engagementRate", float)],
+    ),
+    ReportSpec(
+        "events",
+        dimensions=["eventName"], metrics=["eventCount"],
+        order_bys=["-eventCount"], limit=10,
+        fields=[("event_name", "eventName"), ("event_count", "eventCount", int)],
+    ),
+]
+
+# 月別レポート（ReportSpec.name が /ga4/monthly のセクション名になる）
+GA4_MONTHLY_SPECS = [
+    ReportSpec(
+        "monthly_summary",
+        dimensions=["yearMonth"],
+        metrics=["sessions", "activeUsers", "screenPageViews", "bounceRate", "averageSessionDuration", "keyEvents"],
+        order_bys=["yearMonth"],
+        fields=[
+            ("year_month", "yearMonth", ga4_utils.format_year_month),
+            ("sessions", "sessions", int), ("active_users", "activeUsers", int),
+            ("pageviews", "screenPageViews", int), ("bounce_rate", "bounceRate", round4),
+            ("average_session_duration", "averageSessionDuration", round1), ("key_events", "keyEvents", int),
+        ],
+    ),
+    ReportSpec(
+        "monthly_sources",
+        dimensions=["yearMonth", "sessionSource", "sessionMedium"], metrics=["sessions", "activeUsers"],
+        order_bys=["yearMonth", "-sessions"], limit=100,
+        fields=[("year_month", "yearMonth", ga4_utils.format_year_month),
+                ("source", "sessionSource"), ("medium", "sessionMedium"),
+                ("sessions", "sessions", int), ("users", "activeUsers", int)],
+    ),
+    ReportSpec(
+        "monthly_cities",
+        dimensions=["yearMonth", "city"], metrics=["sessions", "activeUsers"],
+        order_bys=["yearMonth", "-sessions"], paginate=True,
+        fields=[("year_month", "yearMonth", ga4_utils.format_year_month), ("city", "city"),
+                ("sessions", "sessions", int), ("users", "activeUsers", int)],
+    ),
+    ReportSpec(
+        "monthly_devices",
+        dimensions=["yearMonth", "deviceCategory"], metrics=["sessions", "activeUsers", "engagementRate"],
+        order_bys=["yearMonth", "-sessions"],
+        fields=[("year_month", "yearMonth", ga4_utils.format_year_month), ("device", "deviceCategory"),
+                ("sessions", "sessions", int), ("users", "activeUsers", int),
+                ("engagement_rate", "engagementRate", round4)],
+    ),
+    ReportSpec(
+        "monthly_pages",
+        dimensions=["yearMonth", "pagePath"], metrics=["screenPageViews", "activeUsers", "averageSessionDuration"],
+        order_bys=["yearMonth", "-screenPageViews"], paginate=True,
+        fields=[("year_month", "yearMonth", ga4_utils.format_year_month), ("page_path", "pagePath"),
+                ("pageviews", "screenPageViews", int), ("users", "activeUsers", int),
+                ("avg_session_duration", "averageSessionDuration", round1)],
+    ),
+    ReportSpec(
+        "monthly_city_sources",
+        dimensions=["yearMonth", "city", "sessionSource", "sessionMedium"], metrics=["sessions", "activeUsers"],
+        order_bys=["yearMonth", "-sessions"], paginate=True,
+        fields=[("year_month", "yearMonth", ga4_utils.format_year_month), ("city", "city"),
+                ("source", "sessionSource"), ("medium", "sessionMedium"),
+                ("sessions", "sessions", int), ("users", "activeUsers", int)],
+    ),
+]
+
+# /ga4/monthly?mode=pivot 用の エンティティ×月 行列（上位N件はGA4側で絞る）
+GA4_MONTHLY_PIVOT_SPECS = [
+    PivotSpec("city_sessions", "city", "sessions", row_limit=50, row_key="city",
+              column_format=ga4_utils.format_year_month),
+    PivotSpec("page_views", "pagePath", "screenPageViews", row_limit=100, row_key="page_path",
+              column_format=ga4_utils.format_year_month),
+]
+# top_cities / top_pages で上書きできる上限
+GA4_PIVOT_MAX_ROWS = 1000
+
+# 月別×イベント名別のキーイベント数
+GA4_KEY_EVENTS_SPEC = ReportSpec(
+    "monthly_key_events",
+    dimensions=["yearMonth", "eventName"], metrics=["keyEvents"],
+    dimension_filter={"filter": {"field_name": "isKeyEvent", "string_filter": {"value": "true"}}},
+    order_bys=["yearMonth", "-keyEvents"],
+    fields=[("year_month", "yearMonth", ga4_utils.format_year_month),
+            ("event_name", "eventName"), ("count", "keyEvents", int)],
+)
+
 @app.route('/ga4/sessions')
 def get_sessions():
     try:
@@ -304,29 +974,31 @@ def get_sessions():
             return jsonify({"success": False, "error": "GA4_PROPERTY_ID が設定されていません"}), 500
         if not SERVICE_ACCOUNT_JSON:
             return jsonify({"success": False, "error": "SERVICE_ACCOUNT_JSON が設定されていません"}), 500
+        validate_ga4_request(property_id, start_date, end_date)
 
-        service_account_info = json.loads(SERVICE_ACCOUNT_JSON)
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        client = BetaAnalyticsDataClient(credentials=credentials)
+        client = get_ga4_client()
+        from google.analytics.data_v1beta.types import RunReportRequest
         request_obj = RunReportRequest(
             property=f"properties/{property_id}",
             date_ranges=[{"start_date": start_date, "end_date": end_date}],
             metrics=[{"name": "sessions"}]
         )
-        response = client.run_report(request_obj)
-        sessions = 0
-        if response.rows:
-            sessions = response.rows[0].metric_values[0].value
+        response = run_ga4_report(client, request_obj)
+        cols = ga4_utils.decode_response(response)
+        sessions = cols["sessions"][0] if len(cols) else 0
         return jsonify({"success": True, "sessions": int(sessions), "start_date": start_date, "end_date": end_date})
 
+    except ga4_utils.InvalidReportError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/ga4/comprehensive')
 def get_comprehensive():
+    """
+    compare_start_date / compare_end_date を指定すると比較期間の同じ集計を compare に入れて返す
+    （比較期間は同じリクエストの2つ目の dateRange として取得する）
+    """
     try:
         property_id = request.args.get('property_id', DEFAULT_PROPERTY_ID)
         start_date = request.args.get('start_date', '7daysAgo')
@@ -336,155 +1008,187 @@ def get_comprehensive():
             return jsonify({"success": False, "error": "GA4_PROPERTY_ID が設定されていません"}), 500
         if not SERVICE_ACCOUNT_JSON:
             return jsonify({"success": False, "error": "SERVICE_ACCOUNT_JSON が設定されていません"}), 500
+        validate_ga4_request(property_id, start_date, end_date)
 
-        service_account_info = json.loads(SERVICE_ACCOUNT_JSON)
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        client = BetaAnalyticsDataClient(credentials=credentials)
-
-        summary_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            metrics=[
-                {"name": "sessions"}, {"name": "activeUsers"},
-                {"name": "screenPageViews"}, {"name": "engagementRate"},
-                {"name": "bounceRate"}, {"name": "averageSessionDuration"},
-                {"name": "screenPageViewsPerSession"}, {"name": "keyEvents"}
-            ]
-        ))
-        summary = {}
-        if summary_response.rows:
-            row = summary_response.rows[0]
-            summary = {
-                "sessions": int(row.metric_values[0].value),
-                "active_users": int(row.metric_values[1].value),
-                "pageviews": int(row.metric_values[2].value),
-                "engagement_rate": float(row.metric_values[3].value),
-                "bounce_rate": float(row.metric_values[4].value),
-                "average_session_duration": float(row.metric_values[5].value),
-                "pageviews_per_session": float(row.metric_values[6].value),
-                "key_events": int(row.metric_values[7].value)
-            }
-
-        source_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "sessionSource"}, {"name": "sessionMedium"}],
-            metrics=[{"name": "sessions"}, {"name": "activeUsers"}],
-            order_bys=[{"metric": {"metric_name": "sessions"}, "desc": True}],
-            limit=10
-        ))
-        traffic_sources = []
-        for row in source_response.rows:
-            traffic_sources.append({
-                "source": row.dimension_values[0].value,
-                "medium": row.dimension_values[1].value,
-                "sessions": int(row.metric_values[0].value),
-                "users": int(row.metric_values[1].value)
-            })
+        try:
+            compare_range = compare_range_param(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
 
-        device_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "deviceCategory"}],
-            metrics=[{"name": "sessions"}, {"name": "activeUsers"}, {"name": "engagementRate"}],
-            order_bys=[{"metric": {"metric_name": "sessions"}, "desc": True}]
-        ))
-        devices = []
-        for row in device_response.rows:
-            devices.append({
-                "device": row.dimension_values[0].value,
-                "sessions": int(row.metric_values[0].value),
-                "users": int(row.metric_values[1].value),
-                "engagement_rate": float(row.metric_values[2].value)
-            })
+        date_ranges = [(start_date, end_date)] + ([compare_range] if compare_range else [])
+        results = run_ga4_specs(property_id, GA4_COMPREHENSIVE_SPECS, *date_ranges)
+        for result in results:
+            result["summary"] = result["summary"][0] if result["summary"] else {}
 
-        page_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "pagePath"}],
-            metrics=[{"name": "screenPageViews"}, {"name": "activeUsers"}, {"name": "averageSessionDuration"}],
-            order_bys=[{"metric": {"metric_name": "screenPageViews"}, "desc": True}],
-            limit=20
-        ))
-        pages = []
-        for row in page_response.rows:
-            pages.append({
-                "page_path": row.dimension_values[0].value,
-                "pageviews": int(row.metric_values[0].value),
-                "users": int(row.metric_values[1].value),
-                "avg_session_duration": float(row.metric_values[2].value)
-            })
-
-        city_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "city"}],
-            metrics=[{"name": "sessions"}, {"name": "activeUsers"}],
-            order_bys=[{"metric": {"metric_name": "sessions"}, "desc": True}],
-            limit=10
-        ))
-        cities = []
-        for row in city_response.rows:
-            cities.append({
-                "city": row.dimension_values[0].value,
-                "sessions": int(row.metric_values[0].value),
-                "users": int(row.metric_values[1].value)
-            })
-
-        landing_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "landingPage"}],
-            metrics=[{"name": "sessions"}, {"name": "bounceRate"}, {"name": "engagementRate"}],
-            order_bys=[{"metric": {"metric_name": "sessions"}, "desc": True}],
-            limit=10
-        ))
-        landing_pages = []
-        for row in landing_response.rows:
-            landing_pages.append({
-                "landing_page": row.dimension_values[0].value,
-                "sessions": int(row.metric_values[0].value),
-                "bounce_rate": float(row.metric_values[1].value),
-                "engagement_rate": float(row.metric_values[2].value)
-            })
-
-        event_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "eventName"}],
-            metrics=[{"name": "eventCount"}],
-            order_bys=[{"metric": {"metric_name": "eventCount"}, "desc": True}],
-            limit=10
-        ))
-        events = []
-        for row in event_response.rows:
-            events.append({
-                "event_name": row.dimension_values[0].value,
-                "event_count": int(row.metric_values[0].value)
-            })
-
-        return jsonify({
+        response = {
             "success": True,
             "property_id": property_id,
             "start_date": start_date,
             "end_date": end_date,
-            "summary": summary,
-            "traffic_sources": traffic_sources,
-            "devices": devices,
-            "pages": pages,
-            "cities": cities,
-            "landing_pages": landing_pages,
-            "events": events
-        })
+            **results[0]
+        }
+        if compare_range:
+            response["compare"] = {
+                "start_date": compare_range[0],
+                "end_date": compare_range[1],
+                **results[1]
+            }
+        return jsonify(response)
 
+    except ga4_utils.InvalidReportError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+GA4_MONTHLY_SECTIONS = [spec.name for spec in GA4_MONTHLY_SPECS]
+
+def ga4_monthly_sections(compare_range=None):
+    """比較期間がある場合は compare_ 付きのセクションが後ろに並ぶ"""
+    if compare_range:
+        return GA4_MONTHLY_SECTIONS + [f"compare_{section}" for section in GA4_MONTHLY_SECTIONS]
+    return list(GA4_MONTHLY_SECTIONS)
+
+# 月ごとの上位N件を指定するクエリパラメータ
+GA4_MONTHLY_TOP_PARAMS = {
+    "monthly_sources": "top_sources_per_month",
+    "monthly_cities": "top_cities_per_month",
+    "monthly_pages": "top_pages_per_month",
+    "monthly_city_sources": "top_city_sources_per_month",
+}
+# top_*_per_month の上限（GA4 の1リクエストの limit の上限）
+GA4_MAX_ROW_LIMIT = 250000
+
+def ga4_monthly_filters(args):
+    """
+    cities（カンマ区切り）/ page_path_prefix / page_path_regex / sources（カンマ区切り）を
+    GA4 のディメンションフィルタ式のリストにする
+    """
+    filters = []
+    cities = _as_list(args.get('cities'))
+    if cities:
+        filters.append(ga4_utils.in_list_filter("city", cities))
+    page_path_prefix = args.get('page_path_prefix')
+    if page_path_prefix:
+        filters.append(ga4_utils.string_filter("pagePath", page_path_prefix, "BEGINS_WITH"))
+    page_path_regex = args.get('page_path_regex')
+    if page_path_regex:
+        try:
+            re.compile(page_path_regex)
+        except re.error as e:
+            raise ValueError(f"page_path_regex が正規表現として不正です: {e}")
+        filters.append(ga4_utils.string_filter("pagePath", page_path_regex, "PARTIAL_REGEXP"))
+    sources = _as_list(args.get('sources'))
+    if sources:
+        filters.append(ga4_utils.in_list_filter("sessionSource", sources))
+    return filters
+
+def ga4_monthly_specs(args, filters=()):
+    """フィルタと月ごとの上位N件（top_*_per_month）を GA4_MONTHLY_SPECS に反映する"""
+    specs = []
+    for spec in GA4_MONTHLY_SPECS:
+        spec = ga4_utils.apply_filters(spec, filters)
+        param = GA4_MONTHLY_TOP_PARAMS.get(spec.name)
+        value = args.get(param) if param else None
+        if value is not None:
+            if not value.isdigit() or not 1 <= int(value) <= GA4_MAX_ROW_LIMIT:
+                raise ValueError(f"{param} は1〜{GA4_MAX_ROW_LIMIT}の整数で指定してください")
+            spec = spec.replace(limit=int(value), per_month=True, paginate=False)
+        specs.append(spec)
+    return specs
+
+def iter_ga4_monthly(property_id, start_date, end_date, compare_range=None, specs=None):
+    """
+    月別サマリーと月別×流入元/都市/デバイス/ページ/都市×流入元の内訳を
+    GA4 から1ページ届くごとに (セクション名, 行) の形で返すイテレータ（全行をメモリに持たない）。
+    セクションは GA4_MONTHLY_SECTIONS の順。compare_range (start, end) を指定すると
+    比較期間の行を compare_<セクション名> で返す（同じリクエストで取れる場合は同じページの中で続けて返す）。
+    specs で GA4_MONTHLY_SPECS を差し替えられる（ga4_monthly_specs の結果）。
+    プロパティ・指標名の検証は呼び出した時点で行う。
+    """
+    date_ranges = [(start_date, end_date)] + ([compare_range] if compare_range else [])
+    rows = iter_ga4_specs(property_id, specs or GA4_MONTHLY_SPECS, *date_ranges)
+    return ((("compare_" if i else "") + section, row) for i, section, row in rows)
+
+def fetch_ga4_monthly(property_id, start_date, end_date, compare_range=None, specs=None):
+    """全セクションをまとめて取得してセクションごとのリストで返す（GA4 レポートの TTLCache を使う）"""
+    date_ranges = [(start_date, end_date)] + ([compare_range] if compare_range else [])
+    results = run_ga4_specs(property_id, specs or GA4_MONTHLY_SPECS, *date_ranges)
+    return {
+        prefix + section: result[section]
+        for prefix, result in zip(("", "compare_"), results)
+        for section in GA4_MONTHLY_SECTIONS
+    }
+
+def stream_ga4_monthly_ndjson(property_id, start_date, end_date, compare_range=None, specs=None):
+    """
+    /ga4/monthly?format=ndjson 用のストリーミングレスポンス。
+    1行目に meta、以降 GA4 から届いた順に row、最後に end（エラー時は error）を1行ずつ返す。
+    検証エラーはレスポンスを返す前に InvalidReportError になる。
+    """
+    sections = ga4_monthly_sections(compare_range)
+    rows = iter_ga4_monthly(property_id, start_date, end_date, compare_range, specs)
+
+    def generate():
+        meta = {
+            "type": "meta", "property_id": property_id,
+            "start_date": start_date, "end_date": end_date,
+            "sections": sections
+        }
+        if compare_range:
+            meta["compare_start_date"], meta["compare_end_date"] = compare_range
+        yield app.json.dumps(meta) + "\n"
+        counts = {section: 0 for section in sections}
+        try:
+            for section, row in rows:
+                counts[section] += 1
+                yield app.json.dumps({"type": "row", "section": section, "row": row}) + "\n"
+        except Exception as e:
+            # ヘッダー送信後はステータスコードを変えられないため error 行で通知する
+            yield app.json.dumps({"type": "error", "success": False, "error": str(e)}) + "\n"
+            return
+        yield app.json.dumps({"type": "end", "success": True, "counts": counts}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def ga4_monthly_pivot_response(property_id, start_date, end_date, filters=()):
+    """
+    /ga4/monthly?mode=pivot のレスポンス。
+    city_sessions / page_views は1行=1エンティティで、月（YYYY-MM）ごとの値と合計を持つ。
+    """
+    limits = {"city_sessions": request.args.get('top_cities'), "page_views": request.args.get('top_pages')}
+    specs = []
+    for spec in GA4_MONTHLY_PIVOT_SPECS:
+        spec = ga4_utils.apply_filters(spec, filters)
+        limit = limits.get(spec.name)
+        if limit is not None:
+            if not limit.isdigit() or not 1 <= int(limit) <= GA4_PIVOT_MAX_ROWS:
+                return jsonify({"success": False, "error": f"top_cities / top_pages は1〜{GA4_PIVOT_MAX_ROWS}で指定してください"}), 400
+            spec = spec.replace(row_limit=int(limit))
+        specs.append(spec)
+
+    pivots = run_ga4_pivot_specs(property_id, specs, start_date, end_date)
+    months = sorted(set().union(*(p["columns"] for p in pivots.values())))
+    return data_response({
+        "success": True,
+        "property_id": property_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "months": months,
+        **{name: p["rows"] for name, p in pivots.items()}
+    }, request.args.get('format'), request.args.get('section'))
+
 @app.route('/ga4/monthly')
 def get_monthly():
+    """
+    format=ndjson を指定すると行ごとのストリーミング（NDJSON）で返す。
+    format=columnar / arrow / parquet（+ section）で列指向フォーマットも選べる。
+    compare_start_date / compare_end_date を指定すると比較期間を compare_<セクション名> で返す。
+    mode=pivot を指定すると 都市×月 / ページ×月 の行列（top_cities / top_pages 件）を返す（比較期間・ndjson とは併用不可）。
+
+    絞り込み（GA4 のディメンションフィルタとして送る。該当ディメンションを持つセクションだけに効く）:
+      cities=川口市,草加市 / page_path_prefix=/works/ / page_path_regex=^/(contact|thanks) / sources=google,yahoo
+    月ごとの上位N件: top_sources_per_month / top_cities_per_month / top_pages_per_month / top_city_sources_per_month
+    """
     try:
         property_id = request.args.get('property_id', DEFAULT_PROPERTY_ID)
         start_date = request.args.get('start_date', '2025-01-01')
@@ -494,189 +1198,46 @@ def get_monthly():
             return jsonify({"success": False, "error": "GA4_PROPERTY_ID が設定されていません"}), 500
         if not SERVICE_ACCOUNT_JSON:
             return jsonify({"success": False, "error": "SERVICE_ACCOUNT_JSON が設定されていません"}), 500
+        validate_ga4_request(property_id, start_date, end_date)
 
-        service_account_info = json.loads(SERVICE_ACCOUNT_JSON)
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        client = BetaAnalyticsDataClient(credentials=credentials)
+        try:
+            compare_range = compare_range_param(request.args)
+            filters = ga4_monthly_filters(request.args)
+            specs = ga4_monthly_specs(request.args, filters)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
 
-        # 月別サマリー
-        monthly_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "yearMonth"}],
-            metrics=[
-                {"name": "sessions"}, {"name": "activeUsers"},
-                {"name": "screenPageViews"}, {"name": "bounceRate"},
-                {"name": "averageSessionDuration"}, {"name": "keyEvents"}
-            ],
-            order_bys=[{"dimension": {"dimension_name": "yearMonth"}, "desc": False}]
-        ))
-        monthly_summary = []
-        for row in monthly_response.rows:
-            ym = row.dimension_values[0].value  # "202501"
-            monthly_summary.append({
-                "year_month": f"{ym[:4]}-{ym[4:]}",
-                "sessions": int(row.metric_values[0].value),
-                "active_users": int(row.metric_values[1].value),
-                "pageviews": int(row.metric_values[2].value),
-                "bounce_rate": round(float(row.metric_values[3].value), 4),
-                "average_session_duration": round(float(row.metric_values[4].value), 1),
-                "key_events": int(row.metric_values[5].value)
-            })
+        if request.args.get('mode') == 'pivot':
+            if compare_range or request.args.get('format') == 'ndjson':
+                return jsonify({"success": False, "error": "mode=pivot は compare_start_date / compare_end_date・format=ndjson と併用できません"}), 400
+            return ga4_monthly_pivot_response(property_id, start_date, end_date, filters)
 
-        # 月別×流入元
-        source_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "yearMonth"}, {"name": "sessionSource"}, {"name": "sessionMedium"}],
-            metrics=[{"name": "sessions"}, {"name": "activeUsers"}],
-            order_bys=[
-                {"dimension": {"dimension_name": "yearMonth"}, "desc": False},
-                {"metric": {"metric_name": "sessions"}, "desc": True}
-            ],
-            limit=100
-        ))
-        monthly_sources = []
-        for row in source_response.rows:
-            ym = row.dimension_values[0].value
-            monthly_sources.append({
-                "year_month": f"{ym[:4]}-{ym[4:]}",
-                "source": row.dimension_values[1].value,
-                "medium": row.dimension_values[2].value,
-                "sessions": int(row.metric_values[0].value),
-                "users": int(row.metric_values[1].value)
-            })
+        if request.args.get('format') == 'ndjson':
+            return stream_ga4_monthly_ndjson(property_id, start_date, end_date, compare_range, specs)
 
-        # 月別×都市（ページネーション対応）
-        monthly_cities = []
-        offset = 0
-        page_size = 10000
-        while True:
-            city_response = client.run_report(RunReportRequest(
-                property=f"properties/{property_id}",
-                date_ranges=[{"start_date": start_date, "end_date": end_date}],
-                dimensions=[{"name": "yearMonth"}, {"name": "city"}],
-                metrics=[{"name": "sessions"}, {"name": "activeUsers"}],
-                order_bys=[
-                    {"dimension": {"dimension_name": "yearMonth"}, "desc": False},
-                    {"metric": {"metric_name": "sessions"}, "desc": True}
-                ],
-                limit=page_size,
-                offset=offset
-            ))
-            for row in city_response.rows:
-                ym = row.dimension_values[0].value
-                monthly_cities.append({
-                    "year_month": f"{ym[:4]}-{ym[4:]}",
-                    "city": row.dimension_values[1].value,
-                    "sessions": int(row.metric_values[0].value),
-                    "users": int(row.metric_values[1].value)
-                })
-            if len(city_response.rows) < page_size:
-                break
-            offset += page_size
-
-        # 月別×デバイス
-        device_response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "yearMonth"}, {"name": "deviceCategory"}],
-            metrics=[{"name": "sessions"}, {"name": "activeUsers"}, {"name": "engagementRate"}],
-            order_bys=[
-                {"dimension": {"dimension_name": "yearMonth"}, "desc": False},
-                {"metric": {"metric_name": "sessions"}, "desc": True}
-            ]
-        ))
-        monthly_devices = []
-        for row in device_response.rows:
-            ym = row.dimension_values[0].value
-            monthly_devices.append({
-                "year_month": f"{ym[:4]}-{ym[4:]}",
-                "device": row.dimension_values[1].value,
-                "sessions": int(row.metric_values[0].value),
-                "users": int(row.metric_values[1].value),
-                "engagement_rate": round(float(row.metric_values[2].value), 4)
-            })
-
-        # 月別×ページ別（ページネーション対応）
-        monthly_pages = []
-        offset = 0
-        page_size = 10000
-        while True:
-            page_response = client.run_report(RunReportRequest(
-                property=f"properties/{property_id}",
-                date_ranges=[{"start_date": start_date, "end_date": end_date}],
-                dimensions=[{"name": "yearMonth"}, {"name": "pagePath"}],
-                metrics=[{"name": "screenPageViews"}, {"name": "activeUsers"}, {"name": "averageSessionDuration"}],
-                order_bys=[
-                    {"dimension": {"dimension_name": "yearMonth"}, "desc": False},
-                    {"metric": {"metric_name": "screenPageViews"}, "desc": True}
-                ],
-                limit=page_size,
-                offset=offset
-            ))
-            for row in page_response.rows:
-                ym = row.dimension_values[0].value
-                monthly_pages.append({
-                    "year_month": f"{ym[:4]}-{ym[4:]}",
-                    "page_path": row.dimension_values[1].value,
-                    "pageviews": int(row.metric_values[0].value),
-                    "users": int(row.metric_values[1].value),
-                    "avg_session_duration": round(float(row.metric_values[2].value), 1)
-                })
-            if len(page_response.rows) < page_size:
-                break
-            offset += page_size
-
-        # 月別×都市×流入元（ページネーション対応）
-        monthly_city_sources = []
-        offset = 0
-        while True:
-            city_src_response = client.run_report(RunReportRequest(
-                property=f"properties/{property_id}",
-                date_ranges=[{"start_date": start_date, "end_date": end_date}],
-                dimensions=[{"name": "yearMonth"}, {"name": "city"}, {"name": "sessionSource"}, {"name": "sessionMedium"}],
-                metrics=[{"name": "sessions"}, {"name": "activeUsers"}],
-                order_bys=[
-                    {"dimension": {"dimension_name": "yearMonth"}, "desc": False},
-                    {"metric": {"metric_name": "sessions"}, "desc": True}
-                ],
-                limit=page_size,
-                offset=offset
-            ))
-            for row in city_src_response.rows:
-                ym = row.dimension_values[0].value
-                monthly_city_sources.append({
-                    "year_month": f"{ym[:4]}-{ym[4:]}",
-                    "city": row.dimension_values[1].value,
-                    "source": row.dimension_values[2].value,
-                    "medium": row.dimension_values[3].value,
-                    "sessions": int(row.metric_values[0].value),
-                    "users": int(row.metric_values[1].value)
-                })
-            if len(city_src_response.rows) < page_size:
-                break
-            offset += page_size
+        monthly = fetch_ga4_monthly(property_id, start_date, end_date, compare_range, specs)
 
-        return jsonify({
+        payload = {
             "success": True,
             "property_id": property_id,
             "start_date": start_date,
             "end_date": end_date,
-            "monthly_summary": monthly_summary,
-            "monthly_sources": monthly_sources,
-            "monthly_cities": monthly_cities,
-            "monthly_devices": monthly_devices,
-            "monthly_pages": monthly_pages,
-            "monthly_city_sources": monthly_city_sources
-        })
+        }
+        if compare_range:
+            payload["compare_start_date"], payload["compare_end_date"] = compare_range
+        payload.update(monthly)
+        return data_response(payload, request.args.get('format'), request.args.get('section'))
 
+    except ga4_utils.InvalidReportError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+def fetch_ga4_key_events(property_id, start_date, end_date):
+    """月別×イベント名別のキーイベント件数を取得する"""
+    result, = run_ga4_specs(property_id, [GA4_KEY_EVENTS_SPEC], (start_date, end_date))
+    return result[GA4_KEY_EVENTS_SPEC.name]
+
 @app.route('/ga4/key-events')
 def get_key_events():
     """月別×イベント名別のキーイベント件数を返す"""
@@ -689,42 +1250,9 @@ def get_key_events():
             return jsonify({"success": False, "error": "GA4_PROPERTY_ID が設定されていません"}), 500
         if not SERVICE_ACCOUNT_JSON:
             return jsonify({"success": False, "error": "SERVICE_ACCOUNT_JSON が設定されていません"}), 500
+        validate_ga4_request(property_id, start_date, end_date)
 
-        service_account_info = json.loads(SERVICE_ACCOUNT_JSON)
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly']
-        )
-        client = BetaAnalyticsDataClient(credentials=credentials)
-
-        from google.analytics.data_v1beta.types import FilterExpression, Filter
-
-        # 月別×イベント名別のキーイベント数
-        response = client.run_report(RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[{"start_date": start_date, "end_date": end_date}],
-            dimensions=[{"name": "yearMonth"}, {"name": "eventName"}],
-            metrics=[{"name": "keyEvents"}],
-            dimension_filter=FilterExpression(
-                filter=Filter(
-                    field_name="isKeyEvent",
-                    string_filter=Filter.StringFilter(value="true")
-                )
-            ),
-            order_bys=[
-                {"dimension": {"dimension_name": "yearMonth"}, "desc": False},
-                {"metric": {"metric_name": "keyEvents"}, "desc": True}
-            ]
-        ))
-
-        monthly_key_events = []
-        for row in response.rows:
-            ym = row.dimension_values[0].value
-            monthly_key_events.append({
-                "year_month": f"{ym[:4]}-{ym[4:]}",
-                "event_name": row.dimension_values[1].value,
-                "count": int(row.metric_values[0].value)
-            })
+        monthly_key_events = fetch_ga4_key_events(property_id, start_date, end_date)
 
         return jsonify({
             "success": True,
@@ -734,6 +1262,8 @@ def get_key_events():
             "monthly_key_events": monthly_key_events
         })
 
+    except ga4_utils.InvalidReportError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -750,18 +1280,9 @@ def get_gsc_queries():
         if not all([GSC_REFRESH_TOKEN, GSC_CLIENT_ID, GSC_CLIENT_SECRET]):
             return jsonify({"success": False, "error": "GSC環境変数が設定されていません"}), 500
 
-        creds = Credentials(
-            token=None, refresh_token=GSC_REFRESH_TOKEN,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=GSC_CLIENT_ID, client_secret=GSC_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        service = build('searchconsole', 'v1', credentials=creds)
+        service = get_gsc_service()
 
-        summary_response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={'startDate': start_date, 'endDate': end_date}
-        ).execute()
+        summary_response = query_gsc(service, site_url, {'startDate': start_date, 'endDate': end_date})
 
         summary = {'total_clicks': 0, 'total_impressions': 0, 'average_ctr': 0, 'average_position': 0}
         if summary_response.get('rows'):
@@ -773,10 +1294,7 @@ def get_gsc_queries():
                 'average_position': round(row['position'], 1)
             }
 
-        detail_response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={'startDate': start_date, 'endDate': end_date, 'dimensions': ['query'], 'rowLimit': limit}
-        ).execute()
+        detail_response = query_gsc(service, site_url, {'startDate': start_date, 'endDate': end_date, 'dimensions': ['query'], 'rowLimit': limit})
 
         queries = []
         for row in detail_response.get('rows', []):
@@ -800,6 +1318,104 @@ def get_gsc_queries():
             return jsonify({"success": False, "error": "トークンが無効です", "error_type": "TOKEN_EXPIRED"}), 401
         return jsonify({"success": False, "error": error_message}), 500
 
+def fetch_gsc_area_queries(site_url, start_date, end_date, areas):
+    """商圏（市区町村）ごとの「外壁塗装」「屋根塗装」クエリ実績を月別に集計する"""
+    cities = []
+    for a in areas:
+        parts = a.split()
+        city = parts[-1] if len(parts) > 1 else a
+        if city:
+            cities.append(city)
+
+    service = get_gsc_service()
+
+    regex_pattern = "(" + "|".join(cities) + ")"
+    response = query_gsc(service, site_url, {
+        'startDate': start_date,
+        'endDate': end_date,
+        'dimensions': ['date', 'query'],
+        'dimensionFilterGroups': [{
+            'filters': [{
+                'dimension': 'query',
+                'operator': 'includingRegex',
+                'expression': regex_pattern
+            }]
+        }],
+        'rowLimit': 25000
+    })
+
+    from collections import defaultdict
+    # monthly_data[ym][city] = {'gaiheki': {...}, 'yane': {...}}
+    monthly_data = defaultdict(lambda: defaultdict(lambda: {
+        'gaiheki': {'clicks': 0, 'impressions': 0, 'pos_imp': 0},
+        'yane': {'clicks': 0, 'impressions': 0, 'pos_imp': 0}
+    }))
+
+    for row in response.get('rows', []):
+        date_str = row['keys'][0]
+        ym = date_str[:7]
+        query = row['keys'][1].replace('　', ' ')
+        
+        for city in cities:
+            q_gaiheki = f"{city} 外壁塗装"
+            q_gaiheki2 = f"{city}外壁塗装"
+            q_yane = f"{city} 屋根塗装"
+            q_yane2 = f"{city}屋根塗装"
+            
+            if query in [q_gaiheki, q_gaiheki2]:
+                d = monthly_data[ym][city]['gaiheki']
+                d['clicks'] += row['clicks']
+                d['impressions'] += row['impressions']
+                d['pos_imp'] += row['position'] * row['impressions']
+            elif query in [q_yane, q_yane2]:
+                d = monthly_data[ym][city]['yane']
+                d['clicks'] += row['clicks']
+                d['impressions'] += row['impressions']
+                d['pos_imp'] += row['position'] * row['impressions']
+
+    import datetime
+
+    s_dt = datetime.datetime.strptime(start_date[:7], '%Y-%m')
+    e_dt = datetime.datetime.strptime(end_date[:7], '%Y-%m')
+    ym_list = []
+    curr = s_dt
+    while curr <= e_dt:
+        ym_list.append(curr.strftime('%Y-%m'))
+        month = curr.month % 12 + 1
+        year = curr.year + (curr.month // 12)
+        curr = curr.replace(year=year, month=month)
+    ym_list.reverse()
+
+    area_queries = []
+    for ym in ym_list:
+        areas_list = []
+        for city in cities:
+            city_data = monthly_data[ym][city]
+            
+            def calc_metrics(d):
+                clicks = d['clicks']
+                imps = d['impressions']
+                ctr = round((clicks / imps) * 100, 2) if imps > 0 else 0.0
+                pos = round(d['pos_imp'] / imps, 1) if imps > 0 else 0.0
+                return {'clicks': clicks, 'impressions': imps, 'ctr': ctr, 'position': pos}
+            
+            g_metrics = calc_metrics(city_data['gaiheki'])
+            y_metrics = calc_metrics(city_data['yane'])
+            
+            areas_list.append({
+                'area': city,
+                'queries': [
+                    {'query': f"{city} 外壁塗装", **g_metrics},
+                    {'query': f"{city} 屋根塗装", **y_metrics}
+                ]
+            })
+        area_queries.append({
+            'year_month': ym,
+            'areas': areas_list
+        })
+
+    return area_queries
+
 @app.route('/gsc/area_queries', methods=['GET', 'POST'])
 def get_gsc_area_queries():
     try:
@@ -828,109 +1444,8 @@ def get_gsc_area_queries():
         if not areas:
             return jsonify({"success": False, "error": "areas が必要です"}), 400
 
-        cities = []
-        for a in areas:
-            parts = a.split()
-            city = parts[-1] if len(parts) > 1 else a
-            if city:
-                cities.append(city)
-
-        creds = Credentials(
-            token=None, refresh_token=GSC_REFRESH_TOKEN,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=GSC_CLIENT_ID, client_secret=GSC_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        service = build('searchconsole', 'v1', credentials=creds)
-
-        regex_pattern = "(" + "|".join(cities) + ")"
-        response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={
-                'startDate': start_date,
-                'endDate': end_date,
-                'dimensions': ['date', 'query'],
-                'dimensionFilterGroups': [{
-                    'filters': [{
-                        'dimension': 'query',
-                        'operator': 'includingRegex',
-                        'expression': regex_pattern
-                    }]
-                }],
-                'rowLimit': 25000
-            }
-        ).execute()
-
-        from collections import defaultdict
-        # monthly_data[ym][city] = {'gaiheki': {...}, 'yane': {...}}
-        monthly_data = defaultdict(lambda: defaultdict(lambda: {
-            'gaiheki': {'clicks': 0, 'impressions': 0, 'pos_imp': 0},
-            'yane': {'clicks': 0, 'impressions': 0, 'pos_imp': 0}
-        }))
-
-        for row in response.get('rows', []):
-            date_str = row['keys'][0]
-            ym = date_str[:7]
-            query = row['keys'][1].replace('　', ' ')
-            
-            for city in cities:
-                q_gaiheki = f"{city} 外壁塗装"
-                q_gaiheki2 = f"{city}外壁塗装"
-                q_yane = f"{city} 屋根塗装"
-                q_yane2 = f"{city}屋根塗装"
-                
-                if query in [q_gaiheki, q_gaiheki2]:
-                    d = monthly_data[ym][city]['gaiheki']
-                    d['clicks'] += row['clicks']
-                    d['impressions'] += row['impressions']
-                    d['pos_imp'] += row['position'] * row['impressions']
-                elif query in [q_yane, q_yane2]:
-                    d = monthly_data[ym][city]['yane']
-                    d['clicks'] += row['clicks']
-                    d['impressions'] += row['impressions']
-                    d['pos_imp'] += row['position'] * row['impressions']
-
-        import datetime
-
-        s_dt = datetime.datetime.strptime(start_date[:7], '%Y-%m')
-        e_dt = datetime.datetime.strptime(end_date[:7], '%Y-%m')
-        ym_list = []
-        curr = s_dt
-        while curr <= e_dt:
-            ym_list.append(curr.strftime('%Y-%m'))
-            month = curr.month % 12 + 1
-            year = curr.year + (curr.month // 12)
-            curr = curr.replace(year=year, month=month)
-        ym_list.reverse()
-
-        area_queries = []
-        for ym in ym_list:
-            areas_list = []
-            for city in cities:
-                city_data = monthly_data[ym][city]
-                
-                def calc_metrics(d):
-                    clicks = d['clicks']
-                    imps = d['impressions']
-                    ctr = round((clicks / imps) * 100, 2) if imps > 0 else 0.0
-                    pos = round(d['pos_imp'] / imps, 1) if imps > 0 else 0.0
-                    return {'clicks': clicks, 'impressions': imps, 'ctr': ctr, 'position': pos}
-                
-                g_metrics = calc_metrics(city_data['gaiheki'])
-                y_metrics = calc_metrics(city_data['yane'])
-                
-                areas_list.append({
-                    'area': city,
-                    'queries': [
-                        {'query': f"{city} 外壁塗装", **g_metrics},
-                        {'query': f"{city} 屋根塗装", **y_metrics}
-                    ]
-                })
-            area_queries.append({
-                'year_month': ym,
-                'areas': areas_list
-            })
-            
+        area_queries = fetch_gsc_area_queries(site_url, start_date, end_date, areas)
+
         return jsonify({
             "success": True,
             "site_url": site_url,
@@ -956,18 +1471,9 @@ def get_gsc_pages():
         if not all([GSC_REFRESH_TOKEN, GSC_CLIENT_ID, GSC_CLIENT_SECRET]):
             return jsonify({"success": False, "error": "GSC環境変数が設定されていません"}), 500
 
-        creds = Credentials(
-            token=None, refresh_token=GSC_REFRESH_TOKEN,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=GSC_CLIENT_ID, client_secret=GSC_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        service = build('searchconsole', 'v1', credentials=creds)
+        service = get_gsc_service()
 
-        summary_response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={'startDate': start_date, 'endDate': end_date}
-        ).execute()
+        summary_response = query_gsc(service, site_url, {'startDate': start_date, 'endDate': end_date})
 
         summary = {'total_clicks': 0, 'total_impressions': 0, 'average_ctr': 0, 'average_position': 0}
         if summary_response.get('rows'):
@@ -979,10 +1485,7 @@ def get_gsc_pages():
                 'average_position': round(row['position'], 1)
             }
 
-        detail_response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={'startDate': start_date, 'endDate': end_date, 'dimensions': ['page'], 'rowLimit': limit}
-        ).execute()
+        detail_response = query_gsc(service, site_url, {'startDate': start_date, 'endDate': end_date, 'dimensions': ['page'], 'rowLimit': limit})
 
         pages = []
         for row in detail_response.get('rows', []):
@@ -1006,6 +1509,81 @@ def get_gsc_pages():
             return jsonify({"success": False, "error": "トークンが無効です", "error_type": "TOKEN_EXPIRED"}), 401
         return jsonify({"success": False, "error": error_message}), 500
 
+def fetch_gsc_monthly(site_url, start_date, end_date, limit=20):
+    """月別サマリーと月別クエリランキング（上位limit件）を取得する"""
+    service = get_gsc_service()
+
+    # 月別クエリ
+    monthly_queries_response = query_gsc(service, site_url, {
+        'startDate': start_date,
+        'endDate': end_date,
+        'dimensions': ['date', 'query'],
+        'rowLimit': 500
+    })
+
+    # 月別に集計
+    from collections import defaultdict
+    monthly_query_data = defaultdict(lambda: defaultdict(lambda: {'clicks': 0, 'impressions': 0, 'position_sum': 0, 'count': 0}))
+    for row in monthly_queries_response.get('rows', []):
+        date_str = row['keys'][0]  # "2025-12-01"
+        ym = date_str[:7]  # "2025-12"
+        query = row['keys'][1]
+        monthly_query_data[ym][query]['clicks'] += row['clicks']
+        monthly_query_data[ym][query]['impressions'] += row['impressions']
+        monthly_query_data[ym][query]['position_sum'] += row['position']
+        monthly_query_data[ym][query]['count'] += 1
+
+    # 月別クエリランキング（上位limit件）
+    monthly_queries = []
+    for ym in sorted(monthly_query_data.keys()):
+        queries_sorted = sorted(
+            monthly_query_data[ym].items(),
+            key=lambda x: x[1]['clicks'],
+            reverse=True
+        )[:limit]
+        for query, data in queries_sorted:
+            avg_pos = data['position_sum'] / data['count'] if data['count'] > 0 else 0
+            ctr = data['clicks'] / data['impressions'] * 100 if data['impressions'] > 0 else 0
+            monthly_queries.append({
+                'year_month': ym,
+                'query': query,
+                'clicks': data['clicks'],
+                'impressions': data['impressions'],
+                'ctr': round(ctr, 2),
+                'position': round(avg_pos, 1)
+            })
+
+    # 月別サマリー
+    monthly_summary_response = query_gsc(service, site_url, {
+        'startDate': start_date,
+        'endDate': end_date,
+        'dimensions': ['date'],
+        'rowLimit': 500
+    })
+
+    monthly_summary_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0, 'position_sum': 0, 'count': 0})
+    for row in monthly_summary_response.get('rows', []):
+        ym = row['keys'][0][:7]
+        monthly_summary_data[ym]['clicks'] += row['clicks']
+        monthly_summary_data[ym]['impressions'] += row['impressions']
+        monthly_summary_data[ym]['position_sum'] += row['position']
+        monthly_summary_data[ym]['count'] += 1
+
+    monthly_summary = []
+    for ym in sorted(monthly_summary_data.keys()):
+        d = monthly_summary_data[ym]
+        avg_pos = d['position_sum'] / d['count'] if d['count'] > 0 else 0
+        ctr = d['clicks'] / d['impressions'] * 100 if d['impressions'] > 0 else 0
+        monthly_summary.append({
+            'year_month': ym,
+            'clicks': d['clicks'],
+            'impressions': d['impressions'],
+            'ctr': round(ctr, 2),
+            'position': round(avg_pos, 1)
+        })
+
+    return monthly_summary, monthly_queries
+
 @app.route('/gsc/monthly')
 def get_gsc_monthly():
     try:
@@ -1019,97 +1597,16 @@ def get_gsc_monthly():
         if not all([GSC_REFRESH_TOKEN, GSC_CLIENT_ID, GSC_CLIENT_SECRET]):
             return jsonify({"success": False, "error": "GSC環境変数が設定されていません"}), 500
 
-        creds = Credentials(
-            token=None, refresh_token=GSC_REFRESH_TOKEN,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=GSC_CLIENT_ID, client_secret=GSC_CLIENT_SECRET,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
-        )
-        service = build('searchconsole', 'v1', credentials=creds)
-
-        # 月別クエリ
-        monthly_queries_response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={
-                'startDate': start_date,
-                'endDate': end_date,
-                'dimensions': ['date', 'query'],
-                'rowLimit': 500
-            }
-        ).execute()
-
-        # 月別に集計
-        from collections import defaultdict
-        monthly_query_data = defaultdict(lambda: defaultdict(lambda: {'clicks': 0, 'impressions': 0, 'position_sum': 0, 'count': 0}))
-        for row in monthly_queries_response.get('rows', []):
-            date_str = row['keys'][0]  # "2025-12-01"
-            ym = date_str[:7]  # "2025-12"
-            query = row['keys'][1]
-            monthly_query_data[ym][query]['clicks'] += row['clicks']
-            monthly_query_data[ym][query]['impressions'] += row['impressions']
-            monthly_query_data[ym][query]['position_sum'] += row['position']
-            monthly_query_data[ym][query]['count'] += 1
-
-        # 月別クエリランキング（上位limit件）
-        monthly_queries = []
-        for ym in sorted(monthly_query_data.keys()):
-            queries_sorted = sorted(
-                monthly_query_data[ym].items(),
-                key=lambda x: x[1]['clicks'],
-                reverse=True
-            )[:limit]
-            for query, data in queries_sorted:
-                avg_pos = data['position_sum'] / data['count'] if data['count'] > 0 else 0
-                ctr = data['clicks'] / data['impressions'] * 100 if data['impressions'] > 0 else 0
-                monthly_queries.append({
-                    'year_month': ym,
-                    'query': query,
-                    'clicks': data['clicks'],
-                    'impressions': data['impressions'],
-                    'ctr': round(ctr, 2),
-                    'position': round(avg_pos, 1)
-                })
-
-        # 月別サマリー
-        monthly_summary_response = service.searchanalytics().query(
-            siteUrl=site_url,
-            body={
-                'startDate': start_date,
-                'endDate': end_date,
-                'dimensions': ['date'],
-                'rowLimit': 500
-            }
-        ).execute()
-
-        monthly_summary_data = defaultdict(lambda: {'clicks': 0, 'impressions': 0, 'position_sum': 0, 'count': 0})
-        for row in monthly_summary_response.get('rows', []):
-            ym = row['keys'][0][:7]
-            monthly_summary_data[ym]['clicks'] += row['clicks']
-            monthly_summary_data[ym]['impressions'] += row['impressions']
-            monthly_summary_data[ym]['position_sum'] += row['position']
-            monthly_summary_data[ym]['count'] += 1
-
-        monthly_summary = []
-        for ym in sorted(monthly_summary_data.keys()):
-            d = monthly_summary_data[ym]
-            avg_pos = d['position_sum'] / d['count'] if d['count'] > 0 else 0
-            ctr = d['clicks'] / d['impressions'] * 100 if d['impressions'] > 0 else 0
-            monthly_summary.append({
-                'year_month': ym,
-                'clicks': d['clicks'],
-                'impressions': d['impressions'],
-                'ctr': round(ctr, 2),
-                'position': round(avg_pos, 1)
-            })
+        monthly_summary, monthly_queries = fetch_gsc_monthly(site_url, start_date, end_date, limit)
 
-        return jsonify({
+        return data_response({
             "success": True,
             "site_url": site_url,
             "start_date": start_date,
             "end_date": end_date,
             "monthly_summary": monthly_summary,
             "monthly_queries": monthly_queries
-        })
+        }, request.args.get('format'), request.args.get('section'))
 
     except Exception as e:
         error_message = str(e)
@@ -1250,6 +1747,7 @@ def get_google_ads_keywords():
 # ============================================================
 # PPTX生成エンドポイント
 # ============================================================
+import io
 import sys
 import uuid
 import tempfile
@@ -1257,11 +1755,65 @@ import tempfile
 TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'template.pptx')
 GENERATED_FILES_DIR = os.path.join(tempfile.gettempdir(), 'generated_reports')
 
+_template_lock = threading.Lock()
+_template_cache = {}
+
+def load_template_bytes():
+    """テンプレートPPTXのバイト列（更新時刻が変わるまでメモリに保持する）"""
+    mtime = os.path.getmtime(TEMPLATE_PATH)
+    with _template_lock:
+        cached = _template_cache.get(TEMPLATE_PATH)
+        if cached is None or cached[0] != mtime:
+            with open(TEMPLATE_PATH, 'rb') as f:
+                cached = _template_cache[TEMPLATE_PATH] = (mtime, f.read())
+    return cached[1]
+
+# PPTX生成ごとに処理時間の内訳をログに出す
+REPORT_TIMING_LOG = os.environ.get('REPORT_TIMING_LOG', '').lower() in ('1', 'true', 'yes')
+# スライドを組み終わるごとに書き出してメモリから外す（build_report.generate の stream=True）
+REPORT_STREAM_SAVE = os.environ.get('REPORT_STREAM_SAVE', '').lower() in ('1', 'true', 'yes')
+
+def generate_pptx_file(data, timing=False):
+    """
+    build_report.generate でPPTXを生成し、ファイル名とダウンロードURLを返す。
+    timing=True なら処理時間の内訳（スライド・グラフごと）も timing に入れて返す
+    """
+    os.makedirs(GENERATED_FILES_DIR, exist_ok=True)
+
+    # build_report.py を動的にインポート（キャッシュクリア対応）
+    sys.path.insert(0, os.path.dirname(__file__))
+    if 'build_report' in sys.modules:
+        import importlib
+        import build_report as br
+        importlib.reload(br)
+    else:
+        import build_report as br
+
+    # テンプレートを読み込み、データを埋め込んでPPTXを生成
+    output_filename = f"report_{uuid.uuid4().hex[:8]}.pptx"
+    output_path = os.path.join(GENERATED_FILES_DIR, output_filename)
+
+    with trace_utils.span('report.generate'):
+        report = br.generate(data, io.BytesIO(load_template_bytes()), output_path,
+                             on_phase=lambda phase, seconds: REPORT_PHASE_SECONDS.observe(seconds, phase=phase),
+                             log=REPORT_TIMING_LOG, stream=REPORT_STREAM_SAVE)
+
+    # 生成したファイルのダウンロードURLを返す
+    base_url = request.host_url.rstrip('/')
+    result = {
+        "filename": output_filename,
+        "download_url": f"{base_url}/files/{output_filename}"
+    }
+    if timing:
+        result["timing"] = report
+    return result
+
+def timing_requested(value):
+    return str(value or '').lower() in ('1', 'true', 'yes')
+
 @app.route('/generate_report', methods=['POST'])
 def generate_report():
     try:
-        os.makedirs(GENERATED_FILES_DIR, exist_ok=True)
-
         # Difyからは JSON文字列として渡される場合があるため両方対応
         raw = request.get_json(force=True, silent=True)
         if raw is None:
@@ -1278,36 +1830,300 @@ def generate_report():
         if not data:
             return jsonify({"success": False, "error": "JSONデータが必要です"}), 400
 
-        # build_report.py を動的にインポート（キャッシュクリア対応）
-        sys.path.insert(0, os.path.dirname(__file__))
-        if 'build_report' in sys.modules:
-            import importlib
-            import build_report as br
-            importlib.reload(br)
-        else:
-            import build_report as br
-
-        # テンプレートを読み込み、データを埋め込んでPPTXを生成
-        output_filename = f"report_{uuid.uuid4().hex[:8]}.pptx"
-        output_path = os.path.join(GENERATED_FILES_DIR, output_filename)
+        # ?timing=1 で処理時間の内訳もレスポンスに含める
+        return jsonify({"success": True, **generate_pptx_file(data, timing_requested(request.args.get('timing')))})
 
-        br.generate(data, TEMPLATE_PATH, output_path)
+    except Exception as e:
+        import traceback
+        return jsonify({"success": False, "error": str(e), "trace": traceback.format_exc()}), 500
 
-        # 生成したファイルのダウンロードURLを返す
-        base_url = request.host_url.rstrip('/')
-        download_url = f"{base_url}/files/{output_filename}"
+# ============================================================
+# レポート用データ一括取得（GA4・GSC・Adsを並列取得）
+# ============================================================
+REPORT_DATA_WORKERS = int(os.environ.get('REPORT_DATA_WORKERS', 5))
+
+def _as_list(value):
+    """カンマ区切り文字列 / リストのどちらでも受け付ける"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return [str(v).strip() for v in value if str(v).strip()]
+
+def validate_report_request(property_id, start_date, end_date):
+    """上流を呼ぶ前に日付と（GA4 を取得する場合は）プロパティIDを検証する（不正なら InvalidReportError）"""
+    if property_id:
+        validate_ga4_request(property_id, start_date, end_date)
+    else:
+        ga4_utils.validate_date_range(start_date, end_date)
+
+def collect_report_data(property_id=None, site_url=None, customer_id=None,
+                        start_date=None, end_date=None, areas=(), ga4_cities=None,
+                        inquiry_paths=None, report_fields=None):
+    """
+    GA4・GSC・Adsを並列に取得し、build_report.load_data のスキーマに整形して返す。
+    取得できなかったプロバイダはエラー内容を errors に入れ、他の結果はそのまま返す。
+    """
+    import report_data
+
+    tasks = {}
+    if property_id and SERVICE_ACCOUNT_JSON:
+        tasks['ga4'] = (fetch_ga4_monthly, property_id, start_date, end_date)
+        tasks['key_events'] = (fetch_ga4_key_events, property_id, start_date, end_date)
+    if site_url and all([GSC_REFRESH_TOKEN, GSC_CLIENT_ID, GSC_CLIENT_SECRET]):
+        tasks['gsc'] = (fetch_gsc_monthly, site_url, start_date, end_date)
+        if areas:
+            tasks['gsc_area'] = (fetch_gsc_area_queries, site_url, start_date, end_date, areas)
+    if customer_id and all([GOOGLE_ADS_REFRESH_TOKEN, GOOGLE_ADS_CLIENT_ID, GOOGLE_ADS_CLIENT_SECRET, GOOGLE_ADS_DEVELOPER_TOKEN]):
+        tasks['ads'] = (fetch_ads_performance, customer_id, start_date, end_date)
+
+    results, errors = {}, {}
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(len(tasks), REPORT_DATA_WORKERS)) as pool:
+            futures = {name: pool.submit(trace_utils.wrap(fn), *args) for name, (fn, *args) in tasks.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"report-data {name} Error: {e}")
+                    errors[name] = str(e)
+
+    data = report_data.shape_report_data(
+        **results,
+        area_cities=ga4_cities or report_data.area_city_names(areas),
+        inquiry_paths=inquiry_paths,
+        report_fields=report_fields
+    )
+    return data, errors
+
+@app.route('/report-data', methods=['POST'])
+def get_report_data():
+    """
+    GA4・GSC・Google Adsを並列に取得し、/generate_report にそのまま渡せる形式で返す。
+    パラメータ: property_id, site_url, customer_id, start_date, end_date,
+              areas, ga4_cities, inquiry_paths, report_fields, generate, timing
+    generate=true の場合はそのままPPTXを生成してダウンロードURLも返す（timing=true で処理時間の内訳も）。
+    """
+    try:
+        params = request.get_json(force=True, silent=True) or {}
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
+        if not start_date or not end_date:
+            return jsonify({"success": False, "error": "start_date と end_date が必要です"}), 400
+        property_id = params.get('property_id', DEFAULT_PROPERTY_ID)
+        validate_report_request(property_id, start_date, end_date)
+
+        data, errors = collect_report_data(
+            property_id=property_id,
+            site_url=params.get('site_url'),
+            customer_id=str(params.get('customer_id') or '').replace('-', ''),
+            start_date=start_date,
+            end_date=end_date,
+            areas=_as_list(params.get('areas')),
+            ga4_cities=_as_list(params.get('ga4_cities')),
+            inquiry_paths=_as_list(params.get('inquiry_paths')),
+            report_fields=params.get('report_fields') or {}
+        )
 
-        return jsonify({
-            "success": True,
-            "filename": output_filename,
-            "download_url": download_url
-        })
+        result = {"success": True, "report_data": data, "errors": errors}
+        if params.get('generate'):
+            result.update(generate_pptx_file(data, timing_requested(params.get('timing') or request.args.get('timing'))))
+        return jsonify(result)
 
+    except ga4_utils.InvalidReportError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
     except Exception as e:
         import traceback
         return jsonify({"success": False, "error": str(e), "trace": traceback.format_exc()}), 500
 
 
+# ============================================================
+# 複数店舗の一括取得（店舗ごとの結果を完了順にNDJSONで返す）
+# ============================================================
+BULK_STORE_WORKERS = int(os.environ.get('BULK_STORE_WORKERS', 4))
+BULK_MAX_STORES = int(os.environ.get('BULK_MAX_STORES', 50))
+
+def collect_store_report_data(store, start_date, end_date):
+    """店舗1件分の collect_report_data（店舗の指定が共通の start_date / end_date より優先）"""
+    return collect_report_data(
+        property_id=store.get('property_id'),
+        site_url=store.get('site_url'),
+        customer_id=str(store.get('customer_id') or '').replace('-', ''),
+        start_date=store.get('start_date') or start_date,
+        end_date=store.get('end_date') or end_date,
+        areas=_as_list(store.get('areas')),
+        ga4_cities=_as_list(store.get('ga4_cities')),
+        inquiry_paths=_as_list(store.get('inquiry_paths')),
+        report_fields=store.get('report_fields') or {}
+    )
+
+@app.route('/bulk/report-data', methods=['POST'])
+def get_bulk_report_data():
+    """
+    複数店舗の /report-data を並列に取得する。
+    パラメータ: start_date, end_date, stores（[{store_id, property_id, site_url, customer_id, areas, ...}]）
+    レスポンスは NDJSON。meta → 店舗ごとの store（完了した順）→ end。
+    店舗の失敗は他の店舗に影響せず、その店舗の行に success=false で入る。
+    上流APIの同時実行数は upstream_call のプロバイダごとの上限で抑える。
+    """
+    params = request.get_json(force=True, silent=True) or {}
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    stores = params.get('stores')
+    if not isinstance(stores, list) or not stores or not all(isinstance(s, dict) for s in stores):
+        return jsonify({"success": False, "error": "stores に店舗の配列を指定してください"}), 400
+    if len(stores) > BULK_MAX_STORES:
+        return jsonify({"success": False, "error": f"stores は{BULK_MAX_STORES}件までです"}), 400
+    # どの店舗もまだ上流に送っていないうちに全店舗を検証する
+    for i, store in enumerate(stores):
+        store_start, store_end = store.get('start_date') or start_date, store.get('end_date') or end_date
+        if not store_start or not store_end:
+            return jsonify({"success": False, "error": f"start_date と end_date が必要です（stores[{i}]）"}), 400
+        try:
+            validate_report_request(store.get('property_id'), store_start, store_end)
+        except ga4_utils.InvalidReportError as e:
+            return jsonify({"success": False, "error": f"stores[{i}]: {e}"}), 400
+
+    def run_store(store):
+        started = time.perf_counter()
+        with trace_utils.span('bulk.store', attributes={'store_id': str(store.get('store_id', ''))}):
+            data, errors = collect_store_report_data(store, start_date, end_date)
+        return data, errors, round((time.perf_counter() - started) * 1000, 1)
+
+    def generate():
+        started = time.perf_counter()
+        yield app.json.dumps({"type": "meta", "stores": len(stores), "start_date": start_date, "end_date": end_date}) + "\n"
+        succeeded = 0
+        pool = ThreadPoolExecutor(max_workers=min(len(stores), BULK_STORE_WORKERS))
+        try:
+            run = trace_utils.wrap(run_store)
+            futures = {pool.submit(run, store): (i, store) for i, store in enumerate(stores)}
+            for future in as_completed(futures):
+                i, store = futures[future]
+                line = {"type": "store", "index": i, "store_id": store.get('store_id', i)}
+                try:
+                    data, errors, elapsed_ms = future.result()
+                    line.update({"success": True, "elapsed_ms": elapsed_ms, "report_data": data, "errors": errors})
+                    succeeded += 1
+                except Exception as e:
+                    line.update({"success": False, "error": str(e)})
+                yield app.json.dumps(line) + "\n"
+        finally:
+            # クライアントが切断した場合は未着手の店舗を取り消す
+            pool.shutdown(wait=False, cancel_futures=True)
+        yield app.json.dumps({
+            "type": "end", "success": True,
+            "succeeded": succeeded, "failed": len(stores) - succeeded,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# ============================================================
+# ウォームアップ（ワーカー起動時にクライアント・キャッシュを準備する）
+# ============================================================
+# ウォームアップするステップ（カンマ区切り、既定は全部）。
+# 例: WARMUP_PROVIDERS=ads なら google-analytics-data などの重いライブラリを読み込まない
+WARMUP_PROVIDERS = {p.strip() for p in os.environ.get('WARMUP_PROVIDERS', 'ga4,gsc,ads,template,kaleido').split(',') if p.strip()}
+
+_warmup_lock = threading.Lock()
+_warmup = {"state": "pending", "steps": {}}
+
+def _warm_ga4():
+    client = get_ga4_client()
+    if DEFAULT_PROPERTY_ID:
+        # gRPC チャネルの接続とメタデータのキャッシュを済ませる
+        get_ga4_metadata(client, DEFAULT_PROPERTY_ID)
+
+def _warm_template():
+    from pptx import Presentation
+    import build_report  # noqa: F401  pptx / plotly のインポート
+    Presentation(io.BytesIO(load_template_bytes()))
+
+def _warm_kaleido():
+    # kaleido は最初の書き出しで Chromium のサブプロセスを起動する（plot_utils のプールがプロセスならワーカーの分も）
+    import plot_utils
+    plot_utils.warm_up()
+
+# (名前, 関数, 実行するか)
+WARMUP_STEPS = [
+    ('ga4', _warm_ga4, lambda: bool(SERVICE_ACCOUNT_JSON)),
+    ('gsc', get_gsc_service, lambda: all([GSC_REFRESH_TOKEN, GSC_CLIENT_ID, GSC_CLIENT_SECRET])),
+    ('ads', get_ads_access_token, lambda: all([GOOGLE_ADS_REFRESH_TOKEN, GOOGLE_ADS_CLIENT_ID, GOOGLE_ADS_CLIENT_SECRET])),
+    ('template', _warm_template, lambda: os.path.exists(TEMPLATE_PATH)),
+    ('kaleido', _warm_kaleido, lambda: True),
+]
+
+def warm_up():
+    """WARMUP_STEPS を順に実行する。失敗しても次へ進み、結果は /ready で確認できる"""
+    for name, fn, enabled in WARMUP_STEPS:
+        if name not in WARMUP_PROVIDERS or not enabled():
+            _warmup["steps"][name] = {"skipped": True}
+            continue
+        started = time.perf_counter()
+        try:
+            fn()
+            _warmup["steps"][name] = {"ok": True}
+        except Exception as e:
+            print(f"warm-up {name} Error: {e}")
+            _warmup["steps"][name] = {"ok": False, "error": str(e)}
+        _warmup["steps"][name]["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    _warmup["state"] = "ready"
+
+def start_warm_up():
+    """ウォームアップをバックグラウンドで1回だけ開始する（gunicorn.conf.py の post_worker_init から呼ぶ）"""
+    with _warmup_lock:
+        if _warmup["state"] != "pending":
+            return
+        _warmup["state"] = "warming"
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+@app.route('/ready')
+def ready():
+    """ウォームアップが終わっていれば200、それまでは503（未開始ならここで開始する）"""
+    start_warm_up()
+    status = 200 if _warmup["state"] == "ready" else 503
+    return jsonify({"ready": status == 200, "state": _warmup["state"], "steps": _warmup["steps"]}), status
+
+def check_admin_token():
+    """ADMIN_TOKEN と一致しなければエラーのレスポンスを返す（Authorization: Bearer / X-Admin-Token）"""
+    import hmac
+    if not ADMIN_TOKEN:
+        return jsonify({"success": False, "error": "ADMIN_TOKEN が設定されていません"}), 404
+    auth = request.headers.get('Authorization', '')
+    token = auth[len('Bearer '):] if auth.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"success": False, "error": "認証に失敗しました"}), 401
+    return None
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """保存済みのプロファイル一覧（新しい順）"""
+    denied = check_admin_token()
+    if denied:
+        return denied
+    return jsonify({
+        "success": True,
+        "enabled": profile_utils.PROFILING_ENABLED,
+        "slow_ms": profile_utils.PROFILE_SLOW_MS,
+        "max_files": profile_utils.PROFILE_MAX_FILES,
+        "profiles": profile_utils.list_captures(),
+    })
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """プロファイル本体（.folded はテキスト、.prof は pstats のバイナリ）"""
+    from flask import send_file
+    denied = check_admin_token()
+    if denied:
+        return denied
+    path = profile_utils.capture_path(name)
+    if path is None:
+        return jsonify({"success": False, "error": "プロファイルが見つかりません"}), 404
+    if name.endswith('.folded'):
+        return send_file(path, mimetype='text/plain')
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
+
 @app.route('/files/<filename>', methods=['GET'])
 def download_file(filename):
     from flask import send_from_directory
@@ -1319,4 +2135,5 @@ def download_file(filename):
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
+    start_warm_up()
     app.run(host='0.0.0.0', port=port)
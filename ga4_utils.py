@@ -0,0 +1,620 @@
+"""
+ga4_utils.py - GA4 Data API のレスポンス変換
+
+RunReportResponse を行ごとの dict ではなく列ごとの配列に変換する。
+  ディメンション : str のリスト（同じ値は同じオブジェクトを共有）
+  指標          : TYPE_INTEGER は array('q')、それ以外は array('d')
+proto-plus のラッパーを経由せず生の protobuf を読むので、1万行/ページでも軽い。
+
+ReportSpec でレポートを宣言し run_specs でまとめて実行する（iter_specs はページごとに返すストリーミング版）。
+  - batch_run_reports で最大5本ずつまとめて送る（バッチ同士は並列）
+  - paginate=True のレポートは row_count から残りページを求めて一括で取得
+  - 比較期間は dateRange を使って1リクエストにまとめる（最大4期間）
+  - limit + per_month=True のレポートは月ごとの期間に分けて各月の上位N件を取得
+  - 結果（デコード済みの列）は TTLCache にキャッシュ
+PivotSpec / run_pivot_specs はエンティティ×月 の行列を run_pivot_report で取得する
+（上位N件はGA4側で絞る。結果は同じ TTLCache にキャッシュ）。
+validate_* は GA4 に送る前にプロパティID・日付・ディメンション/指標名（get_metadata の結果）を検証する。
+レポートごとの取得ページ数・行数と TTLCache のヒット/ミスは metrics_utils に、
+1ページ目・続きのページの取得は trace_utils のスパンに記録する。
+"""
+import copy
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import islice
+
+import metrics_utils
+import trace_utils
+
+# google.analytics.data_v1beta.types は import するだけでクライアント一式が読み込まれるため、
+# 使う関数の中で import する
+
+# batch_run_reports 1回に含められるリクエスト数の上限
+MAX_BATCH_SIZE = 5
+# 1つの RunReportRequest に指定できる期間数の上限
+MAX_DATE_RANGES = 4
+PAGE_SIZE = 10000
+
+PROPERTY_ID_RE = re.compile(r"^\d+$")
+DATE_RE = re.compile(r"^(\d{4}-\d{2}-\d{2}|today|yesterday|\d+daysAgo)$")
+
+GA4_REPORT_PAGES = metrics_utils.Counter(
+    'ga4_report_pages_total', 'GA4 から取得したページ数（レポート別）', ['report'])
+GA4_REPORT_ROWS = metrics_utils.Histogram(
+    'ga4_report_rows', 'GA4 レポート1件あたりの行数（全ページの合計）', ['report'],
+    buckets=(0, 10, 100, 1000, 10000, 100000, 1000000))
+CACHE_REQUESTS = metrics_utils.Counter(
+    'cache_requests_total', 'TTLCache の参照回数（result=hit/miss）', ['cache', 'result'])
+
+
+class GA4Columns:
+    """RunReportResponse を列指向にしたもの"""
+
+    def __init__(self, dimension_names, metric_names, columns, row_count, total_rows):
+        self.dimension_names = dimension_names
+        self.metric_names = metric_names
+        self.columns = columns
+        self.row_count = row_count
+        self.total_rows = total_rows  # ページネーション前の総行数（RunReportResponse.row_count）
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows(self, *names, **mappers):
+        """
+        指定列（省略時はディメンション→指標の順に全列）を行ごとのタプルで返す。
+        mappers に列名=関数 を渡したディメンション列は mapped() で変換して返す。
+        """
+        names = names or (self.dimension_names + self.metric_names)
+        return zip(*(
+            self.mapped(n, mappers[n]) if n in mappers else self.columns[n]
+            for n in names
+        ))
+
+    def extend(self, other):
+        """同じヘッダーの GA4Columns（次のページ）を後ろに連結する"""
+        for name, col in other.columns.items():
+            self.columns[name].extend(col)
+        self.row_count += other.row_count
+
+    def split_date_ranges(self, count):
+        """
+        複数期間のレスポンスを dateRange ディメンション（date_range_0, date_range_1, ...）で
+        期間ごとの GA4Columns に分ける（dateRange 列は取り除く）
+        """
+        dimension_names = [n for n in self.dimension_names if n != "dateRange"]
+        positions = {f"date_range_{i}": i for i in range(count)}
+        buckets = [[] for _ in range(count)]
+        for row, label in enumerate(self.columns.get("dateRange", ())):
+            buckets[positions[label]].append(row)
+        parts = []
+        for rows in buckets:
+            columns = {}
+            for name in dimension_names:
+                col = self.columns[name]
+                columns[name] = [col[r] for r in rows]
+            for name in self.metric_names:
+                col = self.columns[name]
+                columns[name] = array(col.typecode, [col[r] for r in rows])
+            parts.append(GA4Columns(dimension_names, self.metric_names, columns, len(rows), len(rows)))
+        return parts
+
+    def mapped(self, name, fn):
+        """ディメンション列に fn を適用する（同じ値は1回だけ変換する）"""
+        cache = {}
+        out = []
+        for v in self.columns[name]:
+            r = cache.get(v)
+            if r is None:
+                r = cache[v] = fn(v)
+            out.append(r)
+        return out
+
+
+def decode_response(response, metric_types=None):
+    """
+    RunReportResponse を GA4Columns に変換する。
+    metric_types（指標名→MetricType）を渡すとヘッダーの型より優先して使う。
+    """
+    from google.analytics.data_v1beta.types import MetricType
+
+    pb = type(response).pb(response)
+    dimension_names = [h.name for h in pb.dimension_headers]
+    metric_names = [h.name for h in pb.metric_headers]
+    metric_types = metric_types or {}
+    is_int = [
+        metric_types.get(h.name, h.type_) == MetricType.TYPE_INTEGER
+        for h in pb.metric_headers
+    ]
+
+    dim_cols = [[] for _ in dimension_names]
+    interned = [{} for _ in dimension_names]
+    met_cols = [array('q') if flag else array('d') for flag in is_int]
+    dim_idx = list(enumerate(zip(dim_cols, interned)))
+    met_idx = list(enumerate(zip(met_cols, is_int)))
+
+    for row in pb.rows:
+        dvs = row.dimension_values
+        for j, (col, pool) in dim_idx:
+            v = dvs[j].value
+            col.append(pool.setdefault(v, v))
+        mvs = row.metric_values
+        for i, (col, flag) in met_idx:
+            v = mvs[i].value
+            col.append(int(v) if flag else float(v))
+
+    columns = dict(zip(dimension_names, dim_cols))
+    columns.update(zip(metric_names, met_cols))
+    return GA4Columns(dimension_names, metric_names, columns, len(pb.rows), pb.row_count)
+
+
+def format_year_month(ym):
+    """'202501' → '2025-01'"""
+    return f"{ym[:4]}-{ym[4:]}"
+
+
+# ============================================================
+# 宣言的なレポート定義と実行
+# ============================================================
+class ReportSpec:
+    """
+    GA4 レポート1本の宣言。
+      name             : 結果のキー
+      dimensions       : ディメンション名のリスト
+      metrics          : 指標名のリスト
+      order_bys        : 並び順（"yearMonth" は昇順、"-sessions" は降順）
+      limit            : 取得件数（None は API の既定）
+      per_month        : True なら limit を月ごとの上位N件として扱う（月ごとの期間に分けて取得）
+      paginate         : True なら PAGE_SIZE ごとに全件取得する
+      dimension_filter : FilterExpression（dict でも可）
+      fields           : 出力行のフィールド [(出力キー, 列名[, 変換関数]), ...]
+    """
+
+    def __init__(self, name, dimensions=(), metrics=(), order_bys=(), limit=None,
+                 paginate=False, dimension_filter=None, fields=(), per_month=False):
+        self.name = name
+        self.dimensions = list(dimensions)
+        self.metrics = list(metrics)
+        self.order_bys = list(order_bys)
+        self.limit = limit
+        self.per_month = per_month
+        self.paginate = paginate
+        self.dimension_filter = dimension_filter
+        self.fields = list(fields)
+
+    def replace(self, **changes):
+        """一部の属性だけ変えたコピーを返す（リクエストごとの limit / フィルタ指定用）"""
+        spec = copy.copy(self)
+        spec.__dict__.update(changes)
+        return spec
+
+    def build_request(self, date_ranges, limit=None, offset=0):
+        order_bys = []
+        for o in self.order_bys:
+            name = o.lstrip("-")
+            if name in self.dimensions:
+                order_bys.append({"dimension": {"dimension_name": name}, "desc": o.startswith("-")})
+            else:
+                order_bys.append({"metric": {"metric_name": name}, "desc": o.startswith("-")})
+        from google.analytics.data_v1beta.types import RunReportRequest
+
+        return RunReportRequest(
+            date_ranges=[{"start_date": s, "end_date": e} for s, e in date_ranges],
+            dimensions=[{"name": n} for n in self.dimensions],
+            metrics=[{"name": n} for n in self.metrics],
+            order_bys=order_bys,
+            dimension_filter=self.dimension_filter,
+            limit=limit,
+            offset=offset,
+        )
+
+    def shape(self, cols):
+        """fields に従って GA4Columns を dict の配列にする"""
+        keys = [f[0] for f in self.fields]
+        columns = []
+        for _, name, *fn in self.fields:
+            if not fn:
+                columns.append(cols[name])
+            elif name in cols.dimension_names:
+                columns.append(cols.mapped(name, fn[0]))
+            else:
+                columns.append([fn[0](v) for v in cols[name]])
+        return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+class PivotSpec:
+    """
+    行ディメンション×列ディメンション（既定は yearMonth）の行列を run_pivot_report で取得する宣言。
+      name             : 結果のキー
+      row_dimension    : 行にするディメンション（city, pagePath など）
+      metric           : 集計する指標（1つ）
+      row_limit        : 行の上位N件（期間合計の metric 降順。GA4側で絞る）
+      row_key          : 出力行で行ディメンションの値を入れるキー
+      column_dimension : 列にするディメンション（昇順）
+      column_format    : 列ディメンションの値の変換（yearMonth → YYYY-MM など）
+      value_type       : 値の変換関数
+    """
+
+    def __init__(self, name, row_dimension, metric, row_limit, row_key=None,
+                 column_dimension="yearMonth", column_format=None, column_limit=100,
+                 dimension_filter=None, value_type=int):
+        self.name = name
+        self.row_dimension = row_dimension
+        self.metric = metric
+        self.row_limit = row_limit
+        self.row_key = row_key or row_dimension
+        self.column_dimension = column_dimension
+        self.column_format = column_format
+        self.column_limit = column_limit
+        self.dimension_filter = dimension_filter
+        self.value_type = value_type
+
+    def replace(self, **changes):
+        spec = copy.copy(self)
+        spec.__dict__.update(changes)
+        return spec
+
+    @property
+    def dimensions(self):
+        return [self.row_dimension, self.column_dimension]
+
+    @property
+    def metrics(self):
+        return [self.metric]
+
+    def build_request(self, date_range):
+        from google.analytics.data_v1beta.types import RunPivotReportRequest
+
+        return RunPivotReportRequest(
+            date_ranges=[{"start_date": date_range[0], "end_date": date_range[1]}],
+            dimensions=[{"name": self.row_dimension}, {"name": self.column_dimension}],
+            metrics=[{"name": self.metric}],
+            dimension_filter=self.dimension_filter,
+            pivots=[
+                {"field_names": [self.row_dimension], "limit": self.row_limit,
+                 "order_bys": [{"metric": {"metric_name": self.metric}, "desc": True}]},
+                {"field_names": [self.column_dimension], "limit": self.column_limit,
+                 "order_bys": [{"dimension": {"dimension_name": self.column_dimension}, "desc": False}]},
+            ],
+        )
+
+    def shape(self, response):
+        """
+        RunPivotReportResponse を {"columns": [列の値...], "rows": [{row_key: 値, 列の値: 指標..., "total": 合計}]} にする。
+        行・列の順は pivot_headers の順（行は上位順、列は昇順）。値の無いセルは 0。
+        該当データが無く pivot_headers が2つ揃っていないときは空の columns / rows を返す。
+        """
+        pb = type(response).pb(response)
+        if len(pb.pivot_headers) < 2:
+            return {"columns": [], "rows": []}
+        row_values = [h.dimension_values[0].value for h in pb.pivot_headers[0].pivot_dimension_headers]
+        col_values = [h.dimension_values[0].value for h in pb.pivot_headers[1].pivot_dimension_headers]
+        row_pos = {v: i for i, v in enumerate(row_values)}
+        col_pos = {v: i for i, v in enumerate(col_values)}
+        names = [h.name for h in pb.dimension_headers]
+        ri, ci = names.index(self.row_dimension), names.index(self.column_dimension)
+
+        matrix = [[0] * len(col_values) for _ in row_values]
+        for row in pb.rows:
+            r = row_pos.get(row.dimension_values[ri].value)
+            c = col_pos.get(row.dimension_values[ci].value)
+            if r is not None and c is not None:
+                matrix[r][c] = self.value_type(row.metric_values[0].value)
+
+        columns = [self.column_format(v) for v in col_values] if self.column_format else col_values
+        rows = []
+        for value, cells in zip(row_values, matrix):
+            rows.append({self.row_key: value, **dict(zip(columns, cells)), "total": sum(cells)})
+        return {"columns": columns, "rows": rows}
+
+
+# ============================================================
+# フィルタ・期間
+# ============================================================
+def in_list_filter(field_name, values):
+    return {"filter": {"field_name": field_name, "in_list_filter": {"values": list(values)}}}
+
+def string_filter(field_name, value, match_type="EXACT"):
+    """match_type: EXACT / BEGINS_WITH / ENDS_WITH / CONTAINS / FULL_REGEXP / PARTIAL_REGEXP"""
+    return {"filter": {"field_name": field_name, "string_filter": {"value": value, "match_type": match_type}}}
+
+def and_filters(expressions):
+    expressions = [e for e in expressions if e]
+    if not expressions:
+        return None
+    if len(expressions) == 1:
+        return expressions[0]
+    return {"and_group": {"expressions": expressions}}
+
+def apply_filters(spec, filters):
+    """
+    filters（in_list_filter / string_filter の式）のうち spec のディメンションに関係するものだけを
+    既存の dimension_filter と AND で結合したコピーを返す
+    """
+    matched = [f for f in filters if f["filter"]["field_name"] in spec.dimensions]
+    if not matched:
+        return spec
+    return spec.replace(dimension_filter=and_filters([spec.dimension_filter] + matched))
+
+
+def resolve_date(value, today=None):
+    """GA4 の日付指定（YYYY-MM-DD / today / yesterday / NdaysAgo）を date にする"""
+    today = today or date.today()
+    if value == "today":
+        return today
+    if value == "yesterday":
+        return today - timedelta(days=1)
+    if value.endswith("daysAgo"):
+        return today - timedelta(days=int(value[:-len("daysAgo")]))
+    return date.fromisoformat(value)
+
+def month_ranges(start_date, end_date):
+    """期間を暦月ごとの (start_date, end_date) に分ける"""
+    start, end = resolve_date(start_date), resolve_date(end_date)
+    ranges = []
+    cur = start
+    while cur <= end:
+        next_month = (cur.replace(day=1) + timedelta(days=32)).replace(day=1)
+        ranges.append((cur.isoformat(), min(end, next_month - timedelta(days=1)).isoformat()))
+        cur = next_month
+    return ranges
+
+
+# ============================================================
+# メタデータ・検証
+# ============================================================
+def compact_metadata(response):
+    """
+    get_metadata のレスポンスから検証・デコードに使う部分だけを取り出す。
+      dimensions : ディメンション名の集合（カスタムディメンションを含む）
+      metrics    : 指標名 → MetricType
+    """
+    pb = type(response).pb(response)
+    return {
+        "dimensions": frozenset(d.api_name for d in pb.dimensions),
+        "metrics": {m.api_name: m.type_ for m in pb.metrics},
+    }
+
+
+class InvalidReportError(ValueError):
+    """GA4 に送る前に分かるリクエストの誤り（プロパティID・日付・ディメンション/指標名）"""
+    status_code = 400
+
+
+class PropertyNotFoundError(InvalidReportError):
+    """プロパティが存在しないか、サービスアカウントに閲覧権限がない（get_metadata が NotFound / PermissionDenied）"""
+    status_code = 404
+
+
+def validate_property_id(property_id):
+    if not PROPERTY_ID_RE.match(str(property_id or "")):
+        raise InvalidReportError(f"property_id は数字で指定してください: {property_id}")
+
+def validate_date_range(start_date, end_date):
+    """GA4 の日付指定として正しいか、開始日が終了日より後でないかを確かめる"""
+    for value in (start_date, end_date):
+        if not DATE_RE.match(value or ""):
+            raise InvalidReportError(f"日付は YYYY-MM-DD / today / yesterday / NdaysAgo で指定してください: {value}")
+    try:
+        start, end = resolve_date(start_date), resolve_date(end_date)
+    except ValueError:
+        raise InvalidReportError(f"存在しない日付です: {start_date} / {end_date}")
+    if start > end:
+        raise InvalidReportError(f"start_date が end_date より後になっています: {start_date} > {end_date}")
+
+def validate_specs(specs, metadata):
+    """specs のディメンション/指標がプロパティに存在するかを metadata（compact_metadata）で確かめる"""
+    dimensions = {d for spec in specs for d in spec.dimensions}
+    metrics = {m for spec in specs for m in spec.metrics}
+    unknown_dimensions = sorted(dimensions - metadata["dimensions"])
+    unknown_metrics = sorted(metrics - metadata["metrics"].keys())
+    if unknown_dimensions or unknown_metrics:
+        names = [f"ディメンション {', '.join(unknown_dimensions)}"] if unknown_dimensions else []
+        names += [f"指標 {', '.join(unknown_metrics)}"] if unknown_metrics else []
+        raise InvalidReportError(f"このプロパティに存在しない{' / '.join(names)}")
+
+
+class TTLCache:
+    """
+    有効期限つきの小さなキャッシュ（ttl<=0 なら何も保持しない。name を付けるとヒット率を記録する）。
+    maxrows を指定すると set の rows（GA4 の行数）の合計がそれを超えないよう古いものから捨てる
+    （maxrows より大きい値は保持しない）。
+    """
+
+    def __init__(self, ttl, maxsize=256, name=None, maxrows=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.maxrows = maxrows
+        self.name = name
+        self.rows = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        if self.name:
+            CACHE_REQUESTS.inc(cache=self.name, result='miss' if value is None else 'hit')
+        return value
+
+    def _get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value, _ = item
+            if expires < time.monotonic():
+                self._pop(key)
+                return None
+            return value
+
+    def set(self, key, value, rows=0):
+        if self.ttl <= 0 or (self.maxrows is not None and rows > self.maxrows):
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, rows)
+            self.rows += rows
+            while len(self._data) > self.maxsize or (self.maxrows is not None and self.rows > self.maxrows):
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.rows -= item[2]
+
+
+def _run_batched(requests, batch_fn, batch_size=MAX_BATCH_SIZE):
+    """requests を batch_size 本ずつ batch_fn に渡し、レスポンスを元の順で返す"""
+    chunks = [requests[i:i + batch_size] for i in range(0, len(requests), batch_size)]
+    if not chunks:
+        return []
+    if len(chunks) == 1:
+        return list(batch_fn(chunks[0]))
+    with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+        return [resp for reports in pool.map(trace_utils.wrap(batch_fn), chunks) for resp in reports]
+
+
+def _spec_units(specs, date_ranges):
+    """(spec, 結果を入れる期間の添字, リクエストに含める期間) の実行単位に分ける"""
+    if not 1 <= len(date_ranges) <= MAX_DATE_RANGES:
+        raise ValueError(f"date_ranges は1〜{MAX_DATE_RANGES}件で指定してください")
+    units = []
+    for spec in specs:
+        if spec.limit is None:
+            units.append((spec, list(range(len(date_ranges))), list(date_ranges)))
+        elif spec.per_month:
+            units.extend((spec, [i], [r]) for i, dr in enumerate(date_ranges) for r in month_ranges(*dr))
+        else:
+            units.extend((spec, [i], [dr]) for i, dr in enumerate(date_ranges))
+    return units
+
+
+def run_specs(specs, date_ranges, batch_fn, cache=None, cache_key=(), page_size=PAGE_SIZE,
+              metric_types=None):
+    """
+    specs をまとめて実行し、date_ranges の期間ごとに {spec.name: 行の配列} を返す。
+      date_ranges  : [(start_date, end_date), ...]（最大 MAX_DATE_RANGES 件）
+      batch_fn     : RunReportRequest のリストを受け取り RunReportResponse のリストを返す関数
+      cache        : TTLCache（cache_key + リクエスト内容をキーにデコード済みの列を保持）
+      metric_types : 指標名 → MetricType（メタデータの型でデコードする）
+
+    期間が複数のとき、limit の無いレポートは1リクエストに全期間を入れて dateRange で分割する。
+    limit のあるレポートは期間ごとの上位N件が必要なので期間ごとに別リクエストにする（同じバッチで送る）。
+    per_month のレポートはさらに月ごとに分けて、結果を月の順に連結する。
+    """
+    units = _spec_units(specs, date_ranges)
+    fetched = {}
+    pending = []
+    for n, (spec, idx, ranges) in enumerate(units):
+        req = spec.build_request(ranges, limit=page_size if spec.paginate else spec.limit)
+        key = cache_key + (type(req).serialize(req),)
+        hit = cache.get(key) if cache else None
+        if hit is not None:
+            fetched[n] = hit
+        else:
+            pending.append((n, req, key))
+
+    # 1ページ目をまとめて取得し、続きのページは row_count から一括で取得する
+    more = []
+    with trace_utils.span('ga4.first_pages', attributes={
+            'reports': [units[n][0].name for n, _, _ in pending], 'cached': len(units) - len(pending)}):
+        for (n, _, _), resp in zip(pending, _run_batched([req for _, req, _ in pending], batch_fn)):
+            spec, idx, ranges = units[n]
+            cols = fetched[n] = decode_response(resp, metric_types)
+            GA4_REPORT_PAGES.inc(report=spec.name)
+            if spec.paginate:
+                for offset in range(page_size, cols.total_rows, page_size):
+                    more.append((n, spec.build_request(ranges, limit=page_size, offset=offset)))
+    if more:
+        with trace_utils.span('ga4.next_pages', attributes={
+                'pages': [f"{units[n][0].name}@{req.offset}" for n, req in more]}):
+            for (n, _), resp in zip(more, _run_batched([req for _, req in more], batch_fn)):
+                fetched[n].extend(decode_response(resp, metric_types))
+                GA4_REPORT_PAGES.inc(report=units[n][0].name)
+    for n, _, key in pending:
+        GA4_REPORT_ROWS.observe(len(fetched[n]), report=units[n][0].name)
+        if cache:
+            cache.set(key, fetched[n], rows=len(fetched[n]))
+
+    results = [{spec.name: [] for spec in specs} for _ in date_ranges]
+    for n, (spec, idx, _) in enumerate(units):
+        parts = fetched[n].split_date_ranges(len(idx)) if len(idx) > 1 else [fetched[n]]
+        for i, cols in zip(idx, parts):
+            results[i][spec.name].extend(spec.shape(cols))
+    return results
+
+
+def iter_specs(specs, date_ranges, batch_fn, page_size=PAGE_SIZE, metric_types=None, prefetch=4):
+    """
+    run_specs のストリーミング版。GA4 から1ページ届くごとに (期間の添字, spec.name, 行) を返す。
+    全行をまとめて持たないのでキャッシュは使わない（引数は run_specs と同じ）。
+
+    ページは spec の順・ページの順に返す。先の prefetch ページまでは並列に取得しておき、
+    それより先は返し終わるまで取得しない（メモリは prefetch ページ分で済む）。
+    """
+    units = _spec_units(specs, date_ranges)
+
+    def fetch(n, req):
+        with trace_utils.span('ga4.page', attributes={'report': units[n][0].name, 'offset': req.offset}):
+            return batch_fn([req])[0]
+
+    fetch = trace_utils.wrap(fetch)
+    # [unit の番号, リクエスト, 1ページ目か, Future]
+    tasks = deque([n, spec.build_request(ranges, limit=page_size if spec.paginate else spec.limit), True, None]
+                  for n, (spec, _, ranges) in enumerate(units))
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        while tasks:
+            for task in islice(tasks, prefetch):
+                if task[3] is None:
+                    task[3] = pool.submit(fetch, task[0], task[1])
+            n, _, first, future = tasks.popleft()
+            spec, idx, ranges = units[n]
+            cols = decode_response(future.result(), metric_types)
+            GA4_REPORT_PAGES.inc(report=spec.name)
+            if first:
+                GA4_REPORT_ROWS.observe(cols.total_rows if spec.paginate else len(cols), report=spec.name)
+                if spec.paginate:
+                    # 続きのページは同じ unit の1ページ目の直後に並べる（先読み済みの後ろの unit より先）
+                    tasks.extendleft(reversed([
+                        [n, spec.build_request(ranges, limit=page_size, offset=offset), False, None]
+                        for offset in range(page_size, cols.total_rows, page_size)]))
+            parts = cols.split_date_ranges(len(idx)) if len(idx) > 1 else [cols]
+            for i, part in zip(idx, parts):
+                for row in spec.shape(part):
+                    yield i, spec.name, row
+    finally:
+        # 途中で止めた（クライアントが切断した）ときはまだ始まっていない取得を取り消す
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_pivot_specs(specs, date_range, batch_fn, cache=None, cache_key=()):
+    """
+    PivotSpec をまとめて実行し {spec.name: {"columns": [...], "rows": [...]}} を返す。
+      batch_fn : RunPivotReportRequest のリストを受け取り RunPivotReportResponse のリストを返す関数
+    """
+    results = {}
+    pending = []
+    for spec in specs:
+        req = spec.build_request(date_range)
+        key = cache_key + ("pivot", type(req).serialize(req))
+        hit = cache.get(key) if cache else None
+        if hit is not None:
+            results[spec.name] = hit
+        else:
+            pending.append((spec, req, key))
+    for (spec, _, key), resp in zip(pending, _run_batched([req for _, req, _ in pending], batch_fn)):
+        results[spec.name] = spec.shape(resp)
+        GA4_REPORT_PAGES.inc(report=spec.name)
+        GA4_REPORT_ROWS.observe(len(results[spec.name]["rows"]), report=spec.name)
+        if cache:
+            cache.set(key, results[spec.name], rows=len(results[spec.name]["rows"]))
+    return results
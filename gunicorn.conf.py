@@ -0,0 +1,20 @@
+"""
+gunicorn.conf.py - gunicorn 設定（Dockerfile から -c gunicorn.conf.py で読み込む）
+
+ワーカー起動直後に ga4_api.start_warm_up() でクライアント・トークン・テンプレート・kaleido を
+バックグラウンドで準備する。完了するまで /ready は 503 を返す。
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+
+def post_worker_init(worker):
+    # post_fork はアプリ読み込み前なので、読み込み後に呼ばれるこちらで開始する
+    # （gRPC チャネルなどはフォーク後のワーカー内で作る必要がある）
+    import ga4_api
+    ga4_api.start_warm_up()
@@ -0,0 +1,61 @@
+"""
+http_utils.py - 上流API（Google Ads / OAuth）用の共有HTTPセッション
+
+requests.post を毎回呼ぶと呼び出しごとに TCP + TLS 接続を張り直すため、
+プロセス全体で1つの Session を使い回して keep-alive 接続を再利用する。
+  - HTTPAdapter の接続プールはホストごとに pool_maxsize 本（gthread のスレッド数以上にする）
+  - timeout を指定しない呼び出しには既定の (connect, read) タイムアウトを付ける
+  - pool_stats() でホストごとのリクエスト数・新規接続数・再利用率を返す
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledAdapter(HTTPAdapter):
+    """既定タイムアウトつきの HTTPAdapter"""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+def create_session(pool_size=16, connect_timeout=5.0, read_timeout=60.0):
+    """https / http とも同じ設定のアダプタを付けた Session を作る"""
+    session = requests.Session()
+    adapter = PooledAdapter(
+        timeout=(connect_timeout, read_timeout),
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def pool_stats(session):
+    """
+    ホストごとの接続プールの状態を返す。
+      requests    : このプール経由のリクエスト数
+      connections : 新しく張った接続数
+      reused      : 既存接続を再利用したリクエストの割合
+      idle        : プールで待機中の接続数
+    """
+    stats = {}
+    for prefix, adapter in session.adapters.items():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            requests_count = pool.num_requests
+            stats[host] = {
+                "requests": requests_count,
+                "connections": pool.num_connections,
+                "reused": round(1 - pool.num_connections / requests_count, 4) if requests_count else 0.0,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+    return stats
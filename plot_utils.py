@@ -1,7 +1,32 @@
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 import plotly.graph_objects as plotly_go
 from plotly.subplots import make_subplots
 
+import trace_utils
+
+_local = threading.local()
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+# build_report.generate がグラフを先に書き出しておくプール（0 ならスライドを作るときにその場で書き出す）
+CHART_WORKERS = int(os.environ.get('REPORT_CHART_WORKERS', 2))
+# thread  : kaleido は1プロセスで1枚ずつしか書き出せないので、グラフ同士は並ばずスライドの構築と重なるだけ
+# process : ワーカーごとに kaleido（Chromium）を持つのでコア数に応じて並列に書き出せる（メモリは増える）
+# 未指定なら使えるCPUが2つ以上のとき process、1つなら thread
+CHART_POOL = os.environ.get('REPORT_CHART_POOL') or ('process' if _available_cpus() > 1 else 'thread')
+
+_pool = None
+_pool_lock = threading.Lock()
+
 # PPTXにあわせたカラー設定
 COLOR_BAR = "rgb(179, 226, 131)"
 COLOR_LINE = "rgb(105, 175, 230)"
@@ -12,6 +37,25 @@ def ensure_dir(filepath):
     if dirname:
         os.makedirs(dirname, exist_ok=True)
 
+@contextmanager
+def record_renders(on_render):
+    """with ブロック内（同じスレッド）のグラフ書き出しごとに on_render(ファイル名, 秒) を呼ぶ"""
+    saved = getattr(_local, 'on_render', None)
+    _local.on_render = on_render
+    try:
+        yield
+    finally:
+        _local.on_render = saved
+
+def _write_image(fig, filepath):
+    # kaleido での書き出しがグラフ1枚の時間のほとんどを占める
+    started = time.perf_counter()
+    with trace_utils.span("plot.render", attributes={"chart": os.path.basename(filepath)}):
+        fig.write_image(filepath, scale=2)
+    on_render = getattr(_local, 'on_render', None)
+    if on_render is not None:
+        on_render(os.path.basename(filepath), time.perf_counter() - started)
+
 def _apply_common_layout(fig, width, height):
     fig.update_layout(
         template="simple_white",
@@ -43,7 +87,7 @@ def save_bar_chart(categories, bar_data, bar_name, filepath, width=400, height=2
     ))
     _apply_common_layout(fig, width, height)
     fig.update_layout(showlegend=False)
-    fig.write_image(filepath, scale=2)
+    _write_image(fig, filepath)
 
 def save_combo_chart(categories, bar_data, bar_name, line_data, line_name, filepath, width=400, height=280):
     ensure_dir(filepath)
@@ -61,7 +105,7 @@ def save_combo_chart(categories, bar_data, bar_name, line_data, line_name, filep
     _apply_common_layout(fig, width, height)
     fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray', secondary_y=False)
     fig.update_yaxes(showgrid=False, secondary_y=True)
-    fig.write_image(filepath, scale=2)
+    _write_image(fig, filepath)
 
 def save_multi_line_chart(categories, series_dict, filepath, width=700, height=250):
     ensure_dir(filepath)
@@ -85,4 +129,52 @@ def save_multi_line_chart(categories, series_dict, filepath, width=700, height=2
             x=0.5
         )
     )
-    fig.write_image(filepath, scale=2)
+    _write_image(fig, filepath)
+
+CHART_FUNCTIONS = {
+    "bar": save_bar_chart,
+    "combo": save_combo_chart,
+    "multi_line": save_multi_line_chart,
+}
+
+def render_chart(kind, args, kwargs, filepath):
+    """
+    グラフ1枚（種類, 引数）を filepath に書き出して、かかった秒数を返す。
+    プロセスプールからも呼ぶのでモジュールの関数にしている
+    """
+    started = time.perf_counter()
+    CHART_FUNCTIONS[kind](*args, filepath=filepath, **kwargs)
+    return time.perf_counter() - started
+
+def chart_pool():
+    """グラフ書き出し用のプール（CHART_WORKERS=0 なら None）。ワーカー内で共有する"""
+    global _pool
+    if CHART_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            if CHART_POOL == 'process':
+                # fork だと親のスレッド（gunicorn・kaleido）の状態を引き継ぐので spawn にする
+                _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+            else:
+                _pool = ThreadPoolExecutor(max_workers=CHART_WORKERS, thread_name_prefix='chart')
+        return _pool
+
+def submit_chart(kind, args, kwargs, filepath):
+    """render_chart をプールに投げて Future（結果は秒数）を返す"""
+    pool = chart_pool()
+    if isinstance(pool, ThreadPoolExecutor):
+        return pool.submit(trace_utils.wrap(render_chart), kind, args, kwargs, filepath)
+    return pool.submit(render_chart, kind, args, kwargs, filepath)
+
+def warm_up():
+    """kaleido の Chromium を起動しておく（プロセスプールならワーカーの分も）"""
+    plotly_go.Figure(plotly_go.Bar(x=[1], y=[1])).to_image(format='png', width=10, height=10)
+    pool = chart_pool()
+    if isinstance(pool, ProcessPoolExecutor):
+        for future in [pool.submit(_warm_worker) for _ in range(CHART_WORKERS)]:
+            future.result()
+
+def _warm_worker():
+    plotly_go.Figure(plotly_go.Bar(x=[1], y=[1])).to_image(format='png', width=10, height=10)
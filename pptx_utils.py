@@ -0,0 +1,142 @@
+"""
+pptx_utils.py - 組み終わったスライドから順に .pptx（zip）へ書き出す（build_report.generate の stream=True）
+
+  writer = pptx_utils.StreamingWriter(prs, output_path)
+  for ...:
+      slide = prs.slides.add_slide(layout)
+      ...                      # スライドを組み立てる
+      writer.flush(slide)      # スライドと画像・グラフをzipに書き、メモリから外す
+  writer.close()               # 残り（presentation.xml・レイアウトなど）と [Content_Types].xml を書く
+
+prs.save は全スライドの lxml ツリーと画像を最後まで持ったまま書き出すので、
+デッキが大きいほど・同時に生成するレポートが多いほどメモリが増える。
+flush したパーツは、パーツ名・コンテンツタイプ・関係だけを持つ代わりのオブジェクトに置き換える
+（[Content_Types].xml と次のパーツ名の採番にはそれで足りる）。
+flush したスライドはそれ以降変更・削除しないこと（zip に書いた内容は戻せない）。
+"""
+import os
+import zipfile
+
+from pptx.opc.package import Part, _Relationship
+from pptx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from pptx.opc.oxml import serialize_part_xml
+from pptx.opc.serialized import _ContentTypesItem
+from pptx.parts.image import ImagePart
+
+# flush でスライドと一緒に書き出すパーツ（レイアウト・マスター・テーマは他のスライドと共有なので最後に書く）
+FLUSH_PREFIXES = ('/ppt/slides/', '/ppt/notesSlides/', '/ppt/charts/', '/ppt/embeddings/', '/ppt/media/')
+
+
+class _Written:
+    """書き出し済みのパーツの代わり。関係は元のパーツのものを引き継ぐ（子パーツの採番に使われる）"""
+
+    @property
+    def _rels(self):
+        return self._written_rels
+
+    @property
+    def blob(self):
+        raise RuntimeError(f"{self.partname} は書き出し済みです")
+
+
+class _WrittenPart(_Written, Part):
+
+    def __init__(self, part):
+        Part.__init__(self, part.partname, part.content_type, part.package)
+        self._written_rels = part.rels
+
+
+class _WrittenImagePart(_Written, ImagePart):
+    """画像は同じ画像の再利用（sha1 で探す）と add_picture の大きさの計算に使われるので、その分も残す"""
+
+    def __init__(self, part):
+        ImagePart.__init__(self, part.partname, part.content_type, part.package, None, part._filename)
+        self._written_rels = part.rels
+        self._sha1 = part.sha1
+        self._size = part._native_size
+
+    @property
+    def sha1(self):
+        return self._sha1
+
+    @property
+    def _native_size(self):
+        return self._size
+
+
+class StreamingWriter:
+    """スライド単位で .pptx に書き出す（pkg_file はパスかファイルオブジェクト）"""
+
+    def __init__(self, prs, pkg_file):
+        self.package = prs.part.package
+        self.pkg_file = pkg_file
+        self._zip = zipfile.ZipFile(pkg_file, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._written = set()
+        self.parts_written = 0
+        self.bytes_written = 0
+
+    def flush(self, slide):
+        """スライドと、そこから参照している画像・グラフ（埋め込みの xlsx を含む）を書き出してメモリから外す"""
+        stubs = {}
+        self._flush_part(slide.part, stubs)
+        if stubs:
+            self._replace_parts(stubs)
+
+    def close(self):
+        """まだ書いていないパーツとパッケージの関係・[Content_Types].xml を書いて閉じる"""
+        parts = list(self.package.iter_parts())
+        for part in parts:
+            if part.partname not in self._written:
+                self._write_part(part)
+        # [Content_Types].xml は全パーツが決まってから書くので zip の末尾になる（OPC では順序は問わない）
+        self._write(PACKAGE_URI.rels_uri, self.package._rels.xml)
+        self._write(CONTENT_TYPES_URI, serialize_part_xml(_ContentTypesItem.xml_for(parts)))
+        self._zip.close()
+
+    def abort(self):
+        """途中で失敗したときに閉じて、書きかけのファイルを消す"""
+        self._zip.close()
+        if isinstance(self.pkg_file, (str, os.PathLike)):
+            try:
+                os.remove(self.pkg_file)
+            except FileNotFoundError:
+                pass
+
+    def _flush_part(self, part, stubs):
+        if part.partname in self._written or not part.partname.startswith(FLUSH_PREFIXES):
+            return
+        # スライド ⇔ ノートのように循環する関係があるので先に印をつける
+        self._written.add(part.partname)
+        for rel in part.rels.values():
+            if not rel.is_external:
+                self._flush_part(rel.target_part, stubs)
+        self._write_part(part)
+        stubs[part] = _WrittenImagePart(part) if isinstance(part, ImagePart) else _WrittenPart(part)
+
+    def _write_part(self, part):
+        self._write(part.partname, part.blob)
+        if part.rels:
+            self._write(part.partname.rels_uri, part.rels.xml)
+        self.parts_written += 1
+
+    def _write(self, pack_uri, blob):
+        self._zip.writestr(pack_uri.membername, blob)
+        self.bytes_written += len(blob)
+
+    def _replace_parts(self, stubs):
+        """パッケージ内の関係の参照先を書き出し済みの代わりのオブジェクトに付け替える"""
+        visited = set()
+
+        def walk(rels):
+            for rId, rel in list(rels.items()):
+                if rel.is_external:
+                    continue
+                target = rel.target_part
+                if target in stubs:
+                    target = stubs[target]
+                    rels._rels[rId] = _Relationship(rel._base_uri, rId, rel.reltype, rel._target_mode, target)
+                if target not in visited:
+                    visited.add(target)
+                    walk(target.rels)
+
+        walk(self.package._rels)
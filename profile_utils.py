@@ -0,0 +1,229 @@
+"""
+profile_utils.py - 遅いリクエストのプロファイルを取る（既定は無効・PROFILING_ENABLED=1 で有効）
+
+  明示指定 : X-Profile: 1 ヘッダーか ?profile=1（値に cprofile を指定すると cProfile）
+  自動     : PROFILE_SLOW_MS を超えたリクエストをサンプリングの結果から保存する
+取ったプロファイルは PROFILE_DIR に保存し、PROFILE_MAX_FILES 件を超えたら古いものから消す。
+
+sample   : 共有のサンプラースレッドが PROFILE_SAMPLE_INTERVAL_MS ごとにスタックを記録する。
+           リクエストのスレッドに加えて、trace_utils.wrap で同じトレースを引き継いだ
+           ワーカースレッド（GA4 の並列取得など）も含める。
+           保存形式は collapsed stack（.folded。flamegraph.pl / speedscope でそのまま開ける）
+cprofile : cProfile で関数ごとの呼び出し回数・時間を取る（.prof。pstats / snakeviz で開ける）。
+           リクエストのスレッドだけが対象で、オーバーヘッドが大きいので明示指定のときだけ使う
+"""
+import cProfile
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+import trace_utils
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+# これを超えたリクエストは明示指定がなくても保存する（0 で自動保存しない）
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+MODES = ('sample', 'cprofile')
+EXTENSIONS = {'sample': '.folded', 'cprofile': '.prof'}
+CAPTURE_NAME_RE = re.compile(r'^[0-9a-zA-Z_.-]+\.(folded|prof)$')
+
+_lock = threading.Lock()
+_active = set()
+_sampler = None
+_save_lock = threading.Lock()
+
+
+class Capture:
+    """1リクエスト分のプロファイル"""
+
+    def __init__(self, route, method, mode, explicit, trace_id=None):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.route = route
+        self.method = method
+        self.mode = mode
+        self.explicit = explicit
+        self.trace_id = trace_id
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.samples = Counter()
+        self.profiler = None
+
+    @property
+    def filename(self):
+        return self.id + EXTENSIONS[self.mode]
+
+
+def requested_mode(headers, args):
+    """ヘッダー / クエリでの明示指定（'sample' / 'cprofile'、指定なしは None）"""
+    value = (headers.get(PROFILE_HEADER) or args.get(PROFILE_PARAM) or '').strip().lower()
+    if value in ('', '0', 'false', 'no'):
+        return None
+    return value if value in MODES else 'sample'
+
+
+def start(route, method, headers, args, trace_id=None):
+    """
+    リクエストの開始時に呼ぶ。プロファイルを取る場合は Capture を返す（取らない場合は None）。
+    明示指定がなくても PROFILE_SLOW_MS が設定されていればサンプリングだけしておく
+    """
+    if not PROFILING_ENABLED:
+        return None
+    mode = requested_mode(headers, args)
+    if mode is None and PROFILE_SLOW_MS <= 0:
+        return None
+    capture = Capture(route, method, mode or 'sample', explicit=mode is not None, trace_id=trace_id)
+    if capture.mode == 'cprofile':
+        capture.profiler = cProfile.Profile()
+        try:
+            capture.profiler.enable()
+        except ValueError:
+            # 別のプロファイラが動いているスレッドではサンプリングにする
+            capture.profiler = None
+            capture.mode = 'sample'
+    if capture.mode == 'sample':
+        _start_sampling(capture)
+    return capture
+
+
+def finish(capture, status=None, error=None):
+    """リクエストの終了時に呼ぶ。明示指定か PROFILE_SLOW_MS 超えなら保存してファイル名を返す"""
+    elapsed_ms = (time.perf_counter() - capture.started) * 1000
+    if capture.profiler is not None:
+        capture.profiler.disable()
+    else:
+        with _lock:
+            _active.discard(capture)
+    if not capture.explicit and elapsed_ms < PROFILE_SLOW_MS:
+        return None
+    try:
+        return _save(capture, elapsed_ms, status, error)
+    except OSError as e:
+        print(f"profile save Error: {e}")
+        return None
+
+
+# ============================================================
+# サンプリング
+# ============================================================
+def _start_sampling(capture):
+    global _sampler
+    with _lock:
+        _active.add(capture)
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = threading.Thread(target=_sample_loop, name='profile-sampler', daemon=True)
+            _sampler.start()
+
+
+def _sample_loop():
+    global _sampler
+    interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+    while True:
+        with _lock:
+            captures = list(_active)
+            if not captures:
+                # 次に開始されたときにまたスレッドを作る
+                _sampler = None
+                return
+        frames = sys._current_frames()
+        workers = trace_utils.thread_trace_ids()
+        for capture in captures:
+            frame = frames.get(capture.thread_id)
+            if frame is not None:
+                capture.samples[_collapse(frame, 'request')] += 1
+            for ident, trace_id in workers.items():
+                if trace_id == capture.trace_id and ident != capture.thread_id and ident in frames:
+                    capture.samples[_collapse(frames[ident], 'worker')] += 1
+        del frames
+        time.sleep(interval)
+
+
+def _collapse(frame, root):
+    """スタックを collapsed stack 形式の1行（root;外側の関数;...;内側の関数）にする"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(root)
+    return ';'.join(reversed(names))
+
+
+# ============================================================
+# 保存・一覧
+# ============================================================
+def _save(capture, elapsed_ms, status, error):
+    with _save_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, capture.filename)
+        if capture.mode == 'cprofile':
+            capture.profiler.dump_stats(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in capture.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        meta = {
+            "name": capture.filename,
+            "route": capture.route,
+            "method": capture.method,
+            "mode": capture.mode,
+            "trigger": "explicit" if capture.explicit else "slow",
+            "duration_ms": round(elapsed_ms, 1),
+            "status": status,
+            "error": str(error) if error else None,
+            "samples": sum(capture.samples.values()) if capture.mode == 'sample' else None,
+            "trace_id": capture.trace_id,
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        }
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        _prune()
+    return capture.filename
+
+
+def _prune():
+    """PROFILE_MAX_FILES 件を超えた古いプロファイルを消す（ファイル名の先頭が日時なので名前順で判断する）"""
+    metas = sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith('.json')), reverse=True)
+    for meta_name in metas[PROFILE_MAX_FILES:]:
+        for name in (meta_name, meta_name[:-len('.json')]):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name))
+            except FileNotFoundError:
+                pass
+
+
+def list_captures():
+    """保存済みのプロファイルのメタデータ（新しい順）"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    captures = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                meta = json.load(f)
+            meta["size"] = os.path.getsize(path[:-len('.json')])
+        except (OSError, ValueError):
+            continue
+        captures.append(meta)
+    return sorted(captures, key=lambda m: m["name"], reverse=True)
+
+
+def capture_path(name):
+    """ダウンロード用のパス（不正な名前・存在しない場合は None）"""
+    if not CAPTURE_NAME_RE.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
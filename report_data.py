@@ -0,0 +1,236 @@
+"""
+report_data.py - GA4/GSC/Ads の取得結果を build_report.load_data のスキーマに整形する
+
+  ga4_monthly        : 月別の全体指標・流入元5分類・商圏/問合せ/デバイス・内訳（古い月→新しい月）
+  gsc_monthly        : 月別のGSC全体指標とクエリTop（古い月→新しい月）
+  gsc_area_monthly   : 商圏クエリ実績（新しい月→古い月）
+  traffic_sources_*  : 当月/前月の参照元/メディア別セッション（前月差分つき）
+  area_traffic_*     : 当月/前月の商圏内 市区町村×参照元/メディア別セッション
+  page_metrics_*     : 当月/前月のページ別指標
+  ads_*              : /ads/performance と同じ形式
+"""
+from collections import defaultdict
+
+# 流入元5分類の判定に使う medium / source
+ORGANIC_MEDIUMS = {"organic"}
+CPC_MEDIUMS = {"cpc", "ppc", "paidsearch", "paid_search", "display", "cpm"}
+DIRECT_SOURCES = {"(direct)"}
+SOCIAL_MEDIUMS = {"social", "sns", "social-network", "social-media", "sm"}
+SOCIAL_SOURCES = {
+    "facebook", "m.facebook.com", "l.facebook.com", "instagram", "l.instagram.com",
+    "twitter", "t.co", "x.com", "line", "youtube", "tiktok", "pinterest",
+}
+
+DEFAULT_INQUIRY_PATHS = ["/contact"]
+
+
+def ym_label(ym):
+    """'2025-01' → '2025年1月'"""
+    parts = ym.split('-')
+    return f"{parts[0]}年{int(parts[1])}月" if len(parts) == 2 else ym
+
+def ym_short(ym):
+    """'2025-01' → '1月'"""
+    parts = ym.split('-')
+    return f"{int(parts[1])}月" if len(parts) == 2 else ym
+
+def format_duration(seconds):
+    seconds = int(round(seconds or 0))
+    return f"{seconds // 60}分{seconds % 60:02d}秒"
+
+def pct(part, total, digits=1):
+    return round(part / total * 100, digits) if total else 0.0
+
+def classify_channel(source, medium):
+    """参照元/メディアを organic / cpc / direct / referral / social の5分類に振り分ける"""
+    source = (source or "").lower()
+    medium = (medium or "").lower()
+    if source in DIRECT_SOURCES:
+        return "direct"
+    if medium in CPC_MEDIUMS:
+        return "cpc"
+    if medium in SOCIAL_MEDIUMS or source in SOCIAL_SOURCES:
+        return "social"
+    if medium in ORGANIC_MEDIUMS:
+        return "organic"
+    if medium == "referral":
+        return "referral"
+    return "direct" if medium in ("(none)", "(not set)", "") else "referral"
+
+def area_city_names(areas):
+    """'埼玉県 川口市' のような商圏指定から市区町村名を取り出す（/gsc/area_queries と同じ規則）"""
+    cities = []
+    for a in areas:
+        parts = a.split()
+        city = parts[-1] if len(parts) > 1 else a
+        if city:
+            cities.append(city)
+    return cities
+
+
+def _group_by_month(rows):
+    grouped = defaultdict(list)
+    for r in rows:
+        grouped[r["year_month"]].append(r)
+    return grouped
+
+def _with_deltas(cur_rows, prev_rows, key_fn, ym, limit):
+    """当月の行に前月差分を付けて上位limit件を返す"""
+    prev_map = {key_fn(r): r for r in prev_rows}
+    out = []
+    for r in sorted(cur_rows, key=lambda x: x["sessions"], reverse=True)[:limit]:
+        p = prev_map.get(key_fn(r))
+        out.append({
+            **r,
+            "ym": ym_label(ym),
+            "sessions_delta": r["sessions"] - p["sessions"] if p else None,
+            "total_users_delta": r["total_users"] - p["total_users"] if p else None,
+        })
+    return out
+
+def _source_medium_rows(city_sources, area_cities=None):
+    """月別×都市×流入元 を 月→(市区町村,参照元/メディア) ごとに集計する"""
+    agg = defaultdict(lambda: defaultdict(lambda: {"sessions": 0, "total_users": 0}))
+    for r in city_sources:
+        if area_cities is not None and r["city"] not in area_cities:
+            continue
+        city = r["city"] if area_cities is not None else None
+        a = agg[r["year_month"]][(city, f"{r['source']} / {r['medium']}")]
+        a["sessions"] += r["sessions"]
+        a["total_users"] += r["users"]
+    out = {}
+    for ym, entries in agg.items():
+        rows = []
+        for (city, source_medium), v in entries.items():
+            row = {"source_medium": source_medium, **v}
+            if city is not None:
+                row["city"] = city
+            rows.append(row)
+        out[ym] = rows
+    return out
+
+
+def shape_ga4_monthly(ga4, key_events=None, area_cities=(), inquiry_paths=None):
+    """fetch_ga4_monthly の結果を ga4_monthly（月ごとのdict・古い月→新しい月）に整形する"""
+    inquiry_paths = inquiry_paths or DEFAULT_INQUIRY_PATHS
+    area_cities = set(area_cities)
+    pages_by_month = _group_by_month(ga4.get("monthly_pages", []))
+    cities_by_month = _group_by_month(ga4.get("monthly_cities", []))
+    devices_by_month = _group_by_month(ga4.get("monthly_devices", []))
+    city_sources_by_month = _group_by_month(ga4.get("monthly_city_sources", []))
+    key_events_by_month = _group_by_month(key_events or [])
+
+    ga4_monthly = []
+    for m in ga4.get("monthly_summary", []):
+        ym = m["year_month"]
+        sessions = m["sessions"]
+
+        channels = {"organic": 0, "cpc": 0, "direct": 0, "referral": 0, "social": 0}
+        for r in city_sources_by_month.get(ym, []):
+            channels[classify_channel(r["source"], r["medium"])] += r["sessions"]
+
+        area_by_city = [
+            {"city": c["city"], "sessions": c["sessions"]}
+            for c in cities_by_month.get(ym, []) if c["city"] in area_cities
+        ]
+        area_sessions = sum(c["sessions"] for c in area_by_city)
+
+        inquiry_details = [
+            {"path": p["page_path"], "views": p["pageviews"]}
+            for p in pages_by_month.get(ym, [])
+            if any(p["page_path"].startswith(prefix) for prefix in inquiry_paths)
+        ]
+        inquiry_views = sum(p["views"] for p in inquiry_details)
+
+        device_sessions = {d["device"]: d["sessions"] for d in devices_by_month.get(ym, [])}
+
+        ke = key_events_by_month.get(ym, [])
+        ga4_monthly.append({
+            "ym": ym_label(ym),
+            "ym_short": ym_short(ym),
+            "sessions": sessions,
+            "users": m["active_users"],
+            "pvs": m["pageviews"],
+            "bounce": round(m["bounce_rate"] * 100, 1),
+            "duration": format_duration(m["average_session_duration"]),
+            **channels,
+            "area_sessions": area_sessions,
+            "area_rate": pct(area_sessions, sessions),
+            "inquiry_views": inquiry_views,
+            "inquiry_rate": pct(inquiry_views, sessions),
+            "mobile": pct(device_sessions.get("mobile", 0), sessions),
+            "desktop": pct(device_sessions.get("desktop", 0), sessions),
+            "inquiry_details": inquiry_details,
+            "area_by_city": area_by_city,
+            "key_events": {
+                "total": sum(e["count"] for e in ke),
+                "details": [{"event_name": e["event_name"], "count": e["count"]} for e in ke],
+            },
+        })
+    return ga4_monthly
+
+def shape_period_breakdowns(ga4, area_cities=(), limit=10):
+    """当月/前月の流入元・商圏内流入・ページ別指標（traffic_sources_1st 等）を作る"""
+    months = [m["year_month"] for m in ga4.get("monthly_summary", [])]
+    city_sources = ga4.get("monthly_city_sources", [])
+    sources = _source_medium_rows(city_sources)
+    area_sources = _source_medium_rows(city_sources, set(area_cities))
+    pages_by_month = _group_by_month(ga4.get("monthly_pages", []))
+
+    out = {}
+    for suffix, idx in (("1st", -1), ("2nd", -2)):
+        if len(months) < -idx:
+            continue
+        ym = months[idx]
+        prev_ym = months[idx - 1] if len(months) >= 1 - idx else None
+        out[f"traffic_sources_{suffix}"] = _with_deltas(
+            sources.get(ym, []), sources.get(prev_ym, []),
+            lambda r: r["source_medium"], ym, limit)
+        out[f"area_traffic_{suffix}"] = _with_deltas(
+            area_sources.get(ym, []), area_sources.get(prev_ym, []),
+            lambda r: (r["city"], r["source_medium"]), ym, limit + 5)
+        out[f"page_metrics_{suffix}"] = [{
+            "ym": ym_label(ym),
+            "page_path": p["page_path"],
+            "pageviews": p["pageviews"],
+            "duration": format_duration(p["avg_session_duration"]),
+            "total_users": p["users"],
+        } for p in sorted(pages_by_month.get(ym, []), key=lambda x: x["pageviews"], reverse=True)[:limit]]
+    return out
+
+def shape_gsc_monthly(monthly_summary, monthly_queries):
+    """fetch_gsc_monthly の結果を gsc_monthly（古い月→新しい月）に整形する"""
+    queries_by_month = _group_by_month(monthly_queries)
+    return [{
+        "ym": ym_label(m["year_month"]),
+        "ym_short": ym_short(m["year_month"]),
+        "clicks": m["clicks"],
+        "impressions": m["impressions"],
+        "ctr": m["ctr"],
+        "position": m["position"],
+        "queries": [{
+            "query": q["query"], "clicks": q["clicks"], "imps": q["impressions"],
+            "ctr": q["ctr"], "pos": q["position"],
+        } for q in queries_by_month.get(m["year_month"], [])],
+    } for m in monthly_summary]
+
+def shape_gsc_area_monthly(area_queries):
+    """fetch_gsc_area_queries の結果（新しい月→古い月）に ym_short を付ける"""
+    return [{**m, "ym_short": ym_short(m["year_month"])} for m in area_queries]
+
+def shape_report_data(ga4=None, key_events=None, gsc=None, gsc_area=None, ads=None,
+                      area_cities=(), inquiry_paths=None, report_fields=None):
+    """各APIの取得結果から generate() にそのまま渡せるdictを組み立てる"""
+    d = {}
+    if ga4:
+        d["ga4_monthly"] = shape_ga4_monthly(ga4, key_events, area_cities, inquiry_paths)
+        d.update(shape_period_breakdowns(ga4, area_cities))
+    if gsc:
+        d["gsc_monthly"] = shape_gsc_monthly(*gsc)
+    if gsc_area:
+        d["gsc_area_monthly"] = shape_gsc_area_monthly(gsc_area)
+    if ads:
+        d.update(ads)
+    # 店舗名・期間・CV実績・分析コメントなどAPIから取れない項目は呼び出し元の値で上書き
+    d.update(report_fields or {})
+    return d
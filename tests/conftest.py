@@ -0,0 +1,40 @@
+"""
+上流APIを benchmarks/synth_data.py のスタブに差し替えて、ネットワークなしでテストする。
+  prop : 合成データ（scale=small）
+  api  : スタブを入れた ga4_api（GA4 レポートのキャッシュは無効）
+  client : api.app.test_client()
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import synth_data
+
+
+@pytest.fixture(scope="session")
+def prop():
+    return synth_data.SyntheticProperty("small")
+
+
+@pytest.fixture
+def api(prop, monkeypatch):
+    import ga4_api
+
+    # install は ga4_api のモジュール変数を書き換えるので、テストごとに元に戻す
+    for name in ("SERVICE_ACCOUNT_JSON", "DEFAULT_PROPERTY_ID", "GSC_REFRESH_TOKEN", "GSC_CLIENT_ID",
+                 "GSC_CLIENT_SECRET", "GOOGLE_ADS_REFRESH_TOKEN", "GOOGLE_ADS_CLIENT_ID",
+                 "GOOGLE_ADS_CLIENT_SECRET", "GOOGLE_ADS_DEVELOPER_TOKEN", "GOOGLE_ADS_LOGIN_CUSTOMER_ID",
+                 "create_ga4_client", "_ga4_client", "create_gsc_service"):
+        monkeypatch.setattr(ga4_api, name, getattr(ga4_api, name))
+    monkeypatch.setattr(ga4_api.ga4_report_cache, "ttl", 0)
+    return synth_data.install(prop)
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
@@ -0,0 +1,59 @@
+import pytest
+
+import format_utils
+from synth_data import PROPERTY_ID
+
+
+def test_round_trip():
+    rows = [
+        {"month": "2025-01", "city": "川口市", "sessions": 120, "rate": 0.5},
+        {"month": "2025-01", "city": None, "sessions": 80, "rate": None},
+        {"month": "2025-02", "city": "川口市", "sessions": 0, "rate": 0.25},
+    ]
+    table = format_utils.to_columnar(rows)
+
+    assert table["length"] == 3
+    assert table["columns"] == ["month", "city", "sessions", "rate"]
+    assert table["data"]["city"] == {"dictionary": ["川口市"], "codes": [0, -1, 0]}
+    assert table["data"]["sessions"] == [120, 80, 0]
+    assert format_utils.from_columnar(table) == rows
+
+
+def test_round_trip_fills_missing_keys_with_none():
+    rows = [{"a": "x"}, {"b": 1}]
+    table = format_utils.to_columnar(rows)
+    assert table["columns"] == ["a", "b"]
+    assert format_utils.from_columnar(table) == [{"a": "x", "b": None}, {"a": None, "b": 1}]
+
+
+def test_mixed_column_is_not_dictionary_encoded():
+    rows = [{"v": "1"}, {"v": 1}]
+    assert format_utils.to_columnar(rows)["data"]["v"] == ["1", 1]
+    assert format_utils.from_columnar(format_utils.to_columnar(rows)) == rows
+
+
+def test_empty():
+    assert format_utils.from_columnar(format_utils.to_columnar([])) == []
+
+
+def test_columnar_route_matches_json(client, prop):
+    url = f"/ga4/monthly?property_id={PROPERTY_ID}&start_date={prop.start_date}&end_date={prop.end_date}"
+    expected = client.get(url).get_json()
+    columnar = client.get(url + "&format=columnar").get_json()
+
+    assert columnar.keys() == expected.keys()
+    for key, value in expected.items():
+        if format_utils.is_record_list(value):
+            assert format_utils.from_columnar(columnar[key]) == value, key
+        else:
+            assert columnar[key] == value, key
+
+
+def test_arrow_section(client, prop):
+    pa = pytest.importorskip("pyarrow")
+    url = f"/ga4/monthly?property_id={PROPERTY_ID}&start_date={prop.start_date}&end_date={prop.end_date}"
+    expected = client.get(url).get_json()["monthly_cities"]
+    resp = client.get(url + "&format=arrow&section=monthly_cities")
+
+    assert resp.mimetype == format_utils.ARROW_MIMETYPE
+    assert pa.ipc.open_stream(resp.get_data()).read_all().to_pylist() == expected
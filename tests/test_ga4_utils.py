@@ -0,0 +1,426 @@
+import pytest
+
+import ga4_utils
+import synth_data
+from ga4_utils import ReportSpec, TTLCache
+
+
+@pytest.fixture
+def batch_fn(prop):
+    """synth_data のスタブに batch_run_reports で投げる batch_fn（呼び出しごとのリクエストを calls に残す）"""
+    from google.analytics.data_v1beta.types import BatchRunReportsRequest
+
+    client = synth_data.StubGA4Client(prop)
+
+    def batch_fn(requests):
+        batch_fn.calls.append(requests)
+        request = BatchRunReportsRequest(property=f"properties/{synth_data.PROPERTY_ID}", requests=requests)
+        return client.batch_run_reports(request).reports
+
+    batch_fn.calls = []
+    return batch_fn
+
+
+CITY_SPEC = ReportSpec(
+    "cities", ["yearMonth", "city"], ["sessions"], order_bys=["yearMonth", "-sessions"], paginate=True,
+    fields=[("month", "yearMonth", ga4_utils.format_year_month), ("city", "city"), ("sessions", "sessions")])
+SUMMARY_SPEC = ReportSpec(
+    "summary", ["yearMonth"], ["sessions", "engagementRate"], order_bys=["yearMonth"],
+    fields=[("month", "yearMonth"), ("sessions", "sessions"), ("engagementRate", "engagementRate")])
+
+
+# ============================================================
+# TTLCache
+# ============================================================
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ga4_utils.time, "monotonic", clock)
+    return clock
+
+
+def test_cache_expires(clock):
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    clock.now += 9
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a") is None
+    assert not cache._data
+
+
+def test_cache_disabled():
+    cache = TTLCache(ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_cache_evicts_oldest_over_maxsize():
+    cache = TTLCache(ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert [cache.get(k) for k in "abc"] == [None, 2, 3]
+
+
+def test_cache_evicts_oldest_over_maxrows():
+    cache = TTLCache(ttl=60, maxrows=100)
+    cache.set("a", 1, rows=40)
+    cache.set("b", 2, rows=40)
+    cache.set("c", 3, rows=40)
+    assert [cache.get(k) for k in "abc"] == [None, 2, 3]
+    assert cache.rows == 80
+    # 上書きは古い方の行数を差し引く
+    cache.set("b", 4, rows=10)
+    assert cache.rows == 50
+    assert cache.get("b") == 4
+
+
+def test_cache_skips_value_larger_than_maxrows():
+    cache = TTLCache(ttl=60, maxrows=100)
+    cache.set("a", 1, rows=50)
+    cache.set("big", 2, rows=101)
+    assert cache.get("big") is None
+    assert cache.get("a") == 1
+    assert cache.rows == 50
+
+
+def test_cache_rows_released_on_expiry(clock):
+    cache = TTLCache(ttl=10, maxrows=100)
+    cache.set("a", 1, rows=60)
+    clock.now += 11
+    assert cache.get("a") is None
+    assert cache.rows == 0
+
+
+# ============================================================
+# run_specs / iter_specs
+# ============================================================
+def test_run_specs_batches_and_caches(prop, batch_fn):
+    cache = TTLCache(ttl=60)
+    date_ranges = [(prop.start_date, prop.end_date)]
+    first = ga4_utils.run_specs([CITY_SPEC, SUMMARY_SPEC], date_ranges, batch_fn, cache=cache)
+    assert [len(reqs) for reqs in batch_fn.calls] == [2]
+    assert len(first[0]["cities"]) == len(prop.months(prop.start_date, prop.end_date)) * len(prop.cities)
+
+    second = ga4_utils.run_specs([CITY_SPEC, SUMMARY_SPEC], date_ranges, batch_fn, cache=cache)
+    assert len(batch_fn.calls) == 1
+    assert second == first
+
+
+def test_run_specs_paginates(prop, batch_fn):
+    date_ranges = [(prop.start_date, prop.end_date)]
+    whole, = ga4_utils.run_specs([CITY_SPEC], date_ranges, batch_fn)
+    paged, = ga4_utils.run_specs([CITY_SPEC], date_ranges, batch_fn, page_size=7)
+    assert paged == whole
+    offsets = [req.offset for reqs in batch_fn.calls[1:] for req in reqs]
+    assert offsets == list(range(0, len(whole["cities"]), 7))
+
+
+def test_iter_specs_matches_run_specs(prop, batch_fn):
+    date_ranges = [(prop.start_date, prop.end_date)]
+    expected, = ga4_utils.run_specs([CITY_SPEC, SUMMARY_SPEC], date_ranges, batch_fn)
+    streamed = {"cities": [], "summary": []}
+    for i, name, row in ga4_utils.iter_specs([CITY_SPEC, SUMMARY_SPEC], date_ranges, batch_fn, page_size=7, prefetch=2):
+        assert i == 0
+        streamed[name].append(row)
+    assert streamed == expected
+
+
+def test_iter_specs_stops_fetching_when_closed(prop, batch_fn):
+    rows = ga4_utils.iter_specs([CITY_SPEC], [(prop.start_date, prop.end_date)], batch_fn, page_size=5, prefetch=2)
+    next(rows)
+    rows.close()
+    # 1ページ目と先読みの2ページ分まで（残りのページは取得しない）
+    assert len(batch_fn.calls) <= 3
+
+
+# ============================================================
+# 比較期間（dateRange で分割）
+# ============================================================
+def test_split_date_ranges():
+    from array import array
+
+    cols = ga4_utils.GA4Columns(
+        ["city", "dateRange"], ["sessions"],
+        {"city": ["a", "b", "a"], "dateRange": ["date_range_1", "date_range_0", "date_range_0"],
+         "sessions": array("q", [1, 2, 3])}, 3, 3)
+    current, previous, empty = cols.split_date_ranges(3)
+
+    assert current.dimension_names == ["city"]
+    assert list(current.rows()) == [("b", 2), ("a", 3)]
+    assert list(previous.rows()) == [("a", 1)]
+    assert previous["sessions"].typecode == "q"
+    assert len(empty) == 0 and list(empty.rows()) == []
+
+
+def test_compare_range_is_one_request(prop, batch_fn):
+    current = (prop.start_date, prop.end_date)
+    previous = ("2024-10-01", "2024-12-31")
+    both = ga4_utils.run_specs([CITY_SPEC, SUMMARY_SPEC], [current, previous], batch_fn)
+
+    # limit の無いレポートは両方の期間を1リクエストに入れる
+    assert [len(req.date_ranges) for reqs in batch_fn.calls for req in reqs] == [2, 2]
+    assert both[0] == ga4_utils.run_specs([CITY_SPEC, SUMMARY_SPEC], [current], batch_fn)[0]
+    assert both[1] == ga4_utils.run_specs([CITY_SPEC, SUMMARY_SPEC], [previous], batch_fn)[0]
+
+
+def test_compare_range_with_limit_is_one_request_per_range(prop, batch_fn):
+    top = CITY_SPEC.replace(name="top", limit=5, paginate=False)
+    current = (prop.start_date, prop.end_date)
+    previous = ("2024-10-01", "2024-12-31")
+    both = ga4_utils.run_specs([top], [current, previous], batch_fn)
+
+    assert [[r.start_date for r in req.date_ranges] for req in batch_fn.calls[0]] == [[current[0]], [previous[0]]]
+    assert [len(result["top"]) for result in both] == [5, 5]
+
+
+def test_too_many_date_ranges():
+    with pytest.raises(ValueError):
+        ga4_utils.run_specs([SUMMARY_SPEC], [("2025-01-01", "2025-01-31")] * 5, lambda requests: [])
+
+
+# ============================================================
+# PivotSpec
+# ============================================================
+CITY_PIVOT = ga4_utils.PivotSpec("city_sessions", "city", "sessions", row_limit=5, row_key="city",
+                                 column_format=ga4_utils.format_year_month)
+
+
+def pivot_response(row_values, col_values, cells):
+    """pivot_headers と (行, 列, 値) のセルから RunPivotReportResponse を作る"""
+    from google.analytics.data_v1beta.types import RunPivotReportResponse
+
+    pb = RunPivotReportResponse.pb()()
+    pb.dimension_headers.add(name="city")
+    pb.dimension_headers.add(name="yearMonth")
+    pb.metric_headers.add(name="sessions")
+    for values in (row_values, col_values):
+        header = pb.pivot_headers.add()
+        for v in values:
+            header.pivot_dimension_headers.add().dimension_values.add(value=v)
+    for r, c, v in cells:
+        row = pb.rows.add()
+        row.dimension_values.add(value=r)
+        row.dimension_values.add(value=c)
+        row.metric_values.add(value=str(v))
+    return RunPivotReportResponse.wrap(pb)
+
+
+def test_pivot_shape_empty_response():
+    from google.analytics.data_v1beta.types import RunPivotReportResponse
+
+    assert CITY_PIVOT.shape(RunPivotReportResponse()) == {"columns": [], "rows": []}
+
+
+def test_pivot_shape_headers_without_rows():
+    assert CITY_PIVOT.shape(pivot_response([], [], [])) == {"columns": [], "rows": []}
+    assert CITY_PIVOT.shape(pivot_response(["川口市"], ["202501"], [])) == {
+        "columns": ["2025-01"], "rows": [{"city": "川口市", "2025-01": 0, "total": 0}]}
+
+
+def test_pivot_shape_fills_missing_cells():
+    shaped = CITY_PIVOT.shape(pivot_response(
+        ["川口市", "草加市"], ["202501", "202502"],
+        [("川口市", "202501", 10), ("川口市", "202502", 5), ("草加市", "202502", 3), ("蕨市", "202501", 99)]))
+    assert shaped == {
+        "columns": ["2025-01", "2025-02"],
+        "rows": [
+            {"city": "川口市", "2025-01": 10, "2025-02": 5, "total": 15},
+            {"city": "草加市", "2025-01": 0, "2025-02": 3, "total": 3},
+        ],
+    }
+
+
+def test_run_pivot_specs(prop):
+    from google.analytics.data_v1beta.types import BatchRunPivotReportsRequest
+
+    client = synth_data.StubGA4Client(prop)
+    calls = []
+
+    def batch_fn(requests):
+        calls.append(requests)
+        return client.batch_run_pivot_reports(BatchRunPivotReportsRequest(requests=requests)).pivot_reports
+
+    cache = TTLCache(ttl=60)
+    result = ga4_utils.run_pivot_specs([CITY_PIVOT], (prop.start_date, prop.end_date), batch_fn, cache=cache)
+    pivot = result["city_sessions"]
+    months = prop.months(prop.start_date, prop.end_date)
+
+    assert pivot["columns"] == months
+    assert len(pivot["rows"]) == 5
+    assert all(row["total"] == sum(row[m] for m in months) for row in pivot["rows"])
+    assert ga4_utils.run_pivot_specs([CITY_PIVOT], (prop.start_date, prop.end_date), batch_fn, cache=cache) == result
+    assert len(calls) == 1
+
+
+# ============================================================
+# リクエストの組み立て・フィルタ・月ごとの上位N件
+# ============================================================
+def test_build_request():
+    spec = ReportSpec("pages", ["yearMonth", "pagePath"], ["screenPageViews"],
+                      order_bys=["yearMonth", "-screenPageViews"],
+                      dimension_filter=ga4_utils.string_filter("pagePath", "/works/", "BEGINS_WITH"))
+    req = spec.build_request([("2025-01-01", "2025-01-31")], limit=100, offset=200)
+
+    assert [(r.start_date, r.end_date) for r in req.date_ranges] == [("2025-01-01", "2025-01-31")]
+    assert [d.name for d in req.dimensions] == ["yearMonth", "pagePath"]
+    assert [m.name for m in req.metrics] == ["screenPageViews"]
+    assert (req.limit, req.offset) == (100, 200)
+    first, second = req.order_bys
+    assert (first.dimension.dimension_name, first.desc) == ("yearMonth", False)
+    assert (second.metric.metric_name, second.desc) == ("screenPageViews", True)
+    f = req.dimension_filter.filter
+    assert (f.field_name, f.string_filter.value, f.string_filter.match_type.name) == ("pagePath", "/works/", "BEGINS_WITH")
+
+
+def test_build_request_without_filter():
+    req = SUMMARY_SPEC.build_request([("2025-01-01", "2025-01-31")])
+    assert "dimension_filter" not in req
+    assert req.limit == 0
+
+
+def test_apply_filters():
+    cities = ga4_utils.in_list_filter("city", ["川口市", "草加市"])
+    pages = ga4_utils.string_filter("pagePath", "/works/", "BEGINS_WITH")
+
+    # 関係のないディメンションのフィルタは付けない
+    assert ga4_utils.apply_filters(SUMMARY_SPEC, [cities, pages]) is SUMMARY_SPEC
+    filtered = ga4_utils.apply_filters(CITY_SPEC, [cities, pages])
+    assert filtered.dimension_filter == cities
+    assert CITY_SPEC.dimension_filter is None
+
+    # 既存のフィルタとは AND でつなぐ
+    existing = ga4_utils.string_filter("city", "(not set)")
+    both = ga4_utils.apply_filters(CITY_SPEC.replace(dimension_filter=existing), [cities])
+    assert both.dimension_filter == {"and_group": {"expressions": [existing, cities]}}
+    req = both.build_request([("2025-01-01", "2025-01-31")])
+    assert [e.filter.field_name for e in req.dimension_filter.and_group.expressions] == ["city", "city"]
+
+
+def test_per_month_limit(prop, batch_fn):
+    top = CITY_SPEC.replace(name="top", limit=3, per_month=True, paginate=False)
+    result, = ga4_utils.run_specs([top], [(prop.start_date, prop.end_date)], batch_fn)
+
+    months = prop.months(prop.start_date, prop.end_date)
+    reqs = [req for reqs in batch_fn.calls for req in reqs]
+    assert [(r.date_ranges[0].start_date[:7], r.limit) for r in reqs] == [(m, 3) for m in months]
+    assert [row["month"] for row in result["top"]] == [m for m in months for _ in range(3)]
+
+
+def test_monthly_route_sends_filters(client, prop, api, monkeypatch):
+    stub = api.get_ga4_client()
+    sent = []
+    batch_run_reports = stub.batch_run_reports
+
+    def record(request, **kwargs):
+        sent.extend(request.requests)
+        return batch_run_reports(request, **kwargs)
+
+    monkeypatch.setattr(stub, "batch_run_reports", record)
+    resp = client.get(f"/ga4/monthly?property_id={synth_data.PROPERTY_ID}&start_date={prop.start_date}"
+                      f"&end_date={prop.end_date}&cities=川口市,草加市&top_cities_per_month=2")
+    assert resp.status_code == 200
+
+    by_dims = {}
+    for req in sent:
+        by_dims.setdefault(tuple(d.name for d in req.dimensions), []).append(req)
+    assert all("dimension_filter" not in req for req in by_dims[("yearMonth",)])
+    city_reqs = by_dims[("yearMonth", "city")]
+    assert len(city_reqs) == len(prop.months(prop.start_date, prop.end_date))
+    for req in city_reqs:
+        assert req.limit == 2
+        assert list(req.dimension_filter.filter.in_list_filter.values) == ["川口市", "草加市"]
+
+
+def test_monthly_route_rejects_bad_top_n(client, prop):
+    resp = client.get(f"/ga4/monthly?property_id={synth_data.PROPERTY_ID}&start_date={prop.start_date}"
+                      f"&end_date={prop.end_date}&top_cities_per_month=0")
+    assert resp.status_code == 400
+
+
+# ============================================================
+# 検証
+# ============================================================
+@pytest.fixture
+def metadata(prop):
+    return ga4_utils.compact_metadata(prop.ga4_metadata(f"properties/{synth_data.PROPERTY_ID}/metadata"))
+
+
+def test_validate_specs_accepts_known_names(metadata):
+    ga4_utils.validate_specs([CITY_SPEC, SUMMARY_SPEC, CITY_PIVOT], metadata)
+
+
+@pytest.mark.parametrize("spec, message", [
+    (ReportSpec("x", ["yearMonth", "customEvent:shop"], ["sessions"]), "ディメンション customEvent:shop"),
+    (ReportSpec("x", ["yearMonth"], ["sessions", "conversions"]), "指標 conversions"),
+    (ReportSpec("x", ["citty"], ["sesions"]), "ディメンション citty / 指標 sesions"),
+    (ga4_utils.PivotSpec("x", "region", "sessions", row_limit=5), "ディメンション region"),
+])
+def test_validate_specs_rejects_unknown_names(metadata, spec, message):
+    with pytest.raises(ga4_utils.InvalidReportError, match=message) as e:
+        ga4_utils.validate_specs([SUMMARY_SPEC, spec], metadata)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize("property_id", ["", None, "properties/123", "12a", " 123"])
+def test_validate_property_id(property_id):
+    with pytest.raises(ga4_utils.InvalidReportError):
+        ga4_utils.validate_property_id(property_id)
+
+
+@pytest.mark.parametrize("start_date, end_date", [
+    ("2025-01-01", "2025-13-01"), ("2025-02-30", "2025-03-01"), ("2025/01/01", "2025-01-31"),
+    ("2025-02-01", "2025-01-31"), ("yesterday", "7daysAgo"), ("last_month", "today"), ("", "today"),
+])
+def test_validate_date_range_rejects(start_date, end_date):
+    with pytest.raises(ga4_utils.InvalidReportError):
+        ga4_utils.validate_date_range(start_date, end_date)
+
+
+@pytest.mark.parametrize("start_date, end_date", [
+    ("2025-01-01", "2025-01-01"), ("30daysAgo", "yesterday"), ("2025-01-01", "today"),
+])
+def test_validate_date_range_accepts(start_date, end_date):
+    ga4_utils.validate_date_range(start_date, end_date)
+
+
+@pytest.mark.parametrize("query", [
+    "property_id=abc&start_date=2025-01-01&end_date=2025-01-31",
+    "property_id=123456789&start_date=2025-02-01&end_date=2025-01-31",
+    "property_id=123456789&start_date=2025-01-01&end_date=2025-01-31&cities=川口市&sources=google&page_path_regex=(",
+])
+def test_monthly_route_rejects_before_upstream(client, api, monkeypatch, query):
+    monkeypatch.setattr(api, "get_ga4_client", lambda: pytest.fail("GA4 を呼んだ"))
+    resp = client.get(f"/ga4/monthly?{query}")
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
+
+
+def test_unknown_property_is_404_and_cached(client, prop, api, monkeypatch):
+    from google.api_core.exceptions import NotFound
+
+    monkeypatch.setattr(api, "ga4_metadata_cache", TTLCache(60))
+    monkeypatch.setattr(api, "ga4_metadata_error_cache", TTLCache(60))
+    stub = api.get_ga4_client()
+    calls = []
+
+    def get_metadata(name=None, **kwargs):
+        calls.append(name)
+        raise NotFound("property not found")
+
+    monkeypatch.setattr(stub, "get_metadata", get_metadata)
+    url = f"/ga4/monthly?property_id=999&start_date={prop.start_date}&end_date={prop.end_date}"
+    for _ in range(2):
+        resp = client.get(url)
+        assert resp.status_code == 404
+        assert "999" in resp.get_json()["error"]
+    assert calls == ["properties/999/metadata"]
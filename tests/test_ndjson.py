@@ -0,0 +1,72 @@
+import json
+
+from synth_data import PROPERTY_ID
+
+
+def monthly_url(prop, **params):
+    query = {"property_id": PROPERTY_ID, "start_date": prop.start_date, "end_date": prop.end_date, **params}
+    return "/ga4/monthly?" + "&".join(f"{k}={v}" for k, v in query.items())
+
+
+def read_lines(resp):
+    body = resp.get_data(as_text=True)
+    # 1行 = 1 JSON で、最後の行も改行で終わる
+    assert body.endswith("\n")
+    lines = body[:-1].split("\n")
+    return [json.loads(line) for line in lines]
+
+
+def test_ndjson_framing(client, prop):
+    resp = client.get(monthly_url(prop, format="ndjson"))
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    lines = read_lines(resp)
+
+    meta, rows, end = lines[0], lines[1:-1], lines[-1]
+    assert meta["type"] == "meta"
+    assert meta["property_id"] == PROPERTY_ID
+    assert all(line["type"] == "row" for line in rows)
+    assert end == {"type": "end", "success": True, "counts": end["counts"]}
+    assert list(end["counts"]) == meta["sections"]
+    assert sum(end["counts"].values()) == len(rows)
+
+
+def test_ndjson_rows_match_json(client, prop):
+    lines = read_lines(client.get(monthly_url(prop, format="ndjson")))
+    expected = client.get(monthly_url(prop)).get_json()
+
+    streamed = {section: [] for section in lines[0]["sections"]}
+    for line in lines[1:-1]:
+        streamed[line["section"]].append(line["row"])
+    for section, rows in streamed.items():
+        assert rows == expected[section], section
+
+
+def test_ndjson_compare_sections(client, prop):
+    lines = read_lines(client.get(monthly_url(
+        prop, format="ndjson", compare_start_date=prop.start_date, compare_end_date=prop.start_date)))
+    sections = lines[0]["sections"]
+    assert lines[0]["compare_start_date"] == prop.start_date
+    assert sections[len(sections) // 2:] == ["compare_" + s for s in sections[:len(sections) // 2]]
+    assert {line["section"] for line in lines[1:-1]} <= set(sections)
+
+
+def test_ndjson_error_after_headers(client, prop, api, monkeypatch):
+    """途中で失敗したら最後の行が error になる（ステータスは 200 のまま）"""
+    def iter_ga4_monthly(*args, **kwargs):
+        yield api.GA4_MONTHLY_SECTIONS[0], {"month": "2025-01"}
+        raise RuntimeError("upstream failed")
+
+    monkeypatch.setattr(api, "iter_ga4_monthly", iter_ga4_monthly)
+    resp = client.get(monthly_url(prop, format="ndjson"))
+    lines = read_lines(resp)
+
+    assert resp.status_code == 200
+    assert [line["type"] for line in lines] == ["meta", "row", "error"]
+    assert lines[-1] == {"type": "error", "success": False, "error": "upstream failed"}
+
+
+def test_ndjson_validation_error_is_400(client, prop):
+    resp = client.get(monthly_url(prop, format="ndjson", start_date="2025-13-01"))
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
@@ -0,0 +1,117 @@
+import io
+import zipfile
+
+import pytest
+from PIL import Image
+from pptx import Presentation
+from pptx.chart.data import CategoryChartData
+from pptx.enum.chart import XL_CHART_TYPE
+from pptx.util import Inches
+
+import pptx_utils
+
+
+def png(color):
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buf, "PNG")
+    buf.seek(0)
+    return buf
+
+
+def build(prs, slides, on_slide=None):
+    """画像（2枚目以降は同じ画像を再利用）とグラフ、ノートを持つスライドを slides 枚作る"""
+    for i in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        slide.shapes.title.text = f"スライド {i + 1}"
+        slide.shapes.add_picture(png("red"), Inches(1), Inches(1))
+        slide.shapes.add_picture(png((0, 0, i * 10)), Inches(3), Inches(1))
+        data = CategoryChartData()
+        data.categories = ["1月", "2月", "3月"]
+        data.add_series("セッション", (i, i + 1, i + 2))
+        slide.shapes.add_chart(XL_CHART_TYPE.COLUMN_CLUSTERED, Inches(1), Inches(3), Inches(4), Inches(3), data)
+        slide.notes_slide.notes_text_frame.text = f"ノート {i + 1}"
+        if on_slide:
+            on_slide(slide)
+
+
+def summarize(source):
+    prs = Presentation(source)
+    return [
+        (slide.shapes.title.text,
+         [shape.image.sha1 for shape in slide.shapes if shape.shape_type == 13],
+         [list(shape.chart.plots[0].series[0].values) for shape in slide.shapes if shape.has_chart],
+         slide.notes_slide.notes_text_frame.text)
+        for slide in prs.slides
+    ]
+
+
+def test_streamed_deck_matches_save(tmp_path):
+    expected = Presentation()
+    build(expected, 5)
+    expected_path = tmp_path / "saved.pptx"
+    expected.save(expected_path)
+
+    prs = Presentation()
+    path = tmp_path / "streamed.pptx"
+    writer = pptx_utils.StreamingWriter(prs, str(path))
+    build(prs, 5, writer.flush)
+    writer.close()
+
+    assert summarize(path) == summarize(expected_path)
+    with zipfile.ZipFile(path) as streamed, zipfile.ZipFile(expected_path) as saved:
+        assert streamed.testzip() is None
+        assert sorted(streamed.namelist()) == sorted(saved.namelist())
+        # 同じ画像は1回だけ書く
+        assert len([n for n in streamed.namelist() if n.startswith("ppt/media/")]) == 6
+    assert writer.parts_written > 0 and writer.bytes_written > 0
+
+
+def test_flushed_parts_are_released(tmp_path):
+    prs = Presentation()
+    writer = pptx_utils.StreamingWriter(prs, io.BytesIO())
+    build(prs, 2, writer.flush)
+
+    parts = {str(p.partname): p for p in prs.part.package.iter_parts()}
+    assert isinstance(parts["/ppt/slides/slide1.xml"], pptx_utils._WrittenPart)
+    assert isinstance(parts["/ppt/media/image1.png"], pptx_utils._WrittenImagePart)
+    with pytest.raises(RuntimeError, match="書き出し済み"):
+        parts["/ppt/slides/slide1.xml"].blob
+    writer.close()
+
+
+def test_file_object_output():
+    prs = Presentation()
+    buf = io.BytesIO()
+    writer = pptx_utils.StreamingWriter(prs, buf)
+    build(prs, 2, writer.flush)
+    writer.close()
+    assert len(Presentation(io.BytesIO(buf.getvalue())).slides) == 2
+
+
+def test_abort_removes_file(tmp_path):
+    prs = Presentation()
+    path = tmp_path / "partial.pptx"
+    writer = pptx_utils.StreamingWriter(prs, str(path))
+    build(prs, 1, writer.flush)
+    writer.abort()
+    assert not path.exists()
+
+
+def slide_texts(path):
+    return [[shape.text_frame.text for shape in slide.shapes if shape.has_text_frame]
+            for slide in Presentation(path).slides]
+
+
+def test_generate_stream_matches_save(api, prop, tmp_path):
+    """合成データのレポートを stream=True / False で作ると同じスライドになる"""
+    import bench_suite
+    import build_report
+    import synth_data
+
+    template = str(tmp_path / "template.pptx")
+    bench_suite.make_stub_template(template)
+    data = synth_data.report_input(prop)
+    build_report.generate(data, template, str(tmp_path / "streamed.pptx"), stream=True)
+    build_report.generate(data, template, str(tmp_path / "saved.pptx"))
+
+    assert slide_texts(tmp_path / "streamed.pptx") == slide_texts(tmp_path / "saved.pptx")
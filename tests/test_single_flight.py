@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+
+class CountingDict(dict):
+    """_inflight の代わり。get で実行中の Future を見つけた回数を数える"""
+
+    def __init__(self):
+        super().__init__()
+        self.joined = threading.Semaphore(0)
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        if value is not None:
+            self.joined.release()
+        return value
+
+
+@pytest.fixture
+def inflight(api, monkeypatch):
+    inflight = CountingDict()
+    monkeypatch.setattr(api, "_inflight", inflight)
+    return inflight
+
+
+def run_concurrently(api, inflight, key, fetch, followers=3):
+    """
+    1本目の fetch が走っている間に followers 本が同じ key で single_flight に入るようにして、
+    全員の (結果, 例外) を返す
+    """
+    started = threading.Event()
+    release = threading.Event()
+    outcomes = [None] * (followers + 1)
+
+    def leader_fetch():
+        started.set()
+        release.wait(5)
+        return fetch()
+
+    def run(i, fn):
+        try:
+            outcomes[i] = (api.single_flight(key, fn), None)
+        except Exception as e:
+            outcomes[i] = (None, e)
+
+    threads = [threading.Thread(target=run, args=(0, leader_fetch))]
+    threads[0].start()
+    assert started.wait(5)
+    threads += [threading.Thread(target=run, args=(i, fetch)) for i in range(1, followers + 1)]
+    for t in threads[1:]:
+        t.start()
+    for _ in range(followers):
+        assert inflight.joined.acquire(timeout=5)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return outcomes
+
+
+def test_concurrent_calls_share_one_upstream_call(api, inflight):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"rows": [1, 2, 3]}
+
+    outcomes = run_concurrently(api, inflight, ("test", "share"), fetch)
+
+    assert len(calls) == 1
+    assert all(error is None and result is outcomes[0][0] for result, error in outcomes)
+    assert not inflight
+
+
+def test_error_is_raised_to_every_waiter(api, inflight):
+    error = RuntimeError("upstream failed")
+
+    def fetch():
+        raise error
+
+    outcomes = run_concurrently(api, inflight, ("test", "error"), fetch)
+
+    assert [e for _, e in outcomes] == [error] * 4
+    assert not inflight
+    # 失敗は残さない（次の呼び出しは上流に行く）
+    assert api.single_flight(("test", "error"), lambda: "ok") == "ok"
+
+
+def test_sequential_calls_are_not_shared(api):
+    values = iter([1, 2])
+    assert api.single_flight(("test", "seq"), lambda: next(values)) == 1
+    assert api.single_flight(("test", "seq"), lambda: next(values)) == 2
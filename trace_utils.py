@@ -0,0 +1,204 @@
+"""
+trace_utils.py - リクエスト単位の軽量トレース（OpenTelemetry 互換の JSON スパン）
+
+  with trace_utils.span('ga4.batch_run_reports', kind='client', attributes={'reports': 5}):
+      ...
+スパンの親子関係はスレッドごとのスタックで持つ。ThreadPoolExecutor に渡す関数は
+trace_utils.wrap(fn) で包むと、呼び出し元のスパンを親として引き継ぐ。
+
+書き出し先は TRACE_EXPORTER で選ぶ（未設定なら記録だけして書き出さない）。
+  console : 標準エラーに1行1件
+  file    : TRACE_FILE（既定 traces.jsonl）に追記
+1行は OTLP/JSON の ExportTraceServiceRequest（resourceSpans）なので、
+OpenTelemetry Collector の otlpjsonfile レシーバーなどでそのまま読める。
+受け取った traceparent ヘッダー（W3C Trace Context）があればそのトレースを続ける。
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', '')
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'ga4-api')
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+# OTLP の SpanKind / StatusCode
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_local = threading.local()
+# wrap で親スパンを引き継いで実行中のスレッド → trace_id（profile_utils のサンプラーが参照する）
+_thread_traces = {}
+_export_lock = threading.Lock()
+_export_file = None
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'status_message')
+
+    def __init__(self, name, trace_id, parent_id=None, kind='internal', attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = ''
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.status_message = f'{type(error).__name__}: {error}'
+
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS.get(self.kind, 1),
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.status_message} if self.status_message else {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    elif isinstance(value, (list, tuple)):
+        typed = {'arrayValue': {'values': [_otlp_attribute('', v)['value'] for v in value]}}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def current_span():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def parse_traceparent(header):
+    """traceparent ヘッダーから (trace_id, 親の span_id) を取り出す（不正なら None）"""
+    m = TRACEPARENT_RE.match((header or '').strip().lower())
+    if not m or m.group(1) == '0' * 32 or m.group(2) == '0' * 16:
+        return None
+    return m.group(1), m.group(2)
+
+
+def start_span(name, kind='internal', attributes=None, remote_parent=None):
+    """
+    スパンを開始して現在のスレッドのスタックに積む（end_span で閉じる）。
+    remote_parent: parse_traceparent の結果。指定するとそのトレースの子になる
+    """
+    parent = current_span()
+    if remote_parent:
+        trace_id, parent_id = remote_parent
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = f'{random.getrandbits(128):032x}', None
+    span = Span(name, trace_id, parent_id, kind, attributes)
+    _stack().append(span)
+    return span
+
+
+def end_span(span, error=None):
+    """スパンを閉じてスタックから外し、書き出す（閉じ忘れた子スパンもまとめて外す）"""
+    if span.end_ns is not None:
+        return
+    if error is not None:
+        span.set_error(error)
+    span.end_ns = time.time_ns()
+    stack = _stack()
+    if span in stack:
+        del stack[stack.index(span):]
+    if TRACE_EXPORTER:
+        export(span)
+
+
+@contextmanager
+def span(name, kind='internal', attributes=None):
+    """with ブロックをスパンとして記録する（例外で抜けたら status=ERROR）"""
+    s = start_span(name, kind, attributes)
+    try:
+        yield s
+    except BaseException as e:
+        s.set_error(e)
+        raise
+    finally:
+        end_span(s)
+
+
+def wrap(fn):
+    """呼び出し元のスパンを別スレッドでも親として使うように fn を包む"""
+    parent = current_span()
+    if parent is None:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        saved = getattr(_local, 'stack', None)
+        _local.stack = [parent]
+        ident = threading.get_ident()
+        _thread_traces[ident] = parent.trace_id
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.stack = saved
+            _thread_traces.pop(ident, None)
+
+    return run
+
+
+def thread_trace_ids():
+    """wrap した関数を実行中のスレッドの {スレッドID: trace_id}"""
+    return dict(_thread_traces)
+
+
+def export(span):
+    """TRACE_EXPORTER の書き出し先に1スパンを OTLP/JSON の1行で書く"""
+    global _export_file
+    line = json.dumps({'resourceSpans': [{
+        'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+        'scopeSpans': [{'scope': {'name': 'trace_utils'}, 'spans': [span.to_otlp()]}],
+    }]}, ensure_ascii=False)
+    with _export_lock:
+        if TRACE_EXPORTER == 'console':
+            print(line, file=sys.stderr, flush=True)
+        elif TRACE_EXPORTER == 'file':
+            if _export_file is None:
+                _export_file = open(TRACE_FILE, 'a', encoding='utf-8', buffering=1)
+            _export_file.write(line + '\n')